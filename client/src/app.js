@@ -64,7 +64,7 @@ function App() {
         </div>
       )}
       {currentPage === 'mainrec' && (
-        <MainRecPage filename={filename} />
+        <MainRecPage filename={filename} navigateToPage={navigateToPage} />
       )}
       {currentPage === 'about' && (
         <About />
@@ -1,40 +1,25 @@
 import React, { useState, useEffect, useRef } from 'react';
 
-function MainRecPage({ filename }) {
+function MainRecPage({ filename, navigateToPage }) {
   const [transcript, setTranscript] = useState('');
   const [imageUrl, setImageUrl] = useState('');
   const audioElementRef = useRef(null);
   const [title, setTitle] = useState('');
   const [category, setCategory] = useState('');
-  // Fetch image, transcript, and title data from the server based on the filename when it changes.
+  const [related, setRelated] = useState([]);
+  // Fetch image URL, transcript, title and category from the server in one request when the filename changes.
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const response = await fetch(`/images/${encodeURIComponent(filename)}`);
+        const response = await fetch(`/recording/${encodeURIComponent(filename)}`);
         if (response.ok) {
-          const category = response.headers.get('Category'); // Extract category from response headers
-          setCategory(category);
-          const imageUrl = URL.createObjectURL(await response.blob());
-          setImageUrl(imageUrl);
+          const data = await response.json();
+          setCategory(data.category || '');
+          setImageUrl(data.imageUrl || '');
+          setTitle(data.title);
+          setTranscript((data.transcript || '').replace(/"/g, ''));
         } else {
-          console.error('Error fetching image:', response.statusText);
-        }
-
-        const stmResponse = await fetch(`/get-stm?filename=${filename}`);
-        if (stmResponse.ok) {
-          const data = await stmResponse.text();
-          const cleanedTranscript = data.replace(/"/g, '');
-          setTranscript(cleanedTranscript);
-        } else {
-          console.error('Error fetching transcript:', stmResponse.statusText);
-        }
-
-        const titleResponse = await fetch(`/get-title?filename=${filename}`);
-        if (titleResponse.ok) {
-          const data = await titleResponse.text();
-          setTitle(data);
-        } else {
-          console.error('Error fetching title:', titleResponse.statusText);
+          console.error('Error fetching recording:', response.statusText);
         }
       } catch (error) {
         console.error('Error fetching data:', error);
@@ -42,12 +27,20 @@ function MainRecPage({ filename }) {
     };
 
     fetchData();
+  }, [filename]);
 
-    return () => {
-      if (imageUrl) {
-        URL.revokeObjectURL(imageUrl);
+  // Fetch the recordings with the most similar transcripts, so the listener can move on to a related talk.
+  useEffect(() => {
+    const fetchRelated = async () => {
+      try {
+        const response = await fetch(`/recording/${encodeURIComponent(filename)}/related?limit=5`);
+        setRelated(response.ok ? (await response.json()).related : []);
+      } catch (error) {
+        console.error('Error fetching related recordings:', error);
       }
     };
+
+    fetchRelated();
   }, [filename]);
   
   // Update the audio element's source to fetch the corresponding audio file based on the filename.
@@ -72,6 +65,18 @@ function MainRecPage({ filename }) {
       <div style={{ flex: 1, overflowY: 'auto' }}>
         <h2>{category && `${category}:`} {title}</h2>
         <p>{transcript}</p>
+        {related.length > 0 && (
+          <div>
+            <h3>Related talks</h3>
+            <ul>
+              {related.map(recording => (
+                <li key={recording.filename}>
+                  <a href="#" onClick={(event) => { event.preventDefault(); navigateToPage('mainrec', recording.filename); }}>{recording.title}</a>
+                </li>
+              ))}
+            </ul>
+          </div>
+        )}
       </div>
     </div>
   );
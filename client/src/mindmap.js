@@ -2,6 +2,15 @@ import React, { useState, useEffect, useRef } from 'react';
 import { v4 as uuidv4 } from 'uuid'; 
 import './app.css';
 
+// Whether the browser can show WebP, checked once. Atlases come in WebP and JPEG; browsers without WebP get the JPEG.
+const supportsWebp = (() => {
+  try {
+    return document.createElement('canvas').toDataURL('image/webp').startsWith('data:image/webp');
+  } catch (error) {
+    return false;
+  }
+})();
+
 function MindMap({ selectedCategories, navigateToPage }) {
   const [mindMapData, setMindMapData] = useState([]);
   const [centralImageUrl, setCentralImageUrl] = useState("");
@@ -10,66 +19,36 @@ function MindMap({ selectedCategories, navigateToPage }) {
   const defaultWidth = 800;
   const defaultHeight = 600;
   const clipPathIds = [];
-  //Fetch central image from server based on category(topic)
+  //Fetch the whole mind map (central image and subnodes with their images) for the selected categories in one request.
   useEffect(() => {
-    const fetchCentralImage = async () => {
-      if (selectedCategories.length > 0) {
-        const category = selectedCategories[0];
-        try {
-          const response = await fetch('/data/central-image', {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ categories: [category] }),
-          });
-          if (response.ok) {
-            const imageUrl = URL.createObjectURL(await response.blob());
-            setCentralImageUrl(imageUrl);
-          } else {
-            console.error('Error fetching central image:', response.statusText);
-          }
-        } catch (error) {
-          console.error('Error fetching central image:', error);
-        }
-      }
-    };
-
-    fetchCentralImage();
-  }, [selectedCategories]);
-
-  //Fetch image for subnodes, by fetching filename with help of selectied categories and then use it to fetch image.
-  useEffect(() => {
-    const fetchDataForCategory = async () => {
-      const nodes = [];
-      for (const category of selectedCategories) {
-        try {
-          const response = await fetch('/data/categories', {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ categories: [category] }),
-          });
-          const imageFilenames = await response.json();
-          const sanitizedFilenames = imageFilenames.map(filename => filename.replace('.stm', ''));
-          const categoryNodes = sanitizedFilenames.map(filename => ({
-            imageUrl: `/images/${encodeURIComponent(filename)}`,
-            filename: filename,
-            category: category,
-          }));
-          nodes.push(...categoryNodes);
-        } catch (error) {
-          console.error(`Error fetching images for category ${category}:`, error);
+    const fetchMindMap = async () => {
+      try {
+        // GET, so the browser can cache the response and revalidate it with its ETag
+        const params = new URLSearchParams(selectedCategories.map(category => ['categories', category]));
+        const response = await fetch(`/data/mindmap?${params}`);
+        if (response.ok) {
+          const data = await response.json();
+          const central = data.categories.find(category => category.centralImageUrl);
+          setCentralImageUrl(central ? central.centralImageUrl : "");
+          // Nodes with a sprite are drawn from their category's atlas, so all node images arrive in one request
+          const atlases = Object.fromEntries(data.categories.map(category => [category.category, category.atlas]));
+          setMindMapData(data.nodes.map(node => ({
+            ...node,
+            atlas: node.sprite ? atlases[node.category] : null,
+          })));
+        } else {
+          console.error('Error fetching mind map:', response.statusText);
         }
+      } catch (error) {
+        console.error('Error fetching mind map:', error);
       }
-      setMindMapData(nodes);
       setLoading(false);
     };
 
     if (selectedCategories.length > 0) {
-      fetchDataForCategory();
+      fetchMindMap();
     } else {
+      setCentralImageUrl("");
       setMindMapData([]);
       setLoading(false);
     }
@@ -117,7 +96,8 @@ function MindMap({ selectedCategories, navigateToPage }) {
       const x = centralNodeX + radius * Math.cos(angle);
       const y = centralNodeY + radius * Math.sin(angle);
       if (dataIndex < mindMapData.length) {
-        circles.push({ x, y, radius: circleRadius, imageUrl: mindMapData[dataIndex].imageUrl, isCentralNode: false });
+        const node = mindMapData[dataIndex];
+        circles.push({ x, y, radius: circleRadius, imageUrl: node.imageUrl, atlas: node.atlas, sprite: node.sprite, isCentralNode: false });
         dataIndex++;
       }
     }
@@ -180,14 +160,28 @@ function MindMap({ selectedCategories, navigateToPage }) {
                 stroke="black"
                 strokeWidth="2"
               />
-              <image
-                href={circle.imageUrl}
-                x={circle.x - circle.radius - minX + centralNodeRadius}
-                y={circle.y - circle.radius - minY + centralNodeRadius}
-                width={circle.radius * 2}
-                height={circle.radius * 2}
-                clipPath={`url(#${clipPathId})`}
-              />
+              {circle.atlas ? (
+                <g clipPath={`url(#${clipPathId})`}>
+                  <svg
+                    x={circle.x - circle.radius - minX + centralNodeRadius}
+                    y={circle.y - circle.radius - minY + centralNodeRadius}
+                    width={circle.radius * 2}
+                    height={circle.radius * 2}
+                    viewBox={`${circle.sprite[0]} ${circle.sprite[1]} ${circle.atlas.size} ${circle.atlas.size}`}
+                  >
+                    <image href={supportsWebp && circle.atlas.urls.webp ? circle.atlas.urls.webp : circle.atlas.urls.jpeg} width={circle.atlas.width} height={circle.atlas.height} />
+                  </svg>
+                </g>
+              ) : (
+                <image
+                  href={circle.imageUrl}
+                  x={circle.x - circle.radius - minX + centralNodeRadius}
+                  y={circle.y - circle.radius - minY + centralNodeRadius}
+                  width={circle.radius * 2}
+                  height={circle.radius * 2}
+                  clipPath={`url(#${clipPathId})`}
+                />
+              )}
             </g>
           );
         } else {
@@ -0,0 +1,88 @@
+import contextlib
+import hashlib
+import json
+import os
+
+from watchedindex import WatchedIndex
+
+# Function to turn a filename from selectedtopics.json ('SusanCain_2012.stm') into a recording id ('SusanCain_2012')
+def recording_id(filename):
+    return os.path.splitext(filename)[0] if filename.endswith('.stm') else filename
+
+# Immutable view of selectedtopics.json and maptitle.json, built once and shared by all requests.
+class CatalogSnapshot:
+    def __init__(self, topics, titles, version):
+        # category -> list of filenames, in file order
+        self.category_files = topics
+        self.categories = list(topics.keys())
+        # recording id -> list of categories the recording is assigned to
+        self.recording_categories = {}
+        for category, filenames in topics.items():
+            for filename in filenames:
+                self.recording_categories.setdefault(recording_id(filename), []).append(category)
+        # baseFileName -> {'title', 'event', 'published', 'duration', 'baseFileName'}
+        self.titles = {record['baseFileName']: record for record in titles}
+        # Content hash of both files, changes whenever the catalog does
+        self.version = version
+
+    # Function to get the title of a recording, falls back to the recording id
+    def title(self, recording):
+        record = self.titles.get(recording)
+        return record['title'] if record else recording
+
+    # Function to get the filenames of a category in file order, None for unknown categories
+    def files_in(self, category):
+        return self.category_files.get(category)
+
+    # Function to get the categories a recording is assigned to
+    def categories_of(self, recording):
+        return self.recording_categories.get(recording, [])
+
+    # Function to get the number of categories of every assigned recording: recording id -> count
+    def category_counts(self):
+        return {recording: len(categories) for recording, categories in self.recording_categories.items()}
+
+    # Function to get the distinct 'published' values of the recordings of every category: category -> list
+    def published_by_category(self):
+        published = {}
+        for category, filenames in self.category_files.items():
+            values = {self.titles[recording_id(filename)].get('published') for filename in filenames
+                      if recording_id(filename) in self.titles}
+            published[category] = [value for value in values if value is not None]
+        return published
+
+    # Function to get the maptitle.json record of a recording, None if it has none
+    def record(self, recording):
+        return self.titles.get(recording)
+
+    # Function to get the number of recordings of every category, in file order
+    def category_sizes(self):
+        return {category: len(filenames) for category, filenames in self.category_files.items()}
+
+    # Function to iterate over the maptitle.json records
+    def records(self):
+        return iter(self.titles.values())
+
+    # Function to run several lookups against this snapshot; it never changes, so there is nothing to hold
+    def read(self):
+        return contextlib.nullcontext(self)
+
+# Catalog that keeps the current CatalogSnapshot in memory and reloads it when either JSON file changes.
+class Catalog(WatchedIndex):
+    def __init__(self, topics_path, titles_path, **kwargs):
+        self.topics_path = topics_path
+        self.titles_path = titles_path
+        super().__init__([topics_path, titles_path], **kwargs)
+
+    def _build(self):
+        with open(self.topics_path, 'rb') as file:
+            topics_bytes = file.read()
+        with open(self.titles_path, 'rb') as file:
+            titles_bytes = file.read()
+        digest = hashlib.sha1(topics_bytes)
+        digest.update(titles_bytes)
+        return CatalogSnapshot(json.loads(topics_bytes), json.loads(titles_bytes), digest.hexdigest()[:16])
+
+    # Function to get the current snapshot
+    def snapshot(self):
+        return self.current()
@@ -0,0 +1,280 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+from catalog import recording_id
+from watchedindex import WatchedIndex
+
+# Fields of a maptitle.json record, in file order
+RECORD_FIELDS = ['published', 'event', 'title', 'duration', 'baseFileName']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    filename TEXT,
+    title TEXT,
+    event TEXT,
+    published TEXT,
+    duration TEXT,
+    title_position INTEGER
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    category_id INTEGER NOT NULL REFERENCES categories(id),
+    recording_id INTEGER NOT NULL REFERENCES recordings(id),
+    position INTEGER NOT NULL,
+    PRIMARY KEY (category_id, recording_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS assignments_by_recording ON assignments (recording_id, category_id);
+CREATE INDEX IF NOT EXISTS assignments_by_position ON assignments (category_id, position);
+CREATE INDEX IF NOT EXISTS recordings_by_name ON recordings (name);
+CREATE INDEX IF NOT EXISTS categories_by_position ON categories (position);
+CREATE INDEX IF NOT EXISTS recordings_by_title_position ON recordings (title_position);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+# Function to open the catalog database for writing, creating its tables. WAL lets the server keep reading
+# while a curation script writes.
+def open_database(database_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA foreign_keys=ON')
+    connection.executescript(SCHEMA)
+    return connection
+
+# Function to bump the catalog version inside a write transaction, the server drops its caches when it changes
+def bump_version(connection):
+    connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+# Function to get the id of a recording, adding the recording when it is new
+def recording_row(connection, filename):
+    name = recording_id(filename)
+    row = connection.execute('SELECT id FROM recordings WHERE name = ? ORDER BY id LIMIT 1', (name,)).fetchone()
+    if row:
+        connection.execute('UPDATE recordings SET filename = COALESCE(filename, ?) WHERE id = ?', (filename, row[0]))
+        return row[0]
+    return connection.execute('INSERT INTO recordings (name, filename) VALUES (?, ?)', (name, filename)).lastrowid
+
+# Function to add recordings to categories, creating categories that do not exist yet. Only the new rows are
+# written; recordings already in a category keep their place. Returns the filenames assigned to any category.
+def add_assignments(database_path, topics_to_files):
+    connection = open_database(database_path)
+    try:
+        with connection:
+            for category, filenames in topics_to_files.items():
+                row = connection.execute('SELECT id FROM categories WHERE name = ?', (category,)).fetchone()
+                if row:
+                    category_id = row[0]
+                else:
+                    category_id = connection.execute(
+                        'INSERT INTO categories (name, position) SELECT ?, COALESCE(MAX(position) + 1, 0) FROM categories',
+                        (category,)).lastrowid
+                position = connection.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM assignments WHERE category_id = ?',
+                                              (category_id,)).fetchone()[0]
+                for filename in filenames:
+                    inserted = connection.execute(
+                        'INSERT OR IGNORE INTO assignments (category_id, recording_id, position) VALUES (?, ?, ?)',
+                        (category_id, recording_row(connection, filename), position))
+                    position += inserted.rowcount
+            bump_version(connection)
+        return read_assigned_filenames(connection)
+    finally:
+        connection.close()
+
+# Function to get the filenames assigned to any category, e.g. to exclude them from the next clustering run
+def read_assigned_filenames(connection):
+    return {filename for (filename,) in connection.execute(
+        'SELECT DISTINCT r.filename FROM assignments a JOIN recordings r ON r.id = a.recording_id')}
+
+# Function to get the filenames assigned to any category of the catalog database
+def assigned_filenames(database_path):
+    connection = open_database(database_path)
+    try:
+        return read_assigned_filenames(connection)
+    finally:
+        connection.close()
+
+# Function to replace the catalog with the contents of selectedtopics.json and maptitle.json
+def import_json(database_path, topics_path, titles_path):
+    with open(topics_path, 'r', encoding='utf-8') as file:
+        topics = json.load(file)
+    with open(titles_path, 'r', encoding='utf-8') as file:
+        titles = json.load(file)
+
+    connection = open_database(database_path)
+    try:
+        with connection:
+            connection.execute('DELETE FROM assignments')
+            connection.execute('DELETE FROM categories')
+            connection.execute('DELETE FROM recordings')
+            connection.executemany(
+                'INSERT INTO recordings (name, title, event, published, duration, title_position) VALUES (?, ?, ?, ?, ?, ?)',
+                ((record['baseFileName'], record['title'], record.get('event'), record.get('published'), record.get('duration'), position)
+                 for position, record in enumerate(titles)))
+            for position, (category, filenames) in enumerate(topics.items()):
+                category_id = connection.execute('INSERT INTO categories (name, position) VALUES (?, ?)',
+                                                 (category, position)).lastrowid
+                rows = [(category_id, recording_row(connection, filename), file_position)
+                        for file_position, filename in enumerate(filenames)]
+                connection.executemany('INSERT OR IGNORE INTO assignments (category_id, recording_id, position) VALUES (?, ?, ?)', rows)
+            bump_version(connection)
+        recordings = connection.execute('SELECT COUNT(*) FROM recordings').fetchone()[0]
+        assignments = connection.execute('SELECT COUNT(*) FROM assignments').fetchone()[0]
+        print(f"Catalog import complete. {len(topics)} categories, {recordings} recordings and {assignments} assignments were imported.")
+    finally:
+        connection.close()
+
+# Function to write the catalog back to selectedtopics.json and maptitle.json, in the layout custom.py writes
+def export_json(database_path, topics_path, titles_path):
+    connection = open_database(database_path)
+    try:
+        topics = {}
+        for category, filename in connection.execute(
+                'SELECT c.name, r.filename FROM categories c LEFT JOIN assignments a ON a.category_id = c.id '
+                'LEFT JOIN recordings r ON r.id = a.recording_id ORDER BY c.position, a.position'):
+            files = topics.setdefault(category, [])
+            if filename is not None:
+                files.append(filename)
+        titles = [dict(zip(RECORD_FIELDS, row)) for row in connection.execute(
+            'SELECT published, event, title, duration, name FROM recordings WHERE title IS NOT NULL ORDER BY title_position, id')]
+    finally:
+        connection.close()
+
+    for path, data in ((topics_path, topics), (titles_path, titles)):
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=4)
+        os.replace(path + '.tmp', path)
+    print(f"Catalog export complete. {len(topics)} categories and {len(titles)} titles were exported.")
+
+# Read-only view of the catalog database. It holds no catalog data itself, every lookup is an indexed query
+# against the database as it is now; lookups that must agree with each other run inside read(). Offers the same
+# lookups as CatalogSnapshot.
+class DatabaseSnapshot:
+    def __init__(self, store, version):
+        self.store = store
+        # Changes with every write, 'db-<n>' so it never equals a JSON catalog version
+        self.version = version
+
+    def _query(self, sql, parameters=()):
+        return self.store.connection().execute(sql, parameters)
+
+    @property
+    def categories(self):
+        return [name for (name,) in self._query('SELECT name FROM categories ORDER BY position')]
+
+    # Function to get the title of a recording, falls back to the recording id
+    def title(self, recording):
+        row = self._query('SELECT title FROM recordings WHERE name = ?', (recording,)).fetchone()
+        return row[0] if row and row[0] is not None else recording
+
+    # Function to get the filenames of a category in file order, None for unknown categories
+    def files_in(self, category):
+        row = self._query('SELECT id FROM categories WHERE name = ?', (category,)).fetchone()
+        if row is None:
+            return None
+        return [filename for (filename,) in self._query(
+            'SELECT r.filename FROM assignments a JOIN recordings r ON r.id = a.recording_id '
+            'WHERE a.category_id = ? ORDER BY a.position', (row[0],))]
+
+    # Function to get the categories a recording is assigned to
+    def categories_of(self, recording):
+        return [name for (name,) in self._query(
+            'SELECT c.name FROM recordings r JOIN assignments a ON a.recording_id = r.id '
+            'JOIN categories c ON c.id = a.category_id WHERE r.name = ? ORDER BY c.position', (recording,))]
+
+    # Function to get the number of categories of every assigned recording: recording id -> count, in one query
+    def category_counts(self):
+        return dict(self._query('SELECT r.name, COUNT(*) FROM recordings r JOIN assignments a ON a.recording_id = r.id '
+                                'GROUP BY r.name'))
+
+    # Function to get the distinct 'published' values of the recordings of every category: category -> list,
+    # in one query
+    def published_by_category(self):
+        published = {}
+        for category, value in self._query(
+                'SELECT c.name, r.published FROM categories c JOIN assignments a ON a.category_id = c.id '
+                'JOIN recordings r ON r.id = a.recording_id WHERE r.published IS NOT NULL GROUP BY c.id, r.published'):
+            published.setdefault(category, []).append(value)
+        return published
+
+    # Function to get the maptitle.json record of a recording, None if it has none
+    def record(self, recording):
+        row = self._query('SELECT published, event, title, duration, name FROM recordings WHERE name = ? AND title IS NOT NULL',
+                          (recording,)).fetchone()
+        return dict(zip(RECORD_FIELDS, row)) if row else None
+
+    # Function to get the number of recordings of every category, in file order
+    def category_sizes(self):
+        return dict(self._query('SELECT c.name, COUNT(a.recording_id) FROM categories c '
+                                'LEFT JOIN assignments a ON a.category_id = c.id GROUP BY c.id ORDER BY c.position'))
+
+    # Function to iterate over the maptitle.json records
+    def records(self):
+        for row in self._query('SELECT published, event, title, duration, name FROM recordings '
+                               'WHERE title IS NOT NULL ORDER BY title_position, id'):
+            yield dict(zip(RECORD_FIELDS, row))
+
+    # Function to run several lookups against one state of the database. They share a read transaction on this
+    # thread's connection, so a write committed half-way through is not seen by the later lookups. Nested calls
+    # join the outer transaction.
+    @contextmanager
+    def read(self):
+        connection = self.store.connection()
+        if connection.in_transaction:
+            yield self
+            return
+        connection.execute('BEGIN')
+        try:
+            yield self
+        finally:
+            connection.commit()
+
+# Catalog backed by the SQLite database. Each thread reads through its own read-only connection; a new snapshot
+# (a new version) is taken when a write touches the database or its WAL file.
+class CatalogStore(WatchedIndex):
+    def __init__(self, database_path, **kwargs):
+        self.database_path = database_path
+        self._local = threading.local()
+        super().__init__([database_path, database_path + '-wal'], **kwargs)
+
+    # Function to get this thread's connection, reopened in forked worker processes
+    def connection(self):
+        cached = getattr(self._local, 'connection', None)
+        if cached is None or cached[0] != os.getpid():
+            uri = 'file:' + os.path.abspath(self.database_path) + '?mode=ro'
+            cached = (os.getpid(), sqlite3.connect(uri, uri=True, check_same_thread=False))
+            self._local.connection = cached
+        return cached[1]
+
+    def _build(self):
+        try:
+            row = self.connection().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        except sqlite3.Error as error:
+            raise ValueError(f"Catalog database could not be read: {error}") from error
+        return DatabaseSnapshot(self, f"db-{row[0] if row else 0}")
+
+    # Function to get the current snapshot
+    def snapshot(self):
+        return self.current()
+
+if __name__ == '__main__':
+    # Usage: python catalogdb.py import|export [selectedtopics.json] [maptitle.json] [catalog.db]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'import'
+    topics_path = sys.argv[2] if len(sys.argv) > 2 else '../data/mappedtopics/selectedtopics.json'
+    titles_path = sys.argv[3] if len(sys.argv) > 3 else '../data/mappedtopics/maptitle.json'
+    database_path = sys.argv[4] if len(sys.argv) > 4 else '../data/mappedtopics/catalog.db'
+    if command == 'import':
+        import_json(database_path, topics_path, titles_path)
+    elif command == 'export':
+        export_json(database_path, topics_path, titles_path)
+    else:
+        raise SystemExit("Usage: python catalogdb.py import|export [selectedtopics.json] [maptitle.json] [catalog.db]")
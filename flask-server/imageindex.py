@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+
+from catalog import recording_id
+from watchedindex import WatchedIndex
+
+# Lookup tables over the generated images. Node images are named '{category}_{filename}.png'
+# (scripts/imagegeneration/novitaaipt3_5.py) and central images '{category}_M.png'
+# (scripts/imagegeneration/novitaaimaintopics.py). Category names never contain '_'.
+class ImageSnapshot:
+    def __init__(self, files):
+        # recording id -> list of (image file, category), sorted by file name
+        self.recordings = {}
+        # lowercased category -> central image file
+        self.central = {}
+        for file in sorted(files):
+            if not file.endswith('.png'):
+                continue
+            name = file[:-len('.png')]
+            if name.endswith('_M') and '_' not in name[:-2]:
+                self.central[name[:-2].lower()] = file
+                continue
+            category, separator, filename = name.partition('_')
+            if separator and filename:
+                self.recordings.setdefault(recording_id(filename), []).append((file, category))
+
+    # Function to get (image file, category) for a recording id, optionally preferring a category
+    def image_for(self, recording, category=None):
+        images = self.recordings.get(recording)
+        if not images:
+            return None
+        if category:
+            for image in images:
+                if image[1].lower() == category.lower():
+                    return image
+        return images[0]
+
+    # Function to get the central image file of a category
+    def central_image_for(self, category):
+        return self.central.get(category.lower())
+
+# Index over IMAGE_PATH, rebuilt when files are added to or removed from the directory.
+class ImageIndex(WatchedIndex):
+    def __init__(self, image_path, **kwargs):
+        self.image_path = image_path
+        # image file -> (mtime_ns, size, content hash), filled lazily and kept across rebuilds
+        self._hashes = {}
+        # Number of image files read to compute a content hash
+        self.hash_reads = 0
+        # Number of image files found rewritten in place with new content. Writing a file over an old one leaves the
+        # directory, and so the snapshot, unchanged; responses holding image URLs depend on this count as well.
+        self.hash_changes = 0
+        super().__init__([image_path], **kwargs)
+
+    def _build(self):
+        try:
+            files = os.listdir(self.image_path)
+        except FileNotFoundError:
+            files = []
+        return ImageSnapshot(files)
+
+    # Function to get the current snapshot
+    def snapshot(self):
+        return self.current()
+
+    # Function to get a short content hash of an image file, used as a cache-busting version in image URLs
+    def content_hash(self, image_file):
+        path = os.path.join(self.image_path, image_file)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self._hashes.get(image_file)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 16), b''):
+                digest.update(block)
+        content_hash = digest.hexdigest()[:12]
+        self.hash_reads += 1
+        if cached and cached[2] != content_hash:
+            self.hash_changes += 1
+        self._hashes[image_file] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        return content_hash
+
+# Thumbnails and per-category atlases listed in the manifest written by scripts/imagegeneration/thumbnails.py.
+class DerivedImageSnapshot:
+    def __init__(self, manifest):
+        self.thumbnail_sizes = sorted(manifest.get('thumbnail_sizes', []))
+        self.images = manifest.get('images', {})
+        # lowercased category -> {size -> atlas entry with sprite positions keyed by recording id}
+        self.atlases = {}
+        for category, sizes in manifest.get('atlases', {}).items():
+            for size, atlas in sizes.items():
+                self.atlases.setdefault(category.lower(), {})[int(size)] = {
+                    "size": int(size),
+                    "width": atlas['width'],
+                    "height": atlas['height'],
+                    "files": atlas['files'],
+                    "sprites": {recording_id(image_file[len(category) + 1:-len('.png')]): position
+                                for image_file, position in atlas['sprites'].items()},
+                }
+
+    # Function to get the derived file of an image closest to (and not smaller than) the requested size
+    def thumbnail_for(self, image_file, size, image_format):
+        entry = self.images.get(image_file)
+        if not entry or not self.thumbnail_sizes:
+            return None
+        fitting = [thumbnail_size for thumbnail_size in self.thumbnail_sizes if thumbnail_size >= size]
+        chosen = fitting[0] if fitting else self.thumbnail_sizes[-1]
+        return entry['variants'].get(str(chosen), {}).get(image_format)
+
+    # Function to get the atlas of a category at a sprite size, None if the thumbnail stage has not built it
+    def atlas_for(self, category, size):
+        return self.atlases.get(category.lower(), {}).get(size)
+
+# Index over the derived images manifest, reloaded when the thumbnail stage rewrites it.
+class DerivedImageIndex(WatchedIndex):
+    def __init__(self, derived_path, **kwargs):
+        self.derived_path = derived_path
+        self.manifest_path = os.path.join(derived_path, 'manifest.json')
+        super().__init__([self.manifest_path], **kwargs)
+
+    def _build(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            manifest = {}
+        return DerivedImageSnapshot(manifest)
+
+    # Function to get the current snapshot
+    def snapshot(self):
+        return self.current()
@@ -0,0 +1,150 @@
+import base64
+import json
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+from catalog import recording_id
+
+# Orders of the category listing and of the filename listing. 'file' keeps the order of selectedtopics.json.
+CATEGORY_SORTS = ('name', 'size', 'recent')
+FILE_SORTS = ('file', 'name', 'recent')
+# Number of sorted filename listings (one per selection and order) kept in memory
+FILE_VIEW_CACHE_SIZE = 256
+
+MONTHS = {month: number for number, month in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], start=1)}
+
+# Function to turn maptitle.json's 'published' ('Mar 2012') into a sortable month number, 0 when unknown
+def published_month(published):
+    month, _, year = (published or '').partition(' ')
+    try:
+        return int(year) * 12 + MONTHS.get(month, 0)
+    except ValueError:
+        return 0
+
+# Function to encode the sort key of the last item of a page as an opaque cursor
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+# Function to decode a cursor back into a sort key, raises ValueError for malformed cursors
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as error:
+        raise ValueError("Invalid cursor") from error
+    if not isinstance(key, list):
+        raise ValueError("Invalid cursor")
+    return key
+
+# Items in one order with their sort keys. A page starts right after the key in the cursor (found by binary
+# search), so paging costs O(log n + page size) and cursors stay valid when items are added or removed.
+class SortedView:
+    def __init__(self, items, key):
+        pairs = sorted(((key(item), item) for item in items), key=lambda pair: pair[0])
+        self.keys = [pair[0] for pair in pairs]
+        self.items = [pair[1] for pair in pairs]
+
+    def __len__(self):
+        return len(self.items)
+
+    # Function to get one page, returns (items, cursor of the next page or None on the last page)
+    def page(self, cursor, limit):
+        start = 0
+        if cursor:
+            try:
+                start = bisect_right(self.keys, decode_cursor(cursor))
+            except TypeError as error:
+                # A cursor of another order, its key does not compare with ours
+                raise ValueError("Invalid cursor") from error
+        end = start + limit
+        return self.items[start:end], encode_cursor(self.keys[end - 1]) if end < len(self.items) else None
+
+# Filenames in a fixed order that is not a sort order ('file', the order of selectedtopics.json), with the same
+# paging as SortedView. The cursor holds the last filename of the page and its position; a page starts right after
+# that filename wherever it is now, so adding or removing other files shifts no page. Only when the file itself was
+# removed does the page start at its old position.
+class OrderedView:
+    def __init__(self, items):
+        self.items = list(items)
+        self.positions = {item: position for position, item in enumerate(self.items)}
+
+    def __len__(self):
+        return len(self.items)
+
+    # Function to get one page, returns (items, cursor of the next page or None on the last page)
+    def page(self, cursor, limit):
+        start = 0
+        if cursor:
+            key = decode_cursor(cursor)
+            if len(key) != 2 or not isinstance(key[0], str) or not isinstance(key[1], int):
+                raise ValueError("Invalid cursor")
+            last, position = key
+            start = self.positions[last] + 1 if last in self.positions else min(max(position, 0), len(self.items))
+        end = start + limit
+        return self.items[start:end], encode_cursor([self.items[end - 1], end - 1]) if end < len(self.items) else None
+
+# Presorted category and filename listings of one catalog version, built once per catalog version. Only the
+# category listings are built up front, from aggregate lookups; filename listings are built on first use.
+class CatalogListing:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        with snapshot.read():
+            self.sizes = snapshot.category_sizes()
+            published = snapshot.published_by_category()
+        # category -> month number of its most recently published recording
+        self.recency = {category: max(map(published_month, published.get(category, [])), default=0)
+                        for category in self.sizes}
+        self.category_views = {
+            'name': SortedView(self.sizes, lambda category: [category.lower(), category]),
+            'size': SortedView(self.sizes, lambda category: [-self.sizes[category], category.lower(), category]),
+            'recent': SortedView(self.sizes, lambda category: [-self.recency[category], category.lower(), category]),
+        }
+        self._file_views = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Function to get a page of categories with their recording counts
+    def categories(self, sort, cursor, limit):
+        view = self.category_views[sort]
+        categories, next_cursor = view.page(cursor, limit)
+        return [{"name": category, "count": self.sizes[category]} for category in categories], len(view), next_cursor
+
+    # Function to get the sorted, deduplicated filenames of the selected categories, built on first use
+    def _file_view(self, selected_categories, sort):
+        key = (selected_categories, sort)
+        with self._lock:
+            view = self._file_views.get(key)
+            if view is not None:
+                self._file_views.move_to_end(key)
+                return view
+
+        filenames = []
+        seen = set()
+        with self.snapshot.read():
+            for category in selected_categories:
+                for filename in self.snapshot.files_in(category) or []:
+                    if filename not in seen:
+                        seen.add(filename)
+                        filenames.append(filename)
+            if sort != 'file':
+                records = {filename: self.snapshot.record(recording_id(filename)) or {} for filename in filenames}
+        if sort == 'file':
+            view = OrderedView(filenames)
+        else:
+            titles = {filename: records[filename].get('title', recording_id(filename)) for filename in filenames}
+            if sort == 'name':
+                view = SortedView(filenames, lambda filename: [titles[filename].lower(), filename])
+            else:
+                published = {filename: published_month(records[filename].get('published')) for filename in filenames}
+                view = SortedView(filenames, lambda filename: [-published[filename], titles[filename].lower(), filename])
+        with self._lock:
+            self._file_views[key] = view
+            while len(self._file_views) > FILE_VIEW_CACHE_SIZE:
+                self._file_views.popitem(last=False)
+        return view
+
+    # Function to get a page of the filenames of the selected categories
+    def filenames(self, selected_categories, sort, cursor, limit):
+        view = self._file_view(selected_categories, sort)
+        filenames, next_cursor = view.page(cursor, limit)
+        return filenames, len(view), next_cursor
@@ -0,0 +1,321 @@
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import g, request
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# Number of functions listed in the profile of a slow request
+PROFILE_LINES = 25
+
+# Metric families in the order they are rendered: (name, type, help)
+METRIC_FAMILIES = [
+    ('mindmap_request_duration_seconds', 'histogram', 'Request latency by route.'),
+    ('mindmap_response_bytes_total', 'counter', 'Response body bytes sent by route.'),
+    ('mindmap_responses_total', 'counter', 'Responses by route and status code.'),
+    ('mindmap_disk_reads_total', 'counter', 'Files read from disk while answering requests.'),
+    ('mindmap_cache_requests_total', 'counter', 'Cache lookups by cache and result.'),
+    ('mindmap_index_builds_total', 'counter', 'Index builds, each one rescans or remaps the index files.'),
+]
+# Histogram samples of one route in order: buckets, sum, count
+HISTOGRAM_SUFFIXES = ['_bucket', '_sum', '_count']
+# Seconds between two writes of a worker's counts to the shared directory; other workers report them at most this late
+FLUSH_INTERVAL = 1.0
+# Counts of exited workers in the shared directory
+ARCHIVE_FILE = 'archive.json'
+# Times the shared directory is read again when a worker file is archived while it is being read
+SHARED_READ_ATTEMPTS = 5
+
+# Function to get the position of a sample within its family: by labels, then buckets before sum and count, then by
+# bucket bound
+def sample_order(metric, labels):
+    suffix = next((i for i, suffix in enumerate(HISTOGRAM_SUFFIXES) if metric.endswith(suffix)), 0)
+    bound = next((math.inf if value == '+Inf' else value for name, value in labels if name == 'le'), 0)
+    return tuple(str(value) for name, value in labels if name != 'le'), suffix, bound
+
+# Function to write JSON to a file through a temporary file in the same directory, so readers never see half of it
+def write_json_atomically(path, data):
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+# Function to read the [metric, labels, value] counts of one process file as {(metric, labels): value}
+def read_counts(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return {(metric, tuple(tuple(label) for label in labels)): value for metric, labels, value in json.load(file)}
+
+# Function to add counts to samples, in place
+def add_samples(samples, counts):
+    for key, value in counts.items():
+        samples[key] = samples.get(key, 0) + value
+
+# Function to read the archived counts of exited workers: {'files': archived file names, 'samples': {...}}
+def read_archive(directory):
+    try:
+        with open(os.path.join(directory, ARCHIVE_FILE), 'r', encoding='utf-8') as file:
+            archive = json.load(file)
+    except FileNotFoundError:
+        return {'files': [], 'samples': {}}
+    return {'files': archive['files'],
+            'samples': {(metric, tuple(tuple(label) for label in labels)): value for metric, labels, value in archive['samples']}}
+
+# Function to escape a Prometheus label value
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Function to format a set of labels, e.g. {route="/data",method="GET"}
+def format_labels(labels):
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+# Request and cache counters of the server, rendered in the Prometheus text format. Each process counts in memory;
+# under the multi-worker server the workers share their counts through a directory (enable_sharing), so whichever
+# worker answers a scrape reports the totals of all of them.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (route, method) -> [bucket counts..., +Inf count, sum of seconds]
+        self.latency = {}
+        # (route, method) -> bytes sent
+        self.bytes_sent = {}
+        # (route, method, status) -> responses
+        self.statuses = {}
+        # source -> files read while answering requests
+        self.disk_reads = {}
+        # (cache name, 'hit' or 'miss') -> lookups counted by cache_lookup()
+        self.cache_lookups = {}
+        # cache name -> function returning (hits, misses)
+        self.caches = {}
+        # index name -> WatchedIndex, whose builds are reported
+        self.indexes = {}
+        # source -> function returning a number of disk reads counted elsewhere (e.g. LRU cache misses)
+        self.disk_read_sources = {}
+        # Directory shared with the other worker processes, see enable_sharing()
+        self.directory = None
+        self._flush_lock = threading.Lock()
+        # Workers that exited and are waiting to be archived, and whether archive_worker() is running
+        self._exited_workers = []
+        self._archiving = False
+
+    # Function to record one finished request
+    def observe(self, route, method, status, seconds, size):
+        key = (route, method)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[len(LATENCY_BUCKETS)] += 1
+            histogram[-1] += seconds
+            self.bytes_sent[key] = self.bytes_sent.get(key, 0) + size
+            self.statuses[(route, method, status)] = self.statuses.get((route, method, status), 0) + 1
+
+    # Function to count a file read from disk while answering a request
+    def disk_read(self, source):
+        with self._lock:
+            self.disk_reads[source] = self.disk_reads.get(source, 0) + 1
+
+    # Function to count one lookup of a cache that has no counters of its own
+    def cache_lookup(self, name, hit):
+        key = (name, 'hit' if hit else 'miss')
+        with self._lock:
+            self.cache_lookups[key] = self.cache_lookups.get(key, 0) + 1
+
+    # Function to register a cache whose hits and misses are reported, stats() returns (hits, misses)
+    def register_cache(self, name, stats):
+        self.caches[name] = stats
+
+    # Function to register disk reads counted elsewhere, count() returns the number of reads so far
+    def register_disk_reads(self, source, count):
+        self.disk_read_sources[source] = count
+
+    # Function to register a WatchedIndex, so its rebuilds (directory rescans, file remaps) are reported
+    def register_index(self, name, index):
+        self.indexes[name] = index
+
+    # Function to get every sample of this process as {(metric, labels): value}, labels a tuple of (name, value)
+    def samples(self):
+        with self._lock:
+            latency = {key: list(histogram) for key, histogram in self.latency.items()}
+            bytes_sent = dict(self.bytes_sent)
+            statuses = dict(self.statuses)
+            disk_reads = dict(self.disk_reads)
+            cache_lookups = dict(self.cache_lookups)
+
+        samples = {}
+        for (route, method), histogram in latency.items():
+            labels = (('route', route), ('method', method))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                samples[('mindmap_request_duration_seconds_bucket', labels + (('le', bound),))] = histogram[i]
+            count = histogram[len(LATENCY_BUCKETS)]
+            samples[('mindmap_request_duration_seconds_bucket', labels + (('le', '+Inf'),))] = count
+            samples[('mindmap_request_duration_seconds_sum', labels)] = histogram[-1]
+            samples[('mindmap_request_duration_seconds_count', labels)] = count
+        for (route, method), size in bytes_sent.items():
+            samples[('mindmap_response_bytes_total', (('route', route), ('method', method)))] = size
+        for (route, method, status), count in statuses.items():
+            samples[('mindmap_responses_total', (('route', route), ('method', method), ('status', status)))] = count
+
+        for source, count in self.disk_read_sources.items():
+            disk_reads[source] = disk_reads.get(source, 0) + count()
+        for source, count in disk_reads.items():
+            samples[('mindmap_disk_reads_total', (('source', source),))] = count
+        for name, stats in self.caches.items():
+            hits, misses = stats()
+            cache_lookups[(name, 'hit')] = cache_lookups.get((name, 'hit'), 0) + hits
+            cache_lookups[(name, 'miss')] = cache_lookups.get((name, 'miss'), 0) + misses
+        for (name, result), count in cache_lookups.items():
+            samples[('mindmap_cache_requests_total', (('cache', name), ('result', result)))] = count
+        for name, index in self.indexes.items():
+            samples[('mindmap_index_builds_total', (('index', name),))] = index.builds
+        return samples
+
+    # Function to render every metric in the Prometheus text exposition format. With a shared directory the
+    # samples are the totals of all worker processes, otherwise those of this process.
+    def render(self):
+        samples = self.shared_samples() if self.directory else self.samples()
+        families = {}
+        for (metric, labels), value in samples.items():
+            family = next(family for family, _, _ in METRIC_FAMILIES if metric.startswith(family))
+            families.setdefault(family, []).append((sample_order(metric, labels), metric, labels, value))
+
+        lines = []
+        for family, metric_type, description in METRIC_FAMILIES:
+            lines.append(f'# HELP {family} {description}')
+            lines.append(f'# TYPE {family} {metric_type}')
+            for _, metric, labels, value in sorted(families.get(family, []), key=lambda sample: sample[0]):
+                value = f'{value:.6f}' if isinstance(value, float) else value
+                lines.append(f'{metric}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    # Function to share the counters of the processes forked from this one through files in directory (called in
+    # the master before the workers start). Every process writes its own counts to <pid>.<id>.json, render() adds
+    # up all files, and the counts of workers that exited are kept in archive.json, so totals never go backwards.
+    def enable_sharing(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # The master's file holds everything it counted, e.g. the index builds of the warm-up
+        self._start_process({})
+
+    # Function to start counting in a newly forked worker: its file holds only what it counted after the fork, the
+    # master's file already holds the counts inherited from it. The counts are written every FLUSH_INTERVAL seconds.
+    def start_worker(self):
+        self._start_process(self.samples())
+
+        def flush_periodically():
+            while True:
+                time.sleep(FLUSH_INTERVAL)
+                self.flush()
+
+        threading.Thread(target=flush_periodically, name='metrics-flush', daemon=True).start()
+
+    # Function to start this process' file in the shared directory, counting from baseline
+    def _start_process(self, baseline):
+        self._baseline = baseline
+        self._file_name = f'{os.getpid()}.{uuid.uuid4().hex}.json'
+        self._flushed = None
+        self.flush()
+
+    # Function to write the counts of this process since it started to its file in the shared directory
+    def flush(self):
+        baseline = self._baseline
+        counts = [[metric, labels, value - baseline.get((metric, labels), 0)]
+                  for (metric, labels), value in self.samples().items()]
+        with self._flush_lock:
+            if counts != self._flushed:
+                write_json_atomically(os.path.join(self.directory, self._file_name), counts)
+                self._flushed = counts
+
+    # Function to fold the file of an exited worker into archive.json (called in the master, the only writer).
+    # gunicorn calls it from its SIGCHLD handler, which can interrupt a call in progress; the interrupting call only
+    # queues its worker, the interrupted one archives the queue, so no archive update is lost.
+    def archive_worker(self, pid):
+        self._exited_workers.append(pid)
+        while self._exited_workers and not self._archiving:
+            self._archiving = True
+            try:
+                while self._exited_workers:
+                    self._archive_files(self._exited_workers.pop())
+            finally:
+                self._archiving = False
+
+    def _archive_files(self, pid):
+        names = [name for name in os.listdir(self.directory) if name.startswith(f'{pid}.') and name.endswith('.json')]
+        if not names:
+            return
+        archive = read_archive(self.directory)
+        for name in names:
+            add_samples(archive['samples'], read_counts(os.path.join(self.directory, name)))
+        # Names stay listed until their file is gone, so a reader never counts a file both archived and on its own
+        existing = set(os.listdir(self.directory))
+        write_json_atomically(os.path.join(self.directory, ARCHIVE_FILE), {
+            'files': [name for name in archive['files'] if name in existing] + names,
+            'samples': [[metric, labels, value] for (metric, labels), value in archive['samples'].items()],
+        })
+        for name in names:
+            os.remove(os.path.join(self.directory, name))
+
+    # Function to add up the counts of every process sharing the directory. A worker file that disappears while
+    # it is read was just archived, so the sum starts again from the new archive.
+    def shared_samples(self):
+        self.flush()
+        for _ in range(SHARED_READ_ATTEMPTS):
+            archive = read_archive(self.directory)
+            samples = archive['samples']
+            try:
+                for name in os.listdir(self.directory):
+                    if name.endswith('.json') and name != ARCHIVE_FILE and name not in archive['files']:
+                        add_samples(samples, read_counts(os.path.join(self.directory, name)))
+            except FileNotFoundError:
+                continue
+            return samples
+        return samples
+
+# Function to time every request of app into metrics. When app.config['PROFILE_SLOW_REQUESTS'] is set (seconds)
+# each request also runs under cProfile, and the top functions of requests slower than that are written to the log.
+def install_metrics(app, metrics):
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.profiler = None
+        if app.config.get('PROFILE_SLOW_REQUESTS') is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                g.profiler = profiler
+            except ValueError:
+                # Another request is being profiled, newer Pythons allow one profiler per process
+                pass
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        seconds = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe(route, request.method, response.status_code, seconds, response.content_length or 0)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if seconds >= app.config['PROFILE_SLOW_REQUESTS']:
+                summary = io.StringIO()
+                pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_LINES)
+                app.logger.warning("Slow request %s %s took %.3fs\n%s", request.method, request.full_path,
+                                   seconds, summary.getvalue())
+        return response
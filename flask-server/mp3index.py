@@ -0,0 +1,204 @@
+import logging
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Number of frame indexes kept in memory, one index is ~4 bytes per 26 ms of audio
+INDEX_CACHE_SIZE = 64
+
+# Sidecar file layout: magic, source mtime_ns, source size, sample rate, samples per frame, frame count,
+# followed by frame count + 1 little-endian uint64 byte offsets (the last one is the end of the audio data)
+INDEX_MAGIC = b'MP3X'
+INDEX_HEADER = struct.Struct('<4sQQIII')
+
+# Bitrates in kbit/s indexed by [MPEG-1?][layer][bitrate index]
+BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+# Sample rates indexed by version bits (0 = MPEG-2.5, 2 = MPEG-2, 3 = MPEG-1) and sample rate index
+SAMPLE_RATES = {0: [11025, 12000, 8000], 2: [22050, 24000, 16000], 3: [44100, 48000, 32000]}
+
+# Function to parse a 4-byte MPEG audio frame header, returns (frame length, sample rate, samples per frame) or None
+def parse_frame_header(header):
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x3
+    layer = 4 - ((header[1] >> 1) & 0x3)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x3
+    padding = (header[2] >> 1) & 0x1
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, sample_rate, 384
+    samples_per_frame = 1152 if layer == 2 or mpeg1 else 576
+    return samples_per_frame // 8 * bitrate // sample_rate + padding, sample_rate, samples_per_frame
+
+# Function to get the size of a leading ID3v2 tag, 0 if there is none
+def id3v2_size(data):
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+# Byte offset-to-time map over the audio frames of one MP3 file.
+class Mp3FrameIndex:
+    def __init__(self, sample_rate, samples_per_frame, offsets):
+        self.sample_rate = sample_rate
+        self.samples_per_frame = samples_per_frame
+        # offsets[i] is the first byte of frame i, offsets[-1] is the end of the last frame
+        self.offsets = offsets
+
+    @property
+    def frame_count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def frame_duration(self):
+        return self.samples_per_frame / self.sample_rate
+
+    @property
+    def duration(self):
+        return self.frame_count * self.frame_duration
+
+    # Function to get the frame playing at time t (seconds), clamped to the file
+    def frame_at(self, t):
+        return min(max(int(t / self.frame_duration), 0), self.frame_count)
+
+    # Function to map a time window to whole frames, returns (first byte, end byte, start time, end time)
+    def clip(self, start, end=None):
+        first = self.frame_at(start)
+        last = self.frame_count if end is None else max(first, min(self.frame_count, -int(-end // self.frame_duration)))
+        return self.offsets[first], self.offsets[last], first * self.frame_duration, last * self.frame_duration
+
+# Function to scan an MP3 file and build its frame index. The LAME/Xing info frame is not indexed, since it
+# carries no audio, and scanning stops at the first byte that is not a valid frame (e.g. an ID3v1 tag).
+def build_frame_index(mp3_path):
+    with open(mp3_path, 'rb') as file:
+        data = file.read()
+
+    position = id3v2_size(data)
+    # Resynchronize if the audio does not start right after the tag
+    while position < len(data) - 4 and parse_frame_header(data[position:position + 4]) is None:
+        position += 1
+
+    offsets = array('Q')
+    sample_rate = samples_per_frame = None
+    while position + 4 <= len(data):
+        header = parse_frame_header(data[position:position + 4])
+        if header is None or position + header[0] > len(data):
+            break
+        frame_length, frame_rate, frame_samples = header
+        if sample_rate is None:
+            sample_rate, samples_per_frame = frame_rate, frame_samples
+            frame = data[position:position + min(frame_length, 64)]
+            if b'Xing' in frame or b'Info' in frame or b'VBRI' in frame:
+                position += frame_length
+                continue
+        offsets.append(position)
+        position += frame_length
+    offsets.append(position)
+
+    if sample_rate is None:
+        raise ValueError(f"No MPEG audio frames found in {mp3_path}")
+    return Mp3FrameIndex(sample_rate, samples_per_frame, offsets)
+
+# Function to write a frame index next to the other indexes, tagged with the MP3 file's mtime and size. Each writer
+# uses its own temporary file, so workers building the same index at once do not clash; the last one wins.
+def save_frame_index(index, index_path, source_stat):
+    index_directory = os.path.dirname(index_path) or '.'
+    os.makedirs(index_directory, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=index_directory, prefix=os.path.basename(index_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, source_stat.st_mtime_ns, source_stat.st_size,
+                                         index.sample_rate, index.samples_per_frame, index.frame_count))
+            offsets = index.offsets
+            if sys.byteorder != 'little':
+                offsets = array('Q', offsets)
+                offsets.byteswap()
+            offsets.tofile(file)
+        os.replace(temporary_path, index_path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
+
+# Function to read a frame index, returns None if it is missing or was built from a different version of the MP3 file
+def read_frame_index(index_path, source_stat):
+    try:
+        with open(index_path, 'rb') as file:
+            magic, mtime_ns, size, sample_rate, samples_per_frame, frame_count = INDEX_HEADER.unpack(
+                file.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC or mtime_ns != source_stat.st_mtime_ns or size != source_stat.st_size:
+                return None
+            offsets = array('Q')
+            offsets.fromfile(file, frame_count + 1)
+    except (OSError, EOFError, struct.error):
+        return None
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return Mp3FrameIndex(sample_rate, samples_per_frame, offsets)
+
+@lru_cache(maxsize=INDEX_CACHE_SIZE)
+def _load_frame_index(mp3_path, index_path, mtime_ns, size):
+    source_stat = os.stat(mp3_path)
+    index = read_frame_index(index_path, source_stat)
+    if index is None:
+        index = build_frame_index(mp3_path)
+        # The saved index only spares the next process a scan, a failed write must not fail the request
+        try:
+            save_frame_index(index, index_path, source_stat)
+        except OSError as error:
+            logger.warning("Could not save the frame index %s: %s", index_path, error)
+    return index
+
+# Function to get the frame index of an MP3 file, built and saved on first use and kept in memory afterwards
+def load_frame_index(mp3_path, index_directory):
+    stat = os.stat(mp3_path)
+    index_path = os.path.join(index_directory, os.path.basename(mp3_path) + '.idx')
+    return _load_frame_index(mp3_path, index_path, stat.st_mtime_ns, stat.st_size)
+
+# Function to get the hits and misses of the in-memory frame index cache, a miss reads or builds an index file
+def frame_index_cache_info():
+    return _load_frame_index.cache_info()
+
+# Function to build the frame indexes of every MP3 file in a directory, e.g. right after convert_audiosphtomp3.py
+def build_all_frame_indexes(mp3_directory, index_directory):
+    file_count = 0
+    for file in sorted(os.listdir(mp3_directory)):
+        if file.endswith('.mp3'):
+            mp3_path = os.path.join(mp3_directory, file)
+            index_path = os.path.join(index_directory, file + '.idx')
+            source_stat = os.stat(mp3_path)
+            if read_frame_index(index_path, source_stat) is None:
+                save_frame_index(build_frame_index(mp3_path), index_path, source_stat)
+                file_count += 1
+    print(f"Indexing complete. {file_count} frame indexes were built.")
+
+if __name__ == '__main__':
+    # Usage: python mp3index.py [mp3 directory] [index directory]
+    mp3_directory = sys.argv[1] if len(sys.argv) > 1 else '../data/audiomp3'
+    index_directory = sys.argv[2] if len(sys.argv) > 2 else '../data/audioindex'
+    build_all_frame_indexes(mp3_directory, index_directory)
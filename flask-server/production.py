@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from urllib.parse import quote
+
+# gunicorn is only needed for the production server, the development server runs without it
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+# Function to hand file bodies to the front proxy. Flask's send_file then answers with an empty body and an
+# X-Sendfile header (Apache mod_xsendfile, lighttpd). With accel_prefix the header is rewritten to nginx's
+# X-Accel-Redirect, pointing at the file's path under data_root below that internal location.
+def enable_file_offloading(app, data_root, accel_prefix=None):
+    app.config['USE_X_SENDFILE'] = True
+    data_root = os.path.realpath(data_root)
+
+    @app.after_request
+    def offload_file(response):
+        path = response.headers.get('X-Sendfile')
+        if not path:
+            return response
+        # The proxy answers Range requests itself, so the response describes the whole file
+        if response.status_code == 206:
+            response.status_code = 200
+            del response.headers['Content-Range']
+            del response.headers['Content-Length']
+        if accel_prefix:
+            del response.headers['X-Sendfile']
+            relative_path = os.path.relpath(os.path.realpath(path), data_root)
+            response.headers['X-Accel-Redirect'] = quote(f"{accel_prefix.rstrip('/')}/{relative_path}")
+        return response
+
+# gunicorn application serving an already imported Flask app. With preload_app the app (and every index the
+# server module built at import time) is loaded once in the master and shared copy-on-write by the workers.
+if BaseApplication is not None:
+    class ProductionApplication(BaseApplication):
+        def __init__(self, app, options):
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+# Function to run the app under gunicorn with the given command line options. With metrics, the workers share their
+# counters through a temporary directory that lives as long as the server: each worker starts its own file after the
+# fork and writes it a last time when it exits, the master archives the file of every worker that exits and removes
+# the directory on shutdown.
+def run_production(app, args, metrics=None):
+    if BaseApplication is None:
+        raise SystemExit("The production server needs gunicorn, install it with: pip install gunicorn")
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'timeout': args.timeout,
+        'keepalive': args.keepalive,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'preload_app': True,
+        'accesslog': '-' if args.access_log else None,
+    }
+    if metrics is not None:
+        metrics_directory = tempfile.mkdtemp(prefix='mindmap-metrics-')
+        metrics.enable_sharing(metrics_directory)
+        options['post_fork'] = lambda server, worker: metrics.start_worker()
+        options['worker_exit'] = lambda server, worker: metrics.flush()
+        options['child_exit'] = lambda server, worker: metrics.archive_worker(worker.pid)
+        options['on_exit'] = lambda server: shutil.rmtree(metrics_directory, ignore_errors=True)
+    ProductionApplication(app, options).run()
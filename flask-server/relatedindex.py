@@ -0,0 +1,62 @@
+import json
+import mmap
+import os
+import struct
+
+from watchedindex import WatchedIndex
+
+RELATED_FILE = 'related.bin'
+INDEX_FILE = 'related.index.json'
+
+# Binary layout of related.bin, written by scripts/topicmodeling/custom/related.py: header (magic, recording count,
+# neighbours per recording k), then k int32 neighbour rows (-1 = none) for every recording, then the k float16
+# cosine similarities of every recording. All values are little-endian.
+RELATED_MAGIC = b'REL1'
+RELATED_HEADER = struct.Struct('<4sII')
+
+# Memory-mapped view of one build of the related recordings index.
+class RelatedSnapshot:
+    def __init__(self, recordings, data):
+        self.recordings = recordings
+        # recording id -> row
+        self.rows = {recording: row for row, recording in enumerate(recordings)}
+        self.data = data
+        self.neighbours_per_recording = 0
+        if data is not None:
+            magic, count, self.neighbours_per_recording = RELATED_HEADER.unpack_from(data)
+            if magic != RELATED_MAGIC or count != len(recordings):
+                raise ValueError("Not a related recordings index")
+            self.neighbour_format = struct.Struct(f'<{self.neighbours_per_recording}i')
+            self.score_format = struct.Struct(f'<{self.neighbours_per_recording}e')
+            self.scores_start = RELATED_HEADER.size + count * self.neighbour_format.size
+
+    # Function to get the most similar recordings of a recording as [(recording id, similarity)], best first,
+    # None if the recording is not indexed
+    def get(self, recording, limit):
+        row = self.rows.get(recording)
+        if row is None or self.data is None:
+            return None
+        neighbours = self.neighbour_format.unpack_from(self.data, RELATED_HEADER.size + row * self.neighbour_format.size)
+        scores = self.score_format.unpack_from(self.data, self.scores_start + row * self.score_format.size)
+        return [(self.recordings[neighbour], score) for neighbour, score in zip(neighbours[:limit], scores) if neighbour >= 0]
+
+# Related recordings index that maps related.bin and reloads it when the offline job writes a new one.
+class RelatedIndex(WatchedIndex):
+    def __init__(self, store_directory, **kwargs):
+        self.related_path = os.path.join(store_directory, RELATED_FILE)
+        self.index_path = os.path.join(store_directory, INDEX_FILE)
+        super().__init__([self.index_path], **kwargs)
+
+    def _build(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                recordings = json.load(file)['recordings']
+        except FileNotFoundError:
+            return RelatedSnapshot([], None)
+        with open(self.related_path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return RelatedSnapshot(recordings, data)
+
+    # Function to get the current snapshot
+    def snapshot(self):
+        return self.current()
@@ -0,0 +1,62 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Number of serialized responses kept in memory
+RESPONSE_CACHE_SIZE = 1024
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# One serialized response body with its strong ETag and, once a client asked for it, its gzip variant.
+class CachedPayload:
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self._gzip = None
+
+    # Function to get the gzip-compressed body, None if the body is too small to bother
+    def gzip(self):
+        if len(self.body) < MIN_COMPRESS_SIZE:
+            return None
+        if self._gzip is None:
+            self._gzip = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzip
+
+# LRU cache of serialized responses keyed by route and normalized request parameters. Every entry remembers the
+# data it was built from (e.g. the catalog version); an entry built from older data is rebuilt on its next use,
+# and the whole cache is dropped when the catalog changes.
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    # Function to get the cached payload for key, calling build() for the body when it is missing or stale
+    def get(self, key, version, dependencies, build, mimetype='application/json'):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            cached = self._entries.get(key)
+            if cached and cached[0] == dependencies:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        payload = CachedPayload(build(), mimetype)
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (dependencies, payload)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return payload
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,283 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import sys
+from array import array
+
+from watchedindex import WatchedIndex
+
+POSTINGS_FILE = 'search.postings'
+SPANS_FILE = 'search.spans'
+INDEX_FILE = 'search.index.json'
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Characters of context shown on each side of the first match in a snippet
+SNIPPET_CONTEXT = 80
+
+TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+
+# Function to split text into (term, character offset) pairs. Offsets refer to the text with newlines removed,
+# which is the transcript text /get-stm serves, so snippets and highlights line up with it. A term never contains a
+# newline, so it ends at its offset plus its length.
+def tokenize_with_offsets(text):
+    lowered = text.lower()
+    newline_positions = [match.start() for match in re.finditer('\n', lowered)]
+    tokens = []
+    newlines_before = 0
+    for match in TOKEN.finditer(lowered):
+        while newlines_before < len(newline_positions) and newline_positions[newlines_before] < match.start():
+            newlines_before += 1
+        tokens.append((match.group(), match.start() - newlines_before))
+    return tokens
+
+# Function to split query text into terms
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+# Function to append an unsigned integer to a bytearray as a varint (7 bits per byte, high bit = more bytes follow)
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+# Function to decode count varints from data starting at position, returns (values, position after the last one)
+def read_varints(data, position, count):
+    values = []
+    for _ in range(count):
+        value = shift = 0
+        byte = data[position]
+        while byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            position += 1
+            byte = data[position]
+        values.append(value | (byte << shift))
+        position += 1
+    return values, position
+
+# Function to build the inverted index over every cleaned transcript in a directory. The postings of a term are
+# stored as one block of (document gap, term frequency, positions byte length) varints followed by the
+# delta-encoded token positions of each document, so ranking never has to decode positions.
+def build_search_index(stm_directory, store_directory):
+    os.makedirs(store_directory, exist_ok=True)
+    documents = []
+    # start and end character offset of every token
+    token_spans = array('I')
+    # term -> [document frequency, last document, document block, positions block]
+    postings = {}
+    for filename in sorted(os.listdir(stm_directory)):
+        if not filename.endswith('.stm'):
+            continue
+        with open(os.path.join(stm_directory, filename), 'r', encoding='utf-8') as file:
+            tokens = tokenize_with_offsets(file.read())
+        document = len(documents)
+        documents.append([filename[:-len('.stm')], len(tokens), len(token_spans) // 2])
+
+        term_positions = {}
+        for position, (term, offset) in enumerate(tokens):
+            term_positions.setdefault(term, []).append(position)
+            token_spans.append(offset)
+            token_spans.append(offset + len(term))
+        for term, positions in term_positions.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = [0, 0, bytearray(), bytearray()]
+            position_bytes = bytearray()
+            previous = 0
+            for position in positions:
+                write_varint(position_bytes, position - previous)
+                previous = position
+            write_varint(entry[2], document - entry[1])
+            write_varint(entry[2], len(positions))
+            write_varint(entry[2], len(position_bytes))
+            entry[3] += position_bytes
+            entry[0] += 1
+            entry[1] = document
+
+    terms = {}
+    postings_path = os.path.join(store_directory, POSTINGS_FILE)
+    with open(postings_path + '.tmp', 'wb') as file:
+        for term in sorted(postings):
+            document_frequency, _, document_block, positions_block = postings[term]
+            terms[term] = [file.tell(), len(document_block), document_frequency]
+            file.write(document_block)
+            file.write(positions_block)
+    spans_path = os.path.join(store_directory, SPANS_FILE)
+    with open(spans_path + '.tmp', 'wb') as file:
+        token_spans.tofile(file)
+
+    total_tokens = sum(document[1] for document in documents)
+    index_path = os.path.join(store_directory, INDEX_FILE)
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({
+            'documents': documents,
+            'average_length': total_tokens / len(documents) if documents else 0.0,
+            'terms': terms,
+        }, file)
+    os.replace(postings_path + '.tmp', postings_path)
+    os.replace(spans_path + '.tmp', spans_path)
+    os.replace(index_path + '.tmp', index_path)
+    print(f"Search index complete. {len(documents)} transcripts, {len(terms)} terms, {total_tokens} tokens were indexed.")
+
+# Function to parse a query into (phrases, terms). Quoted parts are phrases, everything else single terms.
+def parse_query(query):
+    phrases = []
+    terms = []
+    for phrase, word in QUERY_PART.findall(query):
+        words = tokenize(phrase if phrase else word)
+        if phrase and len(words) > 1:
+            phrases.append(words)
+        else:
+            terms.extend(words)
+    return phrases, terms
+
+# Memory-mapped view of one build of the search index.
+class SearchSnapshot:
+    def __init__(self, index, postings, spans):
+        self.documents = index['documents']
+        self.average_length = index['average_length']
+        self.terms = index['terms']
+        self.postings = postings
+        self.spans = memoryview(spans).cast('I') if spans is not None else None
+
+    # Function to decode the document block of a term, returns {document: (term frequency, positions start)}
+    def _documents(self, term):
+        entry = self.terms.get(term)
+        if entry is None:
+            return {}
+        start, length, document_frequency = entry
+        values, _ = read_varints(self.postings, start, 3 * document_frequency)
+        documents = {}
+        document = 0
+        positions_start = start + length
+        for i in range(0, len(values), 3):
+            document += values[i]
+            documents[document] = (values[i + 1], positions_start)
+            positions_start += values[i + 2]
+        return documents
+
+    # Function to decode the token positions of a term in one document
+    def _positions(self, term_frequency, positions_start):
+        gaps, _ = read_varints(self.postings, positions_start, term_frequency)
+        positions = []
+        position = 0
+        for gap in gaps:
+            position += gap
+            positions.append(position)
+        return positions
+
+    # Function to get the start positions of a phrase in one document
+    def _phrase_positions(self, phrase_postings, document):
+        candidates = set(self._positions(*phrase_postings[0][document]))
+        for offset, term_postings in enumerate(phrase_postings[1:], start=1):
+            positions = set(self._positions(*term_postings[document]))
+            candidates = {position for position in candidates if position + offset in positions}
+            if not candidates:
+                break
+        return sorted(candidates)
+
+    # Function to rank documents with BM25, returns the total number of matches and the top results as
+    # (score, document, [(first token position, token count)] of the matches used for highlighting)
+    def search(self, query, limit, offset=0):
+        phrases, terms = parse_query(query)
+        query_terms = set(terms)
+        for phrase in phrases:
+            query_terms.update(phrase)
+        term_postings = {term: self._documents(term) for term in query_terms}
+
+        # Documents must contain every phrase, bare terms only add to the score
+        required = None
+        phrase_matches = {}
+        for phrase in phrases:
+            phrase_postings = [term_postings[term] for term in phrase]
+            documents = set.intersection(*(set(postings) for postings in phrase_postings))
+            if required is not None:
+                documents &= required
+            matched = set()
+            for document in documents:
+                positions = self._phrase_positions(phrase_postings, document)
+                if positions:
+                    matched.add(document)
+                    phrase_matches.setdefault(document, []).extend((position, len(phrase)) for position in positions)
+            required = matched
+
+        scores = {}
+        document_count = len(self.documents)
+        for term in query_terms:
+            postings = term_postings[term]
+            if not postings:
+                continue
+            idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for document, (term_frequency, _) in postings.items():
+                if required is not None and document not in required:
+                    continue
+                length_norm = 1 - BM25_B + BM25_B * self.documents[document][1] / (self.average_length or 1)
+                score = idf * term_frequency * (BM25_K1 + 1) / (term_frequency + BM25_K1 * length_norm)
+                scores[document] = scores.get(document, 0.0) + score
+
+        top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], -item[0]))[offset:]
+        results = []
+        for document, score in top:
+            matches = list(phrase_matches.get(document, []))
+            for term in set(terms):
+                if document in term_postings[term]:
+                    matches.extend((position, 1) for position in self._positions(*term_postings[term][document]))
+            results.append((score, document, sorted(matches)))
+        return len(scores), results
+
+    # Function to get the character spans [start, end) of matches in a document's transcript text, from the start
+    # of the first matched token to the end of the last one as stored in the index
+    def match_spans(self, document, matches):
+        base = self.documents[document][2]
+        spans = []
+        for position, count in matches:
+            start = self.spans[2 * (base + position)]
+            end = self.spans[2 * (base + position + count - 1) + 1]
+            spans.append((start, end))
+        return spans
+
+    # Function to cut a snippet around the first match, returns (snippet offset, snippet text, highlighted spans)
+    def snippet(self, spans, text):
+        if not spans:
+            return 0, text[:2 * SNIPPET_CONTEXT], []
+        start = max(spans[0][0] - SNIPPET_CONTEXT, 0)
+        end = min(spans[0][1] + SNIPPET_CONTEXT, len(text))
+        return start, text[start:end], [span for span in spans if span[0] >= start and span[1] <= end]
+
+# Search index that maps the postings and reloads them when the build step writes a new index.
+class SearchIndex(WatchedIndex):
+    def __init__(self, store_directory, **kwargs):
+        self.postings_path = os.path.join(store_directory, POSTINGS_FILE)
+        self.spans_path = os.path.join(store_directory, SPANS_FILE)
+        self.index_path = os.path.join(store_directory, INDEX_FILE)
+        super().__init__([self.index_path], **kwargs)
+
+    def _build(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            return SearchSnapshot({'documents': [], 'average_length': 0.0, 'terms': {}}, None, None)
+        mappings = []
+        for path in (self.postings_path, self.spans_path):
+            with open(path, 'rb') as file:
+                empty = os.fstat(file.fileno()).st_size == 0
+                mappings.append(b'' if empty else mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        return SearchSnapshot(index, *mappings)
+
+    # Function to get the current snapshot
+    def snapshot(self):
+        return self.current()
+
+if __name__ == '__main__':
+    # Usage: python searchindex.py [cleaned stm directory] [store directory]
+    stm_directory = sys.argv[1] if len(sys.argv) > 1 else '../data/transcripts/cleanedtranscripts'
+    store_directory = sys.argv[2] if len(sys.argv) > 2 else '../data/transcripts/store'
+    build_search_index(stm_directory, store_directory)
@@ -0,0 +1,155 @@
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+from watchedindex import WatchedIndex
+
+SEGMENT_FILE = 'segments.bin'
+INDEX_FILE = 'segments.index.json'
+
+# Binary layout of segments.bin: header (magic, segment count, text length), then the columns for all recordings
+# back to back: float32 start times, float32 end times, uint32 text offsets (count + 1), UTF-8 text. The columns
+# are in native byte order so the server can use them straight from the mapping.
+SEGMENT_MAGIC = b'SEG1'
+SEGMENT_HEADER = struct.Struct('<4sII')
+
+# Raw STM line: '<file> <channel> <speaker> <start> <end> <label> <text>'
+STM_LINE = re.compile(r'^(\S+)\s+\S+\s+\S+\s+([\d.]+)\s+([\d.]+)\s+<[^>]*>\s?(.*)$')
+
+# Function to clean the text of one segment the same way simpletextcleaner.py cleans whole lines
+def clean_segment_text(text):
+    return text.replace('<unk>', '')
+
+# Function to parse a raw STM file into a list of (start, end, text), sorted by start time
+def parse_stm(stm_path):
+    segments = []
+    with open(stm_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            match = STM_LINE.match(line.rstrip('\n'))
+            if not match or match.group(4) == 'ignore_time_segment_in_scoring':
+                continue
+            segments.append((float(match.group(2)), float(match.group(3)), clean_segment_text(match.group(4))))
+    segments.sort(key=lambda segment: segment[0])
+    return segments
+
+# Function to build the segment index of every raw STM file in a directory
+def build_segment_index(raw_directory, store_directory):
+    os.makedirs(store_directory, exist_ok=True)
+    starts, ends, text_offsets = array('f'), array('f'), array('I', [0])
+    text = bytearray()
+    recordings = {}
+    for filename in sorted(os.listdir(raw_directory)):
+        if not filename.endswith('.stm'):
+            continue
+        segments = parse_stm(os.path.join(raw_directory, filename))
+        recordings[filename[:-len('.stm')]] = [len(starts), len(segments)]
+        for start, end, segment_text in segments:
+            starts.append(start)
+            ends.append(end)
+            text += segment_text.encode('utf-8')
+            text_offsets.append(len(text))
+
+    segment_path = os.path.join(store_directory, SEGMENT_FILE)
+    index_path = os.path.join(store_directory, INDEX_FILE)
+    with open(segment_path + '.tmp', 'wb') as file:
+        file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(starts), len(text)))
+        for column in (starts, ends, text_offsets):
+            column.tofile(file)
+        file.write(text)
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({'recordings': recordings}, file)
+    os.replace(segment_path + '.tmp', segment_path)
+    os.replace(index_path + '.tmp', index_path)
+    print(f"Segment index complete. {len(starts)} segments of {len(recordings)} recordings were indexed.")
+
+# Segments of one recording, backed by slices of the shared memory-mapped columns.
+class RecordingSegments:
+    def __init__(self, starts, ends, text_offsets, text):
+        self.starts = starts
+        self.ends = ends
+        self.text_offsets = text_offsets
+        self.text = text
+
+    def __len__(self):
+        return len(self.starts)
+
+    # Function to get one segment as a dict
+    def segment(self, index):
+        return {
+            "index": index,
+            "start": round(self.starts[index], 3),
+            "end": round(self.ends[index], 3),
+            "text": str(self.text[self.text_offsets[index]:self.text_offsets[index + 1]], 'utf-8'),
+        }
+
+    # Function to find the segment playing at time t, or the last one that started before t, None before the first
+    def index_at(self, t):
+        index = bisect_right(self.starts, t) - 1
+        return index if index >= 0 else None
+
+    # Function to find the first segment that is still playing at or after time t
+    def first_from(self, t):
+        index = self.index_at(t)
+        if index is None:
+            return 0
+        return index if self.ends[index] > t else index + 1
+
+# Memory-mapped view of one build of the segment index.
+class SegmentSnapshot:
+    def __init__(self, recordings, data):
+        self.recordings = recordings
+        self.columns = None
+        if data is not None:
+            magic, count, text_length = SEGMENT_HEADER.unpack_from(data)
+            if magic != SEGMENT_MAGIC:
+                raise ValueError("Not a segment index")
+            view = memoryview(data)
+            position = SEGMENT_HEADER.size
+            starts = view[position:position + 4 * count].cast('f')
+            position += 4 * count
+            ends = view[position:position + 4 * count].cast('f')
+            position += 4 * count
+            text_offsets = view[position:position + 4 * (count + 1)].cast('I')
+            position += 4 * (count + 1)
+            self.columns = (starts, ends, text_offsets, view[position:position + text_length])
+
+    # Function to get the segments of a recording, None if the recording is not indexed
+    def get(self, recording):
+        if self.columns is None or recording not in self.recordings:
+            return None
+        first, count = self.recordings[recording]
+        starts, ends, text_offsets, text = self.columns
+        return RecordingSegments(starts[first:first + count], ends[first:first + count],
+                                 text_offsets[first:first + count + 1], text)
+
+# Segment index that maps segments.bin and reloads it when the build step writes a new index.
+class SegmentIndex(WatchedIndex):
+    def __init__(self, store_directory, **kwargs):
+        self.segment_path = os.path.join(store_directory, SEGMENT_FILE)
+        self.index_path = os.path.join(store_directory, INDEX_FILE)
+        super().__init__([self.index_path], **kwargs)
+
+    def _build(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                recordings = json.load(file)['recordings']
+        except FileNotFoundError:
+            return SegmentSnapshot({}, None)
+        with open(self.segment_path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return SegmentSnapshot(recordings, data)
+
+    # Function to get the current snapshot
+    def snapshot(self):
+        return self.current()
+
+if __name__ == '__main__':
+    # Usage: python segmentindex.py [raw stm directory] [store directory]
+    raw_directory = sys.argv[1] if len(sys.argv) > 1 else '../data/transcripts/rawtranscripts'
+    store_directory = sys.argv[2] if len(sys.argv) > 2 else '../data/transcripts/store'
+    build_segment_index(raw_directory, store_directory)
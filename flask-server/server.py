@@ -1,117 +1,646 @@
-from flask import Flask, request, send_file, send_from_directory, jsonify
-import os
+from flask import Flask, request, send_file, send_from_directory, jsonify, redirect, url_for
+import argparse
 import json
+import math
+import os
+from urllib.parse import quote
+
+from catalog import Catalog, recording_id
+from catalogdb import CatalogStore
+from imageindex import DerivedImageIndex, ImageIndex
+from listing import CATEGORY_SORTS, FILE_SORTS, CatalogListing
+from metrics import Metrics, install_metrics
+from mp3index import frame_index_cache_info, load_frame_index
+from relatedindex import RelatedIndex
+from responsecache import ResponseCache
+from production import enable_file_offloading, run_production
+from searchindex import SearchIndex
+from segmentindex import SegmentIndex
+from typeahead import TypeaheadIndex, catalog_entries
+from transcriptstore import TranscriptStore, read_transcript_file
 
 app = Flask(__name__)
 
-MP3_DIRECTORY = '../data/audiomp3'
-STM_DIRECTORY = '../data/transcripts/cleanedtranscripts'
-JSON_FILE_PATH = '../data/mappedtopics/selectedtopics.json'
-TITLE_PATH = '../data/mappedtopics/maptitle.json'
-IMAGE_PATH = '../data/images'
+# Data directory, MINDMAP_DATA_ROOT points the server at another tree (e.g. one from scripts/loadtest/generatedata.py)
+DATA_ROOT = os.environ.get('MINDMAP_DATA_ROOT', '../data')
+MP3_DIRECTORY = os.path.join(DATA_ROOT, 'audiomp3')
+MP3_INDEX_DIRECTORY = os.path.join(DATA_ROOT, 'audioindex')
+STM_DIRECTORY = os.path.join(DATA_ROOT, 'transcripts', 'cleanedtranscripts')
+TRANSCRIPT_STORE_DIRECTORY = os.path.join(DATA_ROOT, 'transcripts', 'store')
+JSON_FILE_PATH = os.path.join(DATA_ROOT, 'mappedtopics', 'selectedtopics.json')
+TITLE_PATH = os.path.join(DATA_ROOT, 'mappedtopics', 'maptitle.json')
+CATALOG_DATABASE_PATH = os.path.join(DATA_ROOT, 'mappedtopics', 'catalog.db')
+IMAGE_PATH = os.path.join(DATA_ROOT, 'images')
+DERIVED_IMAGE_PATH = os.path.join(DATA_ROOT, 'images', 'derived')
+# Display sizes (pixels) of mind map images, used to pick thumbnails and atlases
+NODE_IMAGE_SIZE = 128
+CENTRAL_IMAGE_SIZE = 256
+# Cache lifetime for image responses requested with a content hash (?v=...), the URL changes with the content
+IMMUTABLE_MAX_AGE = 31536000
+# Cache lifetime for audio responses, revalidated with ETag/Last-Modified afterwards
+AUDIO_MAX_AGE = 86400
+
+# Catalog of categories, recordings and titles. Served from the SQLite catalog (catalogdb.py) when it exists,
+# otherwise loaded from the JSON files and reloaded when they change.
+if os.path.exists(CATALOG_DATABASE_PATH):
+    catalog = CatalogStore(CATALOG_DATABASE_PATH)
+else:
+    catalog = Catalog(JSON_FILE_PATH, TITLE_PATH)
+# Index of generated images by recording id and category, refreshed when IMAGE_PATH changes
+image_index = ImageIndex(IMAGE_PATH)
+# Thumbnails and category atlases from scripts/imagegeneration/thumbnails.py, refreshed when its manifest changes
+derived_index = DerivedImageIndex(DERIVED_IMAGE_PATH)
+# Packed, precompressed transcripts from transcriptstore.py, remapped when the store is rebuilt
+transcript_store = TranscriptStore(TRANSCRIPT_STORE_DIRECTORY)
+# Time-aligned transcript segments from segmentindex.py, remapped when the index is rebuilt
+segment_index = SegmentIndex(TRANSCRIPT_STORE_DIRECTORY)
+# Largest number of segments returned by one /recording/<id>/segments request
+MAX_SEGMENT_PAGE = 200
+# Inverted index over the cleaned transcripts from searchindex.py, remapped when the index is rebuilt
+search_index = SearchIndex(TRANSCRIPT_STORE_DIRECTORY)
+# Largest number of results returned by one /search request, and of match offsets returned per result
+MAX_SEARCH_RESULTS = 50
+MAX_MATCH_OFFSETS = 50
+# Most similar recordings by transcript TF-IDF from scripts/topicmodeling/custom/related.py, remapped when rebuilt
+related_index = RelatedIndex(TRANSCRIPT_STORE_DIRECTORY)
+# Largest number of related recordings returned by one /recording/<id>/related request
+MAX_RELATED = 50
+# Serialized JSON/text responses by route and parameters, dropped when the catalog changes
+response_cache = ResponseCache()
+# Typeahead index over categories, speakers and titles, rebuilt for each catalog version: (version, index)
+typeahead_index = (None, None)
+# Presorted category and filename listings for paginated /data and /data/categories: (version, listing)
+catalog_listing = (None, None)
+# Default and largest page size of paginated listings
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Serialized recording bundles by recording id, at most RECORDING_BUNDLE_CACHE_SIZE of them (each holds a whole
+# transcript), rebuilt when the catalog, the image or the transcript changes
+RECORDING_BUNDLE_CACHE_SIZE = 256
+recording_bundles = ResponseCache(RECORDING_BUNDLE_CACHE_SIZE)
 
-# Route to get audio file, function retrieve and serve an audio file.
+# Request latency, bytes, status, disk read and cache counters, served by /metrics (totals of all workers under
+# the production server)
+metrics = Metrics()
+install_metrics(app, metrics)
+metrics.register_cache('response', lambda: (response_cache.hits, response_cache.misses))
+metrics.register_cache('recording_bundle', lambda: (recording_bundles.hits, recording_bundles.misses))
+metrics.register_cache('transcript_file', lambda: read_transcript_file.cache_info()[:2])
+metrics.register_cache('mp3_frame_index', lambda: frame_index_cache_info()[:2])
+metrics.register_disk_reads('stm', lambda: read_transcript_file.cache_info().misses)
+metrics.register_disk_reads('mp3_frame_index', lambda: frame_index_cache_info().misses)
+metrics.register_disk_reads('image_hash', lambda: image_index.hash_reads)
+for name, index in (('catalog', catalog), ('images', image_index), ('derived_images', derived_index),
+                    ('transcripts', transcript_store), ('segments', segment_index), ('search', search_index),
+                    ('related', related_index)):
+    metrics.register_index(name, index)
+
+# Route to get audio file, function retrieve and serve an audio file. Range requests are answered with 206.
+# With t=<seconds>, or start=<seconds>&end=<seconds>, only the MP3 frames of that time window are sent; a time that
+# is not a finite number or an end before the start is answered with 400.
 @app.route('/get-mp3')
 def get_audio():
     filename = request.args.get('filename')  
     mp3_file_name = filename + '.mp3' 
     mp3_path = os.path.join(MP3_DIRECTORY, mp3_file_name)
-    return send_file(mp3_path, mimetype='audio/mpeg', as_attachment=True) 
+    start = request.args.get('start', type=float)
+    if start is None:
+        start = request.args.get('t', type=float)
+    end = request.args.get('end', type=float)
+    if start is None and end is None:
+        response = send_file(mp3_path, mimetype='audio/mpeg', as_attachment=True, conditional=True, max_age=AUDIO_MAX_AGE)
+        if response.status_code != 304:
+            metrics.disk_read('mp3')
+        return response
+    start = start or 0.0
+    if not math.isfinite(start) or (end is not None and (not math.isfinite(end) or end < start)):
+        return "Invalid time window", 400
+    return get_audio_clip(mp3_path, start, end)
+
+# Function to serve the frames of an MP3 file that cover a time window, located through the file's frame index
+def get_audio_clip(mp3_path, start, end):
+    try:
+        frame_index = load_frame_index(mp3_path, MP3_INDEX_DIRECTORY)
+    except FileNotFoundError:
+        return "Audio not found", 404
+    except ValueError:
+        return "Audio file could not be indexed", 500
+    first_byte, end_byte, clip_start, clip_end = frame_index.clip(start, end)
+
+    with open(mp3_path, 'rb') as file:
+        file.seek(first_byte)
+        body = file.read(end_byte - first_byte)
+    metrics.disk_read('mp3')
+
+    response = app.response_class(body, mimetype='audio/mpeg')
+    stat = os.stat(mp3_path)
+    response.set_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}-{first_byte:x}-{end_byte:x}")
+    response.cache_control.public = True
+    response.cache_control.max_age = AUDIO_MAX_AGE
+    response.headers['X-Clip-Start'] = f"{clip_start:.3f}"
+    response.headers['X-Clip-End'] = f"{clip_end:.3f}"
+    return response.make_conditional(request)
 
-# Function to extract transcript from STM file
-def extract_transcript_from_stm(stm_path):
-    with open(stm_path, 'r') as file:
-        transcript = file.read()
-    transcript = transcript.replace('\n', '') 
-    return transcript
+# Function to get a transcript, returns (data, etag) or None. Transcripts come from the packed store when it has
+# them (a zero-copy slice, optionally precompressed) and from the STM file otherwise (identity only).
+def get_transcript(filename, encoding='identity'):
+    stored = transcript_store.snapshot().get(filename, encoding)
+    if stored or encoding != 'identity':
+        return stored
+    stm_path = os.path.join(STM_DIRECTORY, filename + '.stm')
+    try:
+        stat = os.stat(stm_path)
+    except OSError:
+        return None
+    return read_transcript_file(stm_path, stat.st_mtime_ns, stat.st_size), f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
 
-# Route to get transcript, function retrieve and serve a transcript.
+# Route to get transcript, function retrieve and serve a transcript, precompressed if the client accepts it.
 @app.route('/get-stm')
 def get_stm():
     filename = request.args.get('filename')
-    stm_filename = filename + '.stm' 
-    stm_path = os.path.join(STM_DIRECTORY, stm_filename)
-    transcript = extract_transcript_from_stm(stm_path)
-    return transcript, 200
+    encoding = 'identity'
+    for stored_encoding in transcript_store.snapshot().encodings(filename):
+        if request.accept_encodings[stored_encoding]:
+            encoding = stored_encoding
+            break
+    transcript = get_transcript(filename, encoding)
+    if transcript is None:
+        return "Transcript not found", 404
+
+    data, etag = transcript
+    if encoding != 'identity':
+        etag = f"{etag}-{encoding}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class([data], mimetype='text/plain', direct_passthrough=True)
+        response.content_length = len(data)
+        if encoding != 'identity':
+            response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+# Function to get the categories a request selects, from the JSON body of a POST or ?categories=... of a GET
+def get_selected_categories():
+    if request.method == 'POST':
+        categories = (request.get_json(silent=True) or {}).get('categories', [])
+    else:
+        categories = request.args.getlist('categories')
+    return tuple(str(category) for category in categories)
+
+# Function to answer from the response cache. The body is built once per key and data version, then served with a
+# strong ETag (304 when the client already has it) and gzip-compressed when the client accepts it.
+def cached_response(key, build, dependencies=(), mimetype='application/json'):
+    payload = response_cache.get(key, catalog.snapshot().version, dependencies, build, mimetype)
+    body = payload.gzip() if request.accept_encodings['gzip'] else None
+    etag = payload.etag + '-gzip' if body else payload.etag
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body or payload.body, mimetype=payload.mimetype)
+        if body:
+            response.content_encoding = 'gzip'
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True
+    return response
 
-# Function to get data from JSON file, function retrieve categories and their associated filenames from a JSON file.
-def get_data():
-    with open(JSON_FILE_PATH, 'r') as file:
-        data = json.load(file)
+# Function to serialize a JSON response body the way jsonify does
+def to_json(data):
+    return app.json.dumps(data, separators=(',', ':')).encode('utf-8') + b'\n'
 
-    categories = list(data.keys())
-    category_filenames = {category: data[category] for category in categories}
+# Function to get the presorted listings of the current catalog, built on first use after each catalog change
+def get_catalog_listing():
+    global catalog_listing
+    snapshot = catalog.snapshot()
+    version, listing = catalog_listing
+    metrics.cache_lookup('catalog_listing', version == snapshot.version)
+    if version != snapshot.version:
+        listing = CatalogListing(snapshot)
+        catalog_listing = (snapshot.version, listing)
+    return listing
 
-    return categories, category_filenames
+# Function to read the pagination parameters of a request, returns (sort, cursor, limit) or None when the request
+# asks for the whole list. Raises ValueError for an unknown sort order.
+def get_page_parameters(sorts):
+    if not any(name in request.args for name in ('sort', 'cursor', 'limit')):
+        return None
+    sort = request.args.get('sort', sorts[0])
+    if sort not in sorts:
+        raise ValueError(f"Invalid sort, use one of: {', '.join(sorts)}")
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return sort, request.args.get('cursor', ''), limit
 
-# Route to get categories, function retrieve categories from a JSON file.
+# Function to answer a paginated listing from the response cache, 400 for a bad sort order or cursor
+def cached_page(key, build_page):
+    try:
+        return cached_response(key, lambda: to_json(build_page()))
+    except ValueError as error:
+        return str(error), 400
+
+# Route to get categories, function retrieve categories from the catalog. With sort=name|size|recent, limit=<n>
+# or cursor=<next> it returns one page of {"name", "count"} objects and the cursor of the next page instead.
 @app.route('/data')
 def get_categories_Data():
-    with open(JSON_FILE_PATH, 'r') as file:
-        data = json.load(file)
+    try:
+        page = get_page_parameters(CATEGORY_SORTS)
+    except ValueError as error:
+        return str(error), 400
+    if page is None:
+        return cached_response(('/data',), lambda: to_json({"categories": catalog.snapshot().categories}))
 
-    categories = list(data.keys())
+    def build_page():
+        categories, total, next_cursor = get_catalog_listing().categories(*page)
+        return {"categories": categories, "total": total, "next": next_cursor}
 
-    return jsonify({"categories": categories})
+    return cached_page(('/data', page), build_page)
 
 # Route to get filenames of selected categories, function retrieve filenames associated with selected categories.
-@app.route('/data/categories', methods=['POST'])
+# GET with ?categories=A&categories=B returns the same as a POST and can be cached by the browser.
+# With sort=file|name|recent, limit=<n> or cursor=<next> it returns one page and the cursor of the next page.
+@app.route('/data/categories', methods=['GET', 'POST'])
 def get_category_filenames():
-    selected_categories = request.json.get('categories', [])
-    _, category_filenames = get_data()
-      
-    for category in selected_categories:
-        category_filenames = category_filenames.get(category, [])
-    return jsonify(category_filenames)
+    selected_categories = get_selected_categories()
+    try:
+        page = get_page_parameters(FILE_SORTS)
+    except ValueError as error:
+        return str(error), 400
+    if page is not None:
+        def build_page():
+            filenames, total, next_cursor = get_catalog_listing().filenames(selected_categories, *page)
+            return {"filenames": filenames, "total": total, "next": next_cursor}
+
+        return cached_page(('/data/categories', selected_categories, page), build_page)
+
+    def build():
+        filenames = []
+        seen = set()
+        with catalog.snapshot().read() as snapshot:
+            for category in selected_categories:
+                for filename in snapshot.files_in(category) or []:
+                    if filename not in seen:
+                        seen.add(filename)
+                        filenames.append(filename)
+        return to_json(filenames)
+
+    return cached_response(('/data/categories', selected_categories), build)
+
+# Function to build a versioned URL for a recording's image, None if the recording has no image
+def get_image_url(recording, category=None, size=None):
+    image = image_index.snapshot().image_for(recording, category)
+    if not image:
+        return None
+    url = f"/images/{quote(recording)}?v={image_index.content_hash(image[0])}"
+    if category:
+        url += f"&category={quote(category)}"
+    if size:
+        url += f"&size={size}"
+    return url
+
+# Function to build a versioned URL for a category's central image, None if the category has no central image
+def get_central_image_url(category, size=None):
+    central_image = image_index.snapshot().central_image_for(category)
+    if not central_image:
+        return None
+    url = f"/images/central/{quote(category)}?v={image_index.content_hash(central_image)}"
+    if size:
+        url += f"&size={size}"
+    return url
+
+# Function to pick the derived image format, an explicit ?format= wins over the Accept header
+def get_image_format():
+    image_format = request.args.get('format')
+    if image_format in ('webp', 'jpeg'):
+        return image_format
+    return 'webp' if 'image/webp' in request.accept_mimetypes.values() else 'jpeg'
+
+# Function to serve an image file, or its thumbnail when ?size= is given (WebP or JPEG, negotiated).
+# Requests versioned with the current content hash (?v=<hash>) may be cached forever. A stale hash is redirected
+# to the current one, so a URL is never cached with content other than its own; unversioned requests are
+# revalidated.
+def send_image(image_file):
+    version = request.args.get('v')
+    current_version = image_index.content_hash(image_file)
+    if version and current_version and version != current_version:
+        return redirect(url_for(request.endpoint, **request.view_args, **{**request.args.to_dict(), 'v': current_version}))
+
+    size = request.args.get('size', type=int)
+    directory = IMAGE_PATH
+    if size:
+        thumbnail = derived_index.snapshot().thumbnail_for(image_file, size, get_image_format())
+        if thumbnail:
+            directory, image_file = DERIVED_IMAGE_PATH, thumbnail
+    if not version or version != current_version:
+        response = send_from_directory(directory, image_file)
+    else:
+        response = send_from_directory(directory, image_file, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.immutable = True
+    if response.status_code != 304:
+        metrics.disk_read('image')
+    if size and not request.args.get('format'):
+        response.vary.add('Accept')
+    return response
+
+# Route to get a derived image (thumbnail or category atlas), names contain a content hash so they never change
+@app.route('/images/derived/<name>')
+def get_derived_image(name):
+    response = send_from_directory(DERIVED_IMAGE_PATH, name, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.immutable = True
+    if response.status_code != 304:
+        metrics.disk_read('image')
+    return response
 
 # Route to get image, function retrieve and serve image files for subnodes
 @app.route('/images/<path:filename>')
 def get_image(filename):
-    image_file = None
-    category = None
-
-    for file in os.listdir(IMAGE_PATH):
-        if filename in file and file.endswith('.png'):
-            image_file = file
-            category = file.split('_')[0]
-            category = category.capitalize()
-            break
+    image = image_index.snapshot().image_for(filename, request.args.get('category'))
 
-    if image_file:
-        return send_from_directory(IMAGE_PATH, image_file), 200, {'Category': category}
+    if image:
+        image_file, category = image
+        response = send_image(image_file)
+        response.headers['Category'] = category.capitalize()
+        return response
+    else:
+        return "Image not found", 404
+
+# Route to get central image of one category by name, used by the URLs returned from /data/mindmap
+@app.route('/images/central/<category>')
+def get_category_central_image(category):
+    central_image = image_index.snapshot().central_image_for(category)
+
+    if central_image:
+        return send_image(central_image)
     else:
         return "Image not found", 404
 
 # Route to get central image, function retrieve and serve the central image associated with selected categories.
-@app.route('/data/central-image', methods=['POST'])
+@app.route('/data/central-image', methods=['GET', 'POST'])
 def get_central_image():
-    selected_categories = request.json.get('categories', [])
+    selected_categories = get_selected_categories()
+    snapshot = image_index.snapshot()
     central_image = None
-    for file in os.listdir(IMAGE_PATH):
-        for category in selected_categories:
-            if category in file and file.endswith('_M.png'):
-                central_image = file
-                break
+    for category in selected_categories:
+        central_image = snapshot.central_image_for(category)
+        if central_image:
+            break
 
     if central_image:
+        metrics.disk_read('image')
         return send_from_directory(IMAGE_PATH, central_image)
     else:
         return "Image not found", 404
 
+# Function to describe a category's sprite atlas for the mind map, None if the thumbnail stage has not built it
+def get_atlas(category):
+    atlas = derived_index.snapshot().atlas_for(category, NODE_IMAGE_SIZE)
+    if not atlas:
+        return None
+    return {
+        "size": atlas['size'],
+        "width": atlas['width'],
+        "height": atlas['height'],
+        "urls": {image_format: f"/images/derived/{quote(name)}" for image_format, name in atlas['files'].items()},
+    }, atlas['sprites']
+
+# Route to get a whole mind map in one response, function retrieve every node (recording, title, category,
+# image URL and, when atlases are built, its sprite position) and the central image of each selected category.
+@app.route('/data/mindmap', methods=['GET', 'POST'])
+def get_mindmap():
+    selected_categories = get_selected_categories()
+
+    def build():
+        categories = []
+        nodes = []
+        with catalog.snapshot().read() as snapshot:
+            for category in selected_categories:
+                filenames = snapshot.files_in(category)
+                if filenames is None:
+                    continue
+                atlas, sprites = get_atlas(category) or (None, {})
+                categories.append({
+                    "category": category,
+                    "centralImageUrl": get_central_image_url(category, CENTRAL_IMAGE_SIZE),
+                    "atlas": atlas,
+                })
+                for filename in filenames:
+                    recording = recording_id(filename)
+                    nodes.append({
+                        "filename": recording,
+                        "title": snapshot.title(recording),
+                        "category": category,
+                        "imageUrl": get_image_url(recording, category, NODE_IMAGE_SIZE),
+                        "sprite": sprites.get(recording),
+                    })
+        return to_json({"categories": categories, "nodes": nodes})
+
+    return cached_response(('/data/mindmap', selected_categories), build,
+                           dependencies=(image_index.snapshot(), image_index.hash_changes, derived_index.snapshot()))
+
 # Route to get title, function retrieve the title associated with a filename.
 @app.route('/get-title', methods=['GET'])
 def get_title():
     filename = request.args.get('filename', '')
-    with open(TITLE_PATH, 'r') as f:
-        data = json.load(f)
+    return cached_response(('/get-title', filename), lambda: catalog.snapshot().title(filename).encode('utf-8'),
+                           mimetype='text/html')
+
+# Function to build the JSON document for one recording, returns (body, etag) or None for unknown recordings.
+# Bundles are cached and rebuilt only when the catalog, the image or the transcript changes.
+def get_recording_bundle(recording):
+    with catalog.snapshot().read() as snapshot:
+        record = snapshot.record(recording) or {}
+        categories = snapshot.categories_of(recording)
+    transcript = get_transcript(recording)
+    if not record and not categories and transcript is None:
+        return None
+
+    category = categories[0] if categories else None
+    image_url = get_image_url(recording, category)
+
+    def build():
+        bundle = {
+            "filename": recording,
+            "title": record.get('title', recording),
+            "event": record.get('event'),
+            "published": record.get('published'),
+            "duration": record.get('duration'),
+            "category": category,
+            "categories": categories,
+            "imageUrl": image_url,
+            "transcript": str(transcript[0], 'utf-8') if transcript else None,
+        }
+        return json.dumps(bundle, ensure_ascii=False).encode('utf-8')
+
+    payload = recording_bundles.get(recording, snapshot.version, (image_url, transcript[1] if transcript else None), build)
+    return payload.body, payload.etag
+
+# Route to get everything the recording page shows (title, metadata, category, image URL and transcript) in one response.
+@app.route('/recording/<recording>')
+def get_recording(recording):
+    bundle = get_recording_bundle(recording)
+    if bundle is None:
+        return "Recording not found", 404
+
+    body, etag = bundle
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
-    for recording in data:
-        if recording['baseFileName'] == filename:
-            title = recording['title']
-            return title
+# Route to get time-aligned transcript segments of a recording. With t=<seconds> it returns the segment playing at
+# that time, otherwise a page of segments from start=<seconds> (or offset=<segment index>) of at most limit segments,
+# stopping at end=<seconds> if given. "next" is the offset of the following page, null on the last page.
+@app.route('/recording/<recording>/segments')
+def get_recording_segments(recording):
+    segments = segment_index.snapshot().get(recording)
+    if segments is None:
+        return "Segments not found", 404
 
-    return filename
+    t = request.args.get('t', type=float)
+    if t is not None:
+        index = segments.index_at(t)
+        return jsonify({"filename": recording, "total": len(segments),
+                        "segment": segments.segment(index) if index is not None else None})
 
-# Main function to run the Flask application
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_SEGMENT_PAGE)
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        offset = segments.first_from(start) if start is not None else 0
+    offset = max(offset, 0)
+
+    page = []
+    index = offset
+    while index < len(segments) and len(page) < limit:
+        if end is not None and segments.starts[index] >= end:
+            break
+        page.append(segments.segment(index))
+        index += 1
+    more = index < len(segments) and (end is None or segments.starts[index] < end)
+    return jsonify({"filename": recording, "total": len(segments), "segments": page, "next": index if more else None})
+
+# Route to get the recordings most similar to a recording (cosine similarity of their transcripts' TF-IDF vectors),
+# best first, with the title and image URL the recording page shows for each of them.
+@app.route('/recording/<recording>/related')
+def get_related_recordings(recording):
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_RELATED)
+    snapshot = related_index.snapshot()
+    if recording not in snapshot.rows:
+        return "Related recordings not found", 404
+
+    def build():
+        titles = catalog.snapshot()
+        related = []
+        for related_recording, score in snapshot.get(recording, limit):
+            categories = titles.categories_of(related_recording)
+            related.append({
+                "filename": related_recording,
+                "title": titles.title(related_recording),
+                "score": round(score, 4),
+                "imageUrl": get_image_url(related_recording, categories[0] if categories else None),
+            })
+        return to_json({"filename": recording, "related": related})
+
+    return cached_response(('/recording/related', recording, limit), build,
+                           dependencies=(snapshot, image_index.snapshot(), image_index.hash_changes))
+
+# Route to search the transcripts, function rank recordings for q with BM25 and return them with a snippet.
+# Quoted parts of q are phrase queries. Highlights and offsets are character spans in the /get-stm transcript text.
+@app.route('/search')
+def search_transcripts():
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_SEARCH_RESULTS)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    snapshot = search_index.snapshot()
+    total, results = snapshot.search(query, limit, offset)
+
+    titles = catalog.snapshot()
+    hits = []
+    for score, document, matches in results:
+        recording = snapshot.documents[document][0]
+        transcript = get_transcript(recording)
+        text = str(transcript[0], 'utf-8') if transcript else ''
+        spans = snapshot.match_spans(document, matches[:MAX_MATCH_OFFSETS])
+        snippet_offset, snippet, highlights = snapshot.snippet(spans, text)
+        hits.append({
+            "filename": recording,
+            "title": titles.title(recording),
+            "score": round(score, 4),
+            "snippet": snippet,
+            "snippetOffset": snippet_offset,
+            "highlights": highlights,
+            "offsets": spans,
+        })
+    return jsonify({"query": query, "total": total, "offset": offset, "results": hits})
+
+# Function to get the typeahead index of the current catalog, built on first use after each catalog change
+def get_typeahead_index():
+    global typeahead_index
+    snapshot = catalog.snapshot()
+    version, index = typeahead_index
+    metrics.cache_lookup('typeahead_index', version == snapshot.version)
+    if version != snapshot.version:
+        index = TypeaheadIndex(catalog_entries(snapshot))
+        typeahead_index = (snapshot.version, index)
+    return index
+
+# Route to get typeahead suggestions, function return the categories, speakers and titles starting with q (at any
+# word), largest collections first. kinds=category,speaker,title restricts the kinds of suggestions.
+@app.route('/typeahead')
+def get_typeahead():
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 10, type=int)
+    kinds = frozenset(filter(None, request.args.get('kinds', '').split(',')))
+    return cached_response(('/typeahead', query, limit, kinds),
+                           lambda: to_json({"query": query, "results": get_typeahead_index().lookup(query, max(limit, 1), kinds)}))
+
+# Route to get the request and cache metrics in the Prometheus text format, summed over the production server's workers
+@app.route('/metrics')
+def get_metrics():
+    response = app.response_class(metrics.render(), mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.cache_control.no_store = True
+    return response
+
+# Function to load everything requests read before the production server forks its workers, so the workers
+# share the catalog, image, transcript, segment and search indexes instead of each building their own
+def warm_up():
+    catalog.snapshot()
+    image_index.snapshot()
+    derived_index.snapshot()
+    transcript_store.snapshot()
+    segment_index.snapshot()
+    search_index.snapshot()
+    related_index.snapshot()
+    get_typeahead_index()
+
+# Main function to run the Flask application. 'python server.py' starts the development server,
+# 'python -m server serve --workers N' the multi-worker production server (needs gunicorn).
 if __name__ == '__main__':
-    app.run(debug=True, port=15000)
+    profile_help = "profile every request and log the top functions of those slower than SECONDS"
+    parser = argparse.ArgumentParser(description="Mind Map web server")
+    parser.add_argument('--profile-slow', type=float, metavar='SECONDS', help=profile_help)
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help="run the production server")
+    serve.add_argument('--profile-slow', type=float, metavar='SECONDS', default=argparse.SUPPRESS, help=profile_help)
+    serve.add_argument('--bind', default='127.0.0.1:15000', help="address to listen on (default: %(default)s)")
+    serve.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    serve.add_argument('--threads', type=int, default=4, help="threads per worker (default: %(default)s)")
+    serve.add_argument('--timeout', type=int, default=30, help="seconds before a silent worker is restarted (default: %(default)s)")
+    serve.add_argument('--keepalive', type=int, default=5, help="seconds to keep idle connections open (default: %(default)s)")
+    serve.add_argument('--max-requests', type=int, default=0, help="restart a worker after this many requests, 0 = never (default: %(default)s)")
+    serve.add_argument('--access-log', action='store_true', help="log every request to stdout")
+    serve.add_argument('--x-sendfile', action='store_true', help="let the proxy send MP3/PNG files (X-Sendfile header)")
+    serve.add_argument('--x-accel-prefix', help="let nginx send MP3/PNG files from this internal location mapped to the data directory (X-Accel-Redirect)")
+    args = parser.parse_args()
+    app.config['PROFILE_SLOW_REQUESTS'] = args.profile_slow
+
+    if args.command == 'serve':
+        if args.x_sendfile or args.x_accel_prefix:
+            enable_file_offloading(app, DATA_ROOT, args.x_accel_prefix)
+        warm_up()
+        run_production(app, args, metrics)
+    else:
+        app.run(debug=True, port=15000)
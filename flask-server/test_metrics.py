@@ -0,0 +1,89 @@
+import http.client
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+from metrics import FLUSH_INTERVAL
+
+SERVER_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Requests sent to the production server; each worker is restarted after MAX_REQUESTS of them
+REQUESTS = 40
+MAX_REQUESTS = 7
+STARTUP_TIMEOUT = 120
+
+pytest.importorskip('gunicorn')
+
+# Function to find a free local port
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+# Function to send one GET request on its own connection, so the requests spread over the workers
+def get(port, path):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request('GET', path, headers={'Connection': 'close'})
+        response = connection.getresponse()
+        return response.status, response.read().decode('utf-8')
+    finally:
+        connection.close()
+
+# Function to read one sample of a /metrics page, 0 when it is missing
+def sample(metrics_text, line_start):
+    match = re.search('^' + re.escape(line_start) + r' (\S+)$', metrics_text, re.MULTILINE)
+    return float(match.group(1)) if match else 0
+
+@pytest.fixture
+def production_server():
+    port = free_port()
+    server_log = tempfile.TemporaryFile(mode='w+')
+    server = subprocess.Popen(
+        [sys.executable, 'server.py', 'serve', '--workers', '2', '--threads', '1', '--bind', f'127.0.0.1:{port}',
+         '--max-requests', str(MAX_REQUESTS)],
+        cwd=SERVER_DIRECTORY, stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                get(port, '/metrics')
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    server_log.seek(0)
+                    pytest.fail("The production server did not start:\n" + server_log.read())
+                time.sleep(0.2)
+        yield port
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        server_log.close()
+
+# Every scrape reaches some worker, and each one must report the requests of all workers, including those of the
+# workers restarted after MAX_REQUESTS requests
+def test_metrics_add_up_over_workers(production_server):
+    port = production_server
+    line_start = 'mindmap_responses_total{route="/get-title",method="GET",status="200"}'
+    for i in range(REQUESTS):
+        status, _ = get(port, f'/get-title?filename=test{i}')
+        assert status == 200
+
+    # Let every worker write its counts
+    time.sleep(2 * FLUSH_INTERVAL)
+    totals = [sample(get(port, '/metrics')[1], line_start) for _ in range(10)]
+    assert totals == [REQUESTS] * 10
+
+    histogram_count = sample(get(port, '/metrics')[1],
+                             'mindmap_request_duration_seconds_count{route="/get-title",method="GET"}')
+    assert histogram_count == REQUESTS
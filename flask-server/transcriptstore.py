@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import sys
+from functools import lru_cache
+
+from watchedindex import WatchedIndex
+
+# brotli is optional, without it only gzip variants are stored
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Number of transcripts read straight from STM files (not yet packed) that are kept in memory
+TRANSCRIPT_CACHE_SIZE = 256
+
+PACK_FILE = 'transcripts.pack'
+INDEX_FILE = 'transcripts.index.json'
+
+# Function to clean a transcript for serving, the same text /get-stm has always returned
+def clean_transcript(text):
+    return text.replace('\n', '')
+
+# Function to read and clean a transcript straight from its STM file, cached by path, mtime and size
+@lru_cache(maxsize=TRANSCRIPT_CACHE_SIZE)
+def read_transcript_file(stm_path, mtime_ns, size):
+    with open(stm_path, 'r', encoding='utf-8') as file:
+        return clean_transcript(file.read()).encode('utf-8')
+
+# Function to pack every transcript of stm_directory into one file plus an offset index. Each transcript is stored
+# as plain UTF-8 ('identity') and precompressed ('gzip' and, if brotli is installed, 'br').
+def build_transcript_store(stm_directory, store_directory):
+    os.makedirs(store_directory, exist_ok=True)
+    pack_path = os.path.join(store_directory, PACK_FILE)
+    index_path = os.path.join(store_directory, INDEX_FILE)
+
+    entries = {}
+    with open(pack_path + '.tmp', 'wb') as pack:
+        for filename in sorted(os.listdir(stm_directory)):
+            if not filename.endswith('.stm'):
+                continue
+            with open(os.path.join(stm_directory, filename), 'r', encoding='utf-8') as file:
+                body = clean_transcript(file.read()).encode('utf-8')
+            variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants['br'] = brotli.compress(body, quality=11)
+
+            entry = {'etag': hashlib.sha1(body).hexdigest()}
+            for encoding, data in variants.items():
+                entry[encoding] = [pack.tell(), len(data)]
+                pack.write(data)
+            entries[filename[:-len('.stm')]] = entry
+
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({'transcripts': entries}, file)
+    # The pack is replaced first, a server still holding the old index keeps its own mapping of the old pack
+    os.replace(pack_path + '.tmp', pack_path)
+    os.replace(index_path + '.tmp', index_path)
+    print(f"Transcript store complete. {len(entries)} transcripts were packed.")
+
+# Memory-mapped view of one build of the transcript store.
+class TranscriptStoreSnapshot:
+    def __init__(self, entries, pack):
+        self.entries = entries
+        self.pack = pack
+        self.view = memoryview(pack) if pack is not None else None
+
+    # Function to get a zero-copy slice of a stored transcript, returns (data, etag) or None
+    def get(self, recording, encoding='identity'):
+        entry = self.entries.get(recording)
+        if not entry or encoding not in entry:
+            return None
+        offset, length = entry[encoding]
+        return self.view[offset:offset + length], entry['etag']
+
+    # Function to list the encodings stored for a transcript, best first
+    def encodings(self, recording):
+        entry = self.entries.get(recording, {})
+        return [encoding for encoding in ('br', 'gzip') if encoding in entry]
+
+# Transcript store that maps the pack file and reloads it when the build step writes a new index.
+class TranscriptStore(WatchedIndex):
+    def __init__(self, store_directory, **kwargs):
+        self.pack_path = os.path.join(store_directory, PACK_FILE)
+        self.index_path = os.path.join(store_directory, INDEX_FILE)
+        super().__init__([self.index_path], **kwargs)
+
+    def _build(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as file:
+                entries = json.load(file)['transcripts']
+        except FileNotFoundError:
+            return TranscriptStoreSnapshot({}, None)
+        with open(self.pack_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return TranscriptStoreSnapshot({}, None)
+            pack = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return TranscriptStoreSnapshot(entries, pack)
+
+    # Function to get the current snapshot
+    def snapshot(self):
+        return self.current()
+
+if __name__ == '__main__':
+    # Usage: python transcriptstore.py [stm directory] [store directory]
+    stm_directory = sys.argv[1] if len(sys.argv) > 1 else '../data/transcripts/cleanedtranscripts'
+    store_directory = sys.argv[2] if len(sys.argv) > 2 else '../data/transcripts/store'
+    build_transcript_store(stm_directory, store_directory)
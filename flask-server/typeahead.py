@@ -0,0 +1,88 @@
+import heapq
+import re
+from bisect import bisect_left
+
+from catalog import recording_id
+
+# Prefixes up to this many characters have their top matches precomputed, longer prefixes match few keys
+SHORT_PREFIX_LENGTH = 3
+# Largest number of matches returned (and precomputed per short prefix)
+MAX_TYPEAHEAD_RESULTS = 50
+
+WHITESPACE = re.compile(r'\s+')
+
+# Function to normalize text for prefix matching
+def normalize(text):
+    return WHITESPACE.sub(' ', text.lower()).strip()
+
+# Function to collect the typeahead entries of a catalog snapshot: categories ranked by their number of recordings,
+# speakers by their number of talks and talk titles by the number of categories they appear in. The counts come
+# from one aggregate lookup each, not one lookup per recording, all read from the same state of the catalog.
+def catalog_entries(snapshot):
+    entries = []
+    with snapshot.read():
+        for category, size in snapshot.category_sizes().items():
+            entries.append({"kind": "category", "value": category, "count": size})
+
+        category_counts = snapshot.category_counts()
+        speakers = {}
+        for record in snapshot.records():
+            recording = record['baseFileName']
+            speaker, separator, _ = record['title'].partition(' - ')
+            if separator:
+                speakers.setdefault(speaker, []).append(recording)
+            entries.append({"kind": "title", "value": record['title'], "filename": recording,
+                            "count": category_counts.get(recording_id(recording), 0)})
+        for speaker, recordings in speakers.items():
+            entries.append({"kind": "speaker", "value": speaker, "count": len(recordings), "filenames": recordings})
+    return entries
+
+# Prefix index over entry names. Every word of a name starts a key, so 'power' finds
+# 'Susan Cain - The power of introverts'. Keys are kept in one sorted array and looked up by binary search.
+class TypeaheadIndex:
+    def __init__(self, entries):
+        self.entries = entries
+        keys = []
+        for entry_id, entry in enumerate(entries):
+            words = normalize(entry['value']).split(' ')
+            for i in range(len(words)):
+                keys.append((' '.join(words[i:]), entry_id))
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.entry_ids = [entry_id for _, entry_id in keys]
+
+        # prefix -> entry ids of its best matches, for every prefix of up to SHORT_PREFIX_LENGTH characters
+        self.top = {}
+        for length in range(1, SHORT_PREFIX_LENGTH + 1):
+            groups = {}
+            for key, entry_id in keys:
+                if len(key) >= length:
+                    groups.setdefault(key[:length], set()).add(entry_id)
+            for prefix, entry_ids in groups.items():
+                self.top[prefix] = self._best(entry_ids, MAX_TYPEAHEAD_RESULTS)
+
+    # Function to order entry ids by collection size, then name
+    def _best(self, entry_ids, limit):
+        return heapq.nsmallest(limit, entry_ids,
+                               key=lambda entry_id: (-self.entries[entry_id]['count'], self.entries[entry_id]['value'].lower()))
+
+    # Function to get the top matches for a prefix, optionally restricted to some kinds of entries
+    def lookup(self, prefix, limit=10, kinds=None):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_TYPEAHEAD_RESULTS)
+
+        candidates = self.top.get(prefix) if len(prefix) <= SHORT_PREFIX_LENGTH else None
+        if candidates is not None and kinds:
+            candidates = [entry_id for entry_id in candidates if self.entries[entry_id]['kind'] in kinds]
+            # The precomputed list may hold too few entries of the requested kinds, look at every key then
+            if len(candidates) < limit and len(self.top[prefix]) == MAX_TYPEAHEAD_RESULTS:
+                candidates = None
+        if candidates is None:
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + '\uffff', start)
+            candidates = {entry_id for entry_id in self.entry_ids[start:end]
+                          if not kinds or self.entries[entry_id]['kind'] in kinds}
+            candidates = self._best(candidates, limit)
+        return [self.entries[entry_id] for entry_id in candidates[:limit]]
@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+
+# How often (in seconds) the watched paths are stat'ed to detect changes on disk.
+CHECK_INTERVAL = 2.0
+
+# Base class for in-memory indexes built from files on disk. Subclasses implement
+# _build(), which returns a complete new index object. The index is rebuilt when the
+# modification time or size of any watched path changes, and the new object replaces
+# the old one in a single assignment so readers never see a half-built index. If a
+# rebuild fails (e.g. a file is caught half-written) the previous index stays in use.
+class WatchedIndex:
+    def __init__(self, paths, check_interval=CHECK_INTERVAL):
+        self.paths = list(paths)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._current = None
+        # Number of times the index was built, a rebuild rescans or remaps its files
+        self.builds = 0
+        self.reload_if_changed(force=True)
+
+    # Function to build the index, returns the object handed out by current()
+    def _build(self):
+        raise NotImplementedError
+
+    # Function to compute a signature of the watched paths, missing paths are recorded as None
+    def _stat_signature(self):
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    # Function to rebuild the index if the watched paths changed, returns True if it was rebuilt
+    def reload_if_changed(self, force=False):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = self._stat_signature()
+            if not force and signature == self._signature:
+                return False
+            try:
+                current = self._build()
+            except (OSError, ValueError):
+                if self._current is None:
+                    raise
+                return False
+            self._current = current
+            self._signature = signature
+            self.builds += 1
+            return True
+
+    # Function to get the current index, checking the watched paths at most once per check_interval
+    def current(self):
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload_if_changed()
+        return self._current
@@ -44,4 +44,7 @@ Run the script by typing python convertaudiosphtomp3.py in the terminal.
 The script will iterate over all files in the source_dir that end with .sph, convert 
 each one to a mp3 file using SoX, and save the resulting mp3 files in target_dir. 
 It will print the count for each file and a message when conversion is complete.
+Afterwards, build the MP3 frame indexes used by the server for seeking and time-window requests
+(/get-mp3?filename=X&t=312.5) by running python mp3index.py in the flask-server directory. The
+server builds a missing index on first use, so this step only moves that cost out of the first request.
 """
@@ -0,0 +1,137 @@
+import hashlib
+import io
+import json
+import math
+import os
+from PIL import Image
+
+# Square thumbnail sizes (pixels) generated for every image
+THUMBNAIL_SIZES = [64, 128, 256]
+# Sprite sizes used for the per-category atlases
+ATLAS_SIZES = [64, 128]
+# Output formats and the Pillow options used to encode them
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 6},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+# Function to hash bytes, the short hash is used in file names so derived files can be cached forever
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()[:12]
+
+# Function to encode an image in one of FORMATS, returns the encoded bytes
+def encode(image, image_format):
+    buffer = io.BytesIO()
+    image.save(buffer, **FORMATS[image_format])
+    return buffer.getvalue()
+
+# Function to write bytes under a content-hashed name ('{stem}-{hash}.{ext}'), returns the file name
+def write_hashed(output_directory, stem, image_format, data):
+    extension = 'jpg' if image_format == 'jpeg' else image_format
+    file_name = f"{stem}-{content_hash(data)}.{extension}"
+    output_path = os.path.join(output_directory, file_name)
+    if not os.path.exists(output_path):
+        with open(output_path, 'wb') as file:
+            file.write(data)
+    return file_name
+
+# Function to load an image and convert it to RGB (JPEG has no alpha channel)
+def load_rgb(image_path):
+    with Image.open(image_path) as image:
+        return image.convert('RGB')
+
+# Function to generate thumbnails of one source image in every size and format
+def make_thumbnails(image, stem, output_directory):
+    variants = {}
+    for size in THUMBNAIL_SIZES:
+        thumbnail = image.resize((size, size), Image.LANCZOS)
+        variants[str(size)] = {image_format: write_hashed(output_directory, f"{stem}-{size}", image_format, encode(thumbnail, image_format))
+                               for image_format in FORMATS}
+    return variants
+
+# Function to pack the node images of one category into a grid, returns the atlas entry of the manifest
+def make_atlas(category, image_files, image_directory, output_directory, size):
+    columns = max(1, math.ceil(math.sqrt(len(image_files))))
+    rows = math.ceil(len(image_files) / columns)
+    atlas = Image.new('RGB', (columns * size, rows * size))
+    sprites = {}
+    for position, image_file in enumerate(image_files):
+        x, y = (position % columns) * size, (position // columns) * size
+        atlas.paste(load_rgb(os.path.join(image_directory, image_file)).resize((size, size), Image.LANCZOS), (x, y))
+        sprites[image_file] = [x, y]
+    return {
+        'width': atlas.width,
+        'height': atlas.height,
+        'files': {image_format: write_hashed(output_directory, f"{category}_atlas-{size}", image_format, encode(atlas, image_format))
+                  for image_format in FORMATS},
+        'sprites': sprites,
+    }
+
+# Function to build the derived images of every PNG in image_directory and write manifest.json.
+# Images whose content hash is unchanged since the previous run are skipped.
+def build_derived_images(image_directory, output_directory):
+    os.makedirs(output_directory, exist_ok=True)
+    manifest_path = os.path.join(output_directory, 'manifest.json')
+    previous = {'images': {}, 'atlases': {}}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            previous = json.load(file)
+
+    images = {}
+    category_images = {}
+    built_count = 0
+    for image_file in sorted(os.listdir(image_directory)):
+        if not image_file.endswith('.png'):
+            continue
+        with open(os.path.join(image_directory, image_file), 'rb') as file:
+            source_hash = content_hash(file.read())
+
+        entry = previous['images'].get(image_file)
+        if not entry or entry['source'] != source_hash or entry['sizes'] != THUMBNAIL_SIZES:
+            image = load_rgb(os.path.join(image_directory, image_file))
+            entry = {'source': source_hash, 'sizes': THUMBNAIL_SIZES,
+                     'variants': make_thumbnails(image, image_file[:-len('.png')], output_directory)}
+            built_count += 1
+        images[image_file] = entry
+
+        name = image_file[:-len('.png')]
+        if not name.endswith('_M') and '_' in name:
+            category_images.setdefault(name.split('_')[0], []).append(image_file)
+
+    atlases = {}
+    atlas_count = 0
+    for category, image_files in category_images.items():
+        # The atlas of a category only changes when one of its images does
+        atlas_key = content_hash(json.dumps([[f, images[f]['source']] for f in image_files]).encode('utf-8'))
+        atlases[category] = {}
+        for size in ATLAS_SIZES:
+            entry = previous['atlases'].get(category, {}).get(str(size))
+            if not entry or entry['key'] != atlas_key:
+                entry = make_atlas(category, image_files, image_directory, output_directory, size)
+                entry['key'] = atlas_key
+                atlas_count += 1
+            atlases[category][str(size)] = entry
+
+    manifest = {'thumbnail_sizes': THUMBNAIL_SIZES, 'atlas_sizes': ATLAS_SIZES, 'images': images, 'atlases': atlases}
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=4)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    # Remove derived files that are no longer referenced by the manifest
+    referenced = {'manifest.json'}
+    for entry in images.values():
+        for formats in entry['variants'].values():
+            referenced.update(formats.values())
+    for sizes in atlases.values():
+        for entry in sizes.values():
+            referenced.update(entry['files'].values())
+    for file_name in os.listdir(output_directory):
+        if file_name not in referenced:
+            os.remove(os.path.join(output_directory, file_name))
+
+    print(f"Derived images complete. {built_count} images and {atlas_count} atlases were built.")
+
+if __name__ == '__main__':
+    image_directory = '../../data/images'  # Images written by novitaaipt3_5.py and novitaaimaintopics.py
+    output_directory = '../../data/images/derived'  # Thumbnails, atlases and manifest.json read by the server
+    build_derived_images(image_directory, output_directory)
@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import zlib
+
+REPOSITORY_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SERVER_DIRECTORY = os.path.join(REPOSITORY_ROOT, 'flask-server')
+
+# Scale of the shipped catalog, used as the default scale
+RECORDINGS = 1099
+CATEGORIES = 259
+ASSIGNMENTS = 2320
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'su', 'an', 'vel', 'do', 'ri', 'ne', 'mar', 'to', 'li', 'sen', 'ba']
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+# MPEG-1 Layer III frame header: 128 kbit/s, 44.1 kHz, no padding. Each frame is 417 bytes and 1152 samples long.
+MP3_FRAME_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME_LENGTH = 417
+MP3_FRAME_SECONDS = 1152 / 44100
+
+# Function to make up a word of two to four syllables
+def make_word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+# Function to encode an RGB image as PNG. The pixels are random so the file is about as large as a real image.
+def make_png(rng, size):
+    rows = b''.join(b'\x00' + rng.randbytes(size * 3) for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b''))
+
+# Function to make an MP3 file of silent frames that the frame index and browsers accept
+def make_mp3(seconds):
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_LENGTH - len(MP3_FRAME_HEADER))
+    return frame * max(1, round(seconds / MP3_FRAME_SECONDS))
+
+# Function to write text or bytes to a file, creating its directory
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb' if isinstance(data, bytes) else 'w', encoding=None if isinstance(data, bytes) else 'utf-8') as file:
+        file.write(data)
+
+# Function to generate a synthetic data/ tree under root with the layout server.py reads: selectedtopics.json,
+# maptitle.json, node and central PNGs, raw and cleaned STM transcripts and MP3 stubs. Category sizes follow a
+# long-tailed distribution like the real catalog.
+def generate(root, recordings=RECORDINGS, categories=CATEGORIES, assignments=ASSIGNMENTS, segments=120,
+             audio_seconds=30.0, image_size=256, seed=0):
+    rng = random.Random(seed)
+    data_directory = os.path.join(root, 'data')
+    vocabulary = sorted({make_word(rng) for _ in range(5000)})
+    # Zipf-like word frequencies, so the search index sees common and rare terms
+    word_weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    category_names = []
+    while len(category_names) < categories:
+        name = make_word(rng).capitalize()
+        if name not in category_names:
+            category_names.append(name)
+    category_weights = [1 / (rank + 1) ** 0.8 for rank in range(categories)]
+
+    titles = []
+    topics = {category: [] for category in category_names}
+    speakers = [f"{make_word(rng).capitalize()} {make_word(rng).capitalize()}" for _ in range(max(1, recordings * 9 // 10))]
+    extra_assignments = max(assignments - recordings, 0)
+    for i in range(recordings):
+        speaker = rng.choice(speakers)
+        year = rng.randint(1990, 2017)
+        recording = f"{speaker.replace(' ', '')}_{year}{i:05d}"
+        titles.append({
+            'published': f"{rng.choice(MONTHS)} {year}",
+            'event': f"TED{year}",
+            'title': f"{speaker} - " + ' '.join(rng.choices(vocabulary, k=rng.randint(3, 7))).capitalize(),
+            'duration': f"{int(audio_seconds) // 60}m{int(audio_seconds) % 60:02d}s",
+            'baseFileName': recording,
+        })
+        count = 1 + extra_assignments // recordings + (1 if rng.random() < (extra_assignments % recordings) / recordings else 0)
+        chosen = set()
+        while len(chosen) < min(count, categories):
+            chosen.add(rng.choices(category_names, weights=category_weights)[0])
+        for category in chosen:
+            topics[category].append(recording + '.stm')
+            write_file(os.path.join(data_directory, 'images', f"{category}_{recording}.stm.png"), make_png(rng, image_size))
+
+        raw_lines = []
+        cleaned_lines = []
+        start = 0.0
+        for _ in range(segments):
+            text = ' '.join(rng.choices(vocabulary, weights=word_weights, k=rng.randint(5, 20)))
+            end = start + rng.uniform(1.0, 6.0)
+            raw_lines.append(f"{recording} 1 {recording} {start:.2f} {end:.2f} <NA> {text}\n")
+            cleaned_lines.append(text + '\n')
+            start = end
+        write_file(os.path.join(data_directory, 'transcripts', 'rawtranscripts', recording + '.stm'), ''.join(raw_lines))
+        write_file(os.path.join(data_directory, 'transcripts', 'cleanedtranscripts', recording + '.stm'), ''.join(cleaned_lines))
+        write_file(os.path.join(data_directory, 'audiomp3', recording + '.mp3'), make_mp3(audio_seconds))
+
+    topics = {category: filenames for category, filenames in topics.items() if filenames}
+    for category in topics:
+        write_file(os.path.join(data_directory, 'images', f"{category}_M.png"), make_png(rng, image_size))
+    write_file(os.path.join(data_directory, 'mappedtopics', 'selectedtopics.json'), json.dumps(topics, indent=4))
+    write_file(os.path.join(data_directory, 'mappedtopics', 'maptitle.json'), json.dumps(titles, indent=4))
+
+    scale = {
+        'recordings': recordings,
+        'categories': len(topics),
+        'assignments': sum(len(filenames) for filenames in topics.values()),
+        'segments': segments,
+        'audio_seconds': audio_seconds,
+        'image_size': image_size,
+        'seed': seed,
+    }
+    write_file(os.path.join(data_directory, 'synthetic.json'), json.dumps(scale, indent=4))
+    print(f"Synthetic data complete. {scale['recordings']} recordings, {scale['categories']} categories and "
+          f"{scale['assignments']} assignments were written to {data_directory}.")
+    return scale
+
+# Function to run the build steps of the real data on the synthetic tree: the transcript store, segment and search
+# indexes, MP3 frame indexes and, when Pillow is installed, the thumbnails and atlases
+def build_indexes(root):
+    data_directory = os.path.join(root, 'data')
+    sys.path.insert(0, SERVER_DIRECTORY)
+    from mp3index import build_all_frame_indexes
+    from searchindex import build_search_index
+    from segmentindex import build_segment_index
+    from transcriptstore import build_transcript_store
+
+    cleaned_directory = os.path.join(data_directory, 'transcripts', 'cleanedtranscripts')
+    store_directory = os.path.join(data_directory, 'transcripts', 'store')
+    build_transcript_store(cleaned_directory, store_directory)
+    build_segment_index(os.path.join(data_directory, 'transcripts', 'rawtranscripts'), store_directory)
+    build_search_index(cleaned_directory, store_directory)
+    build_all_frame_indexes(os.path.join(data_directory, 'audiomp3'), os.path.join(data_directory, 'audioindex'))
+    sys.path.insert(0, os.path.join(REPOSITORY_ROOT, 'scripts', 'imagegeneration'))
+    try:
+        from thumbnails import build_derived_images
+    except ImportError:
+        print("Pillow is not installed, the mind map is served without thumbnails and atlases.")
+        return
+    build_derived_images(os.path.join(data_directory, 'images'), os.path.join(data_directory, 'images', 'derived'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic data/ tree for load tests")
+    parser.add_argument('root', help="directory to create data/ in")
+    parser.add_argument('--recordings', type=int, default=RECORDINGS, help="number of recordings (default: %(default)s)")
+    parser.add_argument('--categories', type=int, default=CATEGORIES, help="number of categories (default: %(default)s)")
+    parser.add_argument('--assignments', type=int, default=ASSIGNMENTS, help="recording-category assignments (default: %(default)s)")
+    parser.add_argument('--segments', type=int, default=120, help="transcript segments per recording (default: %(default)s)")
+    parser.add_argument('--audio-seconds', type=float, default=30.0, help="length of each MP3 stub (default: %(default)s)")
+    parser.add_argument('--image-size', type=int, default=256, help="width and height of each PNG (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: %(default)s)")
+    parser.add_argument('--no-indexes', action='store_true', help="skip building the transcript, search, audio and image indexes")
+    args = parser.parse_args()
+
+    generate(args.root, args.recordings, args.categories, args.assignments, args.segments, args.audio_seconds,
+             args.image_size, args.seed)
+    if not args.no_indexes:
+        build_indexes(args.root)
@@ -0,0 +1,308 @@
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+REPOSITORY_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SERVER_SCRIPT = os.path.join(REPOSITORY_ROOT, 'flask-server', 'server.py')
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+# Traffic phases, each one replays what a page of the client requests
+PHASES = ['front_page', 'mind_map', 'recording']
+# A route whose p95 latency grows or whose throughput drops by more than this fraction is reported as a regression
+REGRESSION_THRESHOLD = 0.10
+# How often (seconds) the memory of the server processes is sampled
+MEMORY_SAMPLE_INTERVAL = 0.2
+# Bytes of audio the browser asks for in its first Range request
+AUDIO_RANGE = 65536
+
+# Function to map a request path to the Flask route that serves it, so results group like /metrics does
+def route_of(path):
+    path = path.split('?', 1)[0]
+    for prefix, route in (('/images/derived/', '/images/derived/<name>'), ('/images/central/', '/images/central/<category>'),
+                          ('/images/', '/images/<path:filename>'), ('/recording/', '/recording/<recording>')):
+        if path.startswith(prefix):
+            return route
+    return path
+
+# Function to get the memory (kB) of a process and its children. Proportional set size is used where the kernel
+# reports it, so pages the preloaded workers share with the master are not counted once per worker.
+def process_tree_memory(pid):
+    total = 0
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as file:
+            total += next(int(line.split()[1]) for line in file if line.startswith('Pss:'))
+    except (OSError, StopIteration):
+        try:
+            with open(f'/proc/{pid}/status') as file:
+                total += next(int(line.split()[1]) for line in file if line.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            return None
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as file:
+            children = [int(child) for child in file.read().split()]
+    except OSError:
+        children = []
+    for child in children:
+        total += process_tree_memory(child) or 0
+    return total
+
+# Function to get the nearest-rank percentile of sorted values
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+# HTTP client of one simulated user. The connection is kept open between requests and reopened when the server
+# closes it (sync workers close after every response).
+class Client:
+    def __init__(self, host, port, samples):
+        self.host = host
+        self.port = port
+        self.samples = samples
+        self.connection = None
+
+    # Function to send one request and record (route, seconds, status, bytes), returns (status, body)
+    def get(self, path, headers=None):
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            started = time.perf_counter()
+            try:
+                self.connection.request('GET', path, headers=headers or {})
+                response = self.connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    self.samples.append((route_of(path), time.perf_counter() - started, 0, 0))
+                    return 0, b''
+                continue
+            self.samples.append((route_of(path), time.perf_counter() - started, response.status, len(body)))
+            if response.getheader('Connection', '').lower() == 'close':
+                self.connection.close()
+                self.connection = None
+            return response.status, body
+
+# Catalog of the synthetic tree, used to pick what the simulated users open
+class Traffic:
+    def __init__(self, data_directory, seed):
+        with open(os.path.join(data_directory, 'mappedtopics', 'selectedtopics.json'), encoding='utf-8') as file:
+            self.categories = list(json.load(file))
+        with open(os.path.join(data_directory, 'mappedtopics', 'maptitle.json'), encoding='utf-8') as file:
+            self.recordings = [record['baseFileName'] for record in json.load(file)]
+        self.seed = seed
+
+    # Front page (App.js and filterpage.js): the category list
+    def front_page(self, client, rng):
+        client.get('/data')
+
+    # Mind map (mindmap.js): the mind map of one to three categories, then every image it shows as a browser
+    # without a cache fetches them, the central image and either the category atlases or one image per node
+    def mind_map(self, client, rng):
+        selected = rng.sample(self.categories, min(len(self.categories), rng.randint(1, 3)))
+        status, body = client.get('/data/mindmap?' + urlencode([('categories', category) for category in selected]))
+        if status != 200:
+            return
+        mindmap = json.loads(body)
+        image_headers = {'Accept': 'image/webp,image/*'}
+        central = next((category['centralImageUrl'] for category in mindmap['categories'] if category['centralImageUrl']), None)
+        if central:
+            client.get(central, image_headers)
+        atlases = {category['category']: category['atlas'] for category in mindmap['categories']}
+        for category, atlas in atlases.items():
+            if atlas:
+                client.get(atlas['urls']['webp'], image_headers)
+        for node in mindmap['nodes']:
+            if not (node['sprite'] and atlases.get(node['category'])) and node['imageUrl']:
+                client.get(node['imageUrl'], image_headers)
+
+    # Recording page (mainrecpage.js): the recording bundle, its image and the start of its audio
+    def recording(self, client, rng):
+        recording = rng.choice(self.recordings)
+        status, body = client.get(f'/recording/{quote(recording)}')
+        if status == 200 and json.loads(body).get('imageUrl'):
+            client.get(json.loads(body)['imageUrl'])
+        client.get(f'/get-mp3?filename={quote(recording)}', {'Range': f'bytes=0-{AUDIO_RANGE - 1}'})
+
+# Function to replay one phase with concurrency users for duration seconds, returns the phase results
+def run_phase(traffic, phase, host, port, concurrency, duration, server_pid):
+    samples = []
+    stop = threading.Event()
+
+    def user(number):
+        rng = random.Random(f"{traffic.seed}-{phase}-{number}")
+        client = Client(host, port, samples)
+        while not stop.is_set():
+            getattr(traffic, phase)(client, rng)
+
+    memory = []
+
+    def sample_memory():
+        while not stop.is_set():
+            memory.append(process_tree_memory(server_pid))
+            stop.wait(MEMORY_SAMPLE_INTERVAL)
+
+    threads = [threading.Thread(target=user, args=(number,)) for number in range(concurrency)]
+    threads.append(threading.Thread(target=sample_memory))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    memory.append(process_tree_memory(server_pid))
+    memory = [kilobytes for kilobytes in memory if kilobytes is not None]
+
+    routes = {}
+    for route, seconds, status, size in samples:
+        routes.setdefault(route, []).append((seconds, status, size))
+    summary = {}
+    for route, route_samples in sorted(routes.items()):
+        latencies = sorted(seconds * 1000 for seconds, _, _ in route_samples)
+        summary[route] = {
+            'requests': len(route_samples),
+            'errors': sum(1 for _, status, _ in route_samples if not 200 <= status < 400),
+            'throughput': round(len(route_samples) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'bytes': sum(size for _, _, size in route_samples),
+        }
+    return {
+        'seconds': round(elapsed, 3),
+        'requests': len(samples),
+        'throughput': round(len(samples) / elapsed, 2),
+        'memory_start_kb': memory[0] if memory else None,
+        'memory_peak_kb': max(memory) if memory else None,
+        'memory_end_kb': memory[-1] if memory else None,
+        'routes': summary,
+    }
+
+# Function to get a free local TCP port
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# Function to start the production server on the synthetic tree
+def start_server(root, port, workers, threads):
+    environment = dict(os.environ, MINDMAP_DATA_ROOT=os.path.abspath(os.path.join(root, 'data')))
+    server = subprocess.Popen([sys.executable, SERVER_SCRIPT, 'serve', '--bind', f'127.0.0.1:{port}',
+                               '--workers', str(workers), '--threads', str(threads)],
+                              cwd=os.path.dirname(SERVER_SCRIPT), env=environment)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("The server exited before it answered a request")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/data')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("The server did not answer within 60 seconds")
+
+# Function to describe the checked out version, e.g. '1a2b3c4' or '1a2b3c4-dirty'
+def repository_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPOSITORY_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Function to find the latest stored run with the same scale and settings, None if there is none
+def previous_result(results_path, result):
+    previous = None
+    try:
+        with open(results_path, encoding='utf-8') as file:
+            for line in file:
+                stored = json.loads(line)
+                if stored['scale'] == result['scale'] and stored['settings'] == result['settings']:
+                    previous = stored
+    except FileNotFoundError:
+        pass
+    return previous
+
+# Function to print the results of a run, compared with the previous run where there is one
+def print_report(result, previous):
+    print(f"\nVersion {result['version']}, {result['scale']['recordings']} recordings, "
+          f"{result['scale']['categories']} categories, {result['settings']['concurrency']} users")
+    if previous:
+        print(f"Compared with version {previous['version']} from {previous['time']}")
+    regressions = []
+    for phase, phase_result in result['phases'].items():
+        memory = (f"memory {phase_result['memory_start_kb'] // 1024} -> {phase_result['memory_end_kb'] // 1024} MB, "
+                  f"peak {phase_result['memory_peak_kb'] // 1024} MB" if phase_result['memory_peak_kb'] else "memory n/a")
+        print(f"\n{phase}: {phase_result['throughput']} requests/s, {memory}")
+        print(f"  {'route':32} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        previous_routes = previous['phases'].get(phase, {}).get('routes', {}) if previous else {}
+        for route, stats in phase_result['routes'].items():
+            line = (f"  {route:32} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput']:>9} "
+                    f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+            before = previous_routes.get(route)
+            if before:
+                p95_change = stats['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+                throughput_change = stats['throughput'] / before['throughput'] - 1 if before['throughput'] else 0.0
+                line += f"  p95 {p95_change:+.0%}, req/s {throughput_change:+.0%}"
+                if p95_change > REGRESSION_THRESHOLD or throughput_change < -REGRESSION_THRESHOLD:
+                    regressions.append(f"{phase} {route}")
+            print(line)
+    if regressions:
+        print(f"\nRegressions over {REGRESSION_THRESHOLD:.0%}: {', '.join(regressions)}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay front page, mind map and recording traffic against the server "
+                                                 "running on a data/ tree from generatedata.py")
+    parser.add_argument('root', help="directory holding the generated data/")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per phase (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=8, help="simultaneous users (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=2, help="server worker processes (default: %(default)s)")
+    parser.add_argument('--threads', type=int, default=4, help="threads per server worker (default: %(default)s)")
+    parser.add_argument('--phases', default=','.join(PHASES), help="comma-separated phases to run (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the simulated users (default: %(default)s)")
+    parser.add_argument('--results', default=RESULTS_PATH, help="file the results are appended to (default: %(default)s)")
+    args = parser.parse_args()
+
+    if importlib.util.find_spec('gunicorn') is None:
+        raise SystemExit("The load test runs the production server, install gunicorn with: pip install gunicorn")
+    data_directory = os.path.join(args.root, 'data')
+    with open(os.path.join(data_directory, 'synthetic.json'), encoding='utf-8') as file:
+        scale = json.load(file)
+    traffic = Traffic(data_directory, args.seed)
+    port = free_port()
+    server = start_server(args.root, port, args.workers, args.threads)
+    try:
+        phases = {}
+        for phase in args.phases.split(','):
+            print(f"Running {phase} for {args.duration} seconds...")
+            phases[phase] = run_phase(traffic, phase, '127.0.0.1', port, args.concurrency, args.duration, server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    result = {
+        'version': repository_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': scale,
+        'settings': {'concurrency': args.concurrency, 'workers': args.workers, 'threads': args.threads,
+                     'duration': args.duration, 'seed': args.seed},
+        'phases': phases,
+    }
+    print_report(result, previous_result(args.results, result))
+    with open(args.results, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(result) + '\n')
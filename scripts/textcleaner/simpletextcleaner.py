@@ -1,31 +1,138 @@
+import argparse
+import hashlib
+import json
 import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 
+# Remove <NA> and everything before it, then remove <unk>
+NA_PREFIX = re.compile(r'.*<NA>\s?')
+UNKNOWN_WORD = re.compile('<unk>')
+# Manifest of the cleaned transcripts, kept in the output directory
+MANIFEST_FILE = 'cleaning.manifest.json'
+# Changing the cleaning rules above must change this, so every transcript is cleaned again
+CLEANER_VERSION = 1
+# Number of slowest files listed after a run
+SLOWEST_FILES = 5
+
+# The timestamps removed here are kept in the segment index built from the raw transcripts by
+# flask-server/segmentindex.py, which cleans each segment's text the same way.
 def clean_text(text):
-    # Remove <NA> and everything before it, then remove <unk>
-    cleaned_text = re.sub(r'.*<NA>\s?', '', text)
-    cleaned_text = re.sub('<unk>', '', cleaned_text)
+    cleaned_text = NA_PREFIX.sub('', text)
+    cleaned_text = UNKNOWN_WORD.sub('', cleaned_text)
     return cleaned_text
 
-# Function to save cleaned transcripts
-
-def save_clean_transcripts(input_directory, output_directory):
-    for filename in os.listdir(input_directory):
-        if filename.endswith('.stm'):
-            input_file_path = os.path.join(input_directory, filename)
-            with open(input_file_path, 'r', encoding='utf-8') as file:
-                text = file.read()
-                cleaned_text = clean_text(text)
-            
-            # Construct path for the cleaned transcript
-            output_file_path = os.path.join(output_directory, filename)
-            # Save cleaned transcript
-            with open(output_file_path, 'w', encoding='utf-8') as file:
-                file.write(cleaned_text)
+# Function to clean one transcript line by line, writing the result next to the output and moving it into place.
+# Both patterns stay within a line, so this gives the same output as clean_text on the whole file.
+# Returns (filename, input hash, output hash, output size, seconds).
+def clean_file(input_directory, output_directory, filename):
+    started = time.perf_counter()
+    input_hash = hashlib.sha1()
+    output_hash = hashlib.sha1()
+    output_path = os.path.join(output_directory, filename)
+    with open(os.path.join(input_directory, filename), 'r', encoding='utf-8') as input_file, \
+            open(output_path + '.tmp', 'w', encoding='utf-8') as output_file:
+        for line in input_file:
+            input_hash.update(line.encode('utf-8'))
+            cleaned_line = clean_text(line)
+            output_hash.update(cleaned_line.encode('utf-8'))
+            output_file.write(cleaned_line)
+    os.replace(output_path + '.tmp', output_path)
+    return filename, input_hash.hexdigest(), output_hash.hexdigest(), os.path.getsize(output_path), time.perf_counter() - started
 
-if __name__ == '__main__':
+# Function to hash a transcript the way clean_file does (decoded text, newlines normalized)
+def hash_input(input_path):
+    input_hash = hashlib.sha1()
+    with open(input_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            input_hash.update(line.encode('utf-8'))
+    return input_hash.hexdigest()
+
+# Function to read the manifest of a previous run, empty if there is none
+def read_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Function to get the files of a previous run's manifest, empty if there is none or it was written by other cleaning
+# rules
+def load_manifest(manifest_path):
+    manifest = read_manifest(manifest_path)
+    if manifest.get('cleaner_version') != CLEANER_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+# Function to check whether a transcript is already cleaned: its size and modification time, or failing that its
+# hash, match the manifest, and the cleaned file is still there with the recorded size
+def is_up_to_date(entry, input_path, output_path):
+    if not entry or not os.path.exists(output_path) or os.path.getsize(output_path) != entry['output_size']:
+        return False
+    stat = os.stat(input_path)
+    if stat.st_mtime_ns == entry['mtime_ns'] and stat.st_size == entry['size']:
+        return True
+    if hash_input(input_path) != entry['input']:
+        return False
+    entry['mtime_ns'], entry['size'] = stat.st_mtime_ns, stat.st_size
+    return True
+
+# Function to save cleaned transcripts. Transcripts unchanged since the previous run are skipped, the rest are
+# cleaned in parallel. Cleaned transcripts whose raw transcript was removed are removed as well, also with force or
+# after a change of the cleaning rules.
+def save_clean_transcripts(input_directory, output_directory, workers=None, force=False):
+    os.makedirs(output_directory, exist_ok=True)
+    manifest_path = os.path.join(output_directory, MANIFEST_FILE)
+    # Every transcript the last run cleaned, whatever rules it cleaned them with
+    cleaned = read_manifest(manifest_path).get('files', {})
+    previous = {} if force else load_manifest(manifest_path)
+    started = time.perf_counter()
 
+    filenames = sorted(filename for filename in os.listdir(input_directory) if filename.endswith('.stm'))
+    manifest = {}
+    changed = []
+    for filename in filenames:
+        entry = previous.get(filename)
+        if is_up_to_date(entry, os.path.join(input_directory, filename), os.path.join(output_directory, filename)):
+            manifest[filename] = entry
+        else:
+            changed.append(filename)
+
+    timings = []
+    if changed:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for filename, input_hash, output_hash, output_size, seconds in executor.map(
+                    clean_file, [input_directory] * len(changed), [output_directory] * len(changed), changed, chunksize=8):
+                stat = os.stat(os.path.join(input_directory, filename))
+                manifest[filename] = {'input': input_hash, 'output': output_hash, 'output_size': output_size,
+                                      'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'seconds': round(seconds, 4)}
+                timings.append((seconds, filename))
+                print(f"{filename}: {seconds * 1000:.1f} ms")
+
+    listed = set(filenames)
+    removed = [filename for filename in cleaned if filename not in listed]
+    for filename in removed:
+        output_path = os.path.join(output_directory, filename)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({'cleaner_version': CLEANER_VERSION, 'files': manifest}, file, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    print(f"Cleaning complete. {len(changed)} transcripts were cleaned, {len(filenames) - len(changed)} were unchanged "
+          f"and {len(removed)} were removed in {time.perf_counter() - started:.2f} s.")
+    if timings:
+        slowest = ', '.join(f"{filename} ({seconds * 1000:.1f} ms)" for seconds, filename in sorted(timings, reverse=True)[:SLOWEST_FILES])
+        print(f"Slowest: {slowest}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Clean raw STM transcripts, skipping those unchanged since the last run")
     # Define input and output directories
-    input_directory = '..data/transcripts/rawtranscripts'
-    output_directory = '..data/transcripts/cleanedtranscripts'
-    save_clean_transcripts(input_directory, output_directory)
+    parser.add_argument('input_directory', nargs='?', default='../../data/transcripts/rawtranscripts')
+    parser.add_argument('output_directory', nargs='?', default='../../data/transcripts/cleanedtranscripts')
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--force', action='store_true', help="clean every transcript again")
+    args = parser.parse_args()
+    save_clean_transcripts(args.input_directory, args.output_directory, args.workers, args.force)
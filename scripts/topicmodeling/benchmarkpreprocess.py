@@ -0,0 +1,89 @@
+import argparse
+import os
+import re
+import tempfile
+import time
+# Necessary NLTK resources are downloaded automatically
+import nltk
+nltk.download('punkt')  # for the word_tokenize function
+nltk.download('stopwords')  # for stopwords
+nltk.download('wordnet')  # for the WordNet Lemmatizer
+from nltk.corpus import stopwords
+from nltk.tokenize import word_tokenize
+from nltk.stem import WordNetLemmatizer
+from corpus import Corpus, update_corpus
+
+# Compares the shared corpus (corpus.py) with the preprocessing the topic modeling scripts did before it, on the
+# same transcripts: both must give the same text for every transcript. Times a cold build of the corpus (every
+# transcript tokenized, every word lemmatized) and a warm load (nothing changed since the last run).
+
+# The scripts' original preprocess(), per pipeline: regex substitutions, word_tokenize, then stopword filtering
+# and lemmatization of every token occurrence
+def reference_letters(text):
+    cleaned_text = re.sub('[^A-Za-z]+', ' ', text)
+    cleaned_text = re.sub(r'\b\w{1,2}\b', '', cleaned_text)
+    return word_tokenize(cleaned_text.lower())
+
+def reference_words(text):
+    cleaned_text = re.sub(r'\b\w{1,2}\b', '', text)
+    cleaned_text = re.sub('[^A-Za-z]+', ' ', cleaned_text)
+    return word_tokenize(cleaned_text.lower())
+
+def reference_transcript(text):
+    cleaned_text = re.sub(r'.*<NA>\s?', '', text)
+    cleaned_text = re.sub('<unk>', ' ', cleaned_text)
+    cleaned_text = re.sub(r'\b\w{1,2}\b', '', cleaned_text)
+    cleaned_text = re.sub('[^A-Za-z]+', ' ', cleaned_text)
+    return word_tokenize(cleaned_text.lower())
+
+REFERENCES = {
+    'letters': reference_letters,
+    'words': reference_words,
+    'transcript': reference_transcript,
+}
+
+# Function to preprocess every transcript the way the scripts used to, in directory order
+def reference_texts(directory, pipeline, stop_words):
+    texts = []
+    for filename in os.listdir(directory):
+        if filename.endswith('.stm'):
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as file:
+                lemmatizer = WordNetLemmatizer()
+                tokens = REFERENCES[pipeline](file.read())
+                texts.append(" ".join([lemmatizer.lemmatize(w) for w in tokens if w not in stop_words]))
+    return texts
+
+# Function to load every transcript from a corpus in its own directory, building it first
+def corpus_texts(directory, pipeline, stop_words, output_directory, workers):
+    update_corpus(directory, pipeline, output_directory, workers)
+    corpus = Corpus(output_directory)
+    return corpus.texts(list(corpus.rows), stop_words)
+
+# Function to time a call, returns (result, seconds)
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the shared corpus with the scripts' original preprocessing")
+    parser.add_argument('directory', nargs='?', default='../../data/transcripts/cleanedtranscripts')
+    parser.add_argument('--pipeline', choices=list(REFERENCES), default='letters')
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+    stop_words = set(stopwords.words('english'))
+
+    expected, reference_seconds = timed(reference_texts, args.directory, args.pipeline, stop_words)
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        output_directory = os.path.join(temporary_directory, args.pipeline)
+        cold, cold_seconds = timed(corpus_texts, args.directory, args.pipeline, stop_words, output_directory, args.workers)
+        warm, warm_seconds = timed(corpus_texts, args.directory, args.pipeline, stop_words, output_directory, args.workers)
+
+    if cold != expected or warm != expected:
+        different = sum(1 for text, expected_text in zip(cold, expected) if text != expected_text)
+        raise SystemExit(f"The corpus differs from the original preprocessing in {different} of {len(expected)} transcripts")
+    words = sum(len(text.split()) for text in expected)
+    print(f"{len(expected)} transcripts, {words} words after preprocessing, identical output.")
+    print(f"Original preprocessing: {reference_seconds:.2f} s")
+    print(f"Corpus, cold build:     {cold_seconds:.2f} s ({reference_seconds / cold_seconds:.1f}x)")
+    print(f"Corpus, warm load:      {warm_seconds:.2f} s ({reference_seconds / warm_seconds:.1f}x)")
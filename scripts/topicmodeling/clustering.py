@@ -0,0 +1,160 @@
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import KMeans, MiniBatchKMeans, kmeans_plusplus
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+from threadpoolctl import threadpool_limits
+
+# Clustering engines of the KMeans topic scripts:
+#   kmeans     full-batch KMeans on the document vectors, what the scripts always did
+#   minibatch  MiniBatchKMeans, every step looks at a random batch of documents instead of the whole corpus
+#   spherical  spherical k-means: documents and centroids L2-normalized, documents go to the centroid of highest
+#              cosine similarity. Works on the sparse vectors directly, the centroids are the only dense data.
+ENGINES = ('kmeans', 'minibatch', 'spherical')
+# Documents per MiniBatchKMeans step
+BATCH_SIZE = 4096
+# Documents whose similarities to the centroids are computed at once by one thread (block x clusters floats)
+BLOCK_SIZE = 4096
+MAX_ITERATIONS = 100
+
+# Spherical k-means with the attributes of sklearn's KMeans (labels_, cluster_centers_), so the scripts read the
+# result the same way. Similarities are computed in blocks of documents on a thread pool; the sparse products
+# release the GIL, so the blocks run on all cores.
+class SphericalKMeans:
+    def __init__(self, n_clusters, init=None, n_init=1, max_iter=MAX_ITERATIONS, workers=None, random_state=None):
+        self.n_clusters = n_clusters
+        self.init = init
+        self.n_init = 1 if init is not None else n_init
+        self.max_iter = max_iter
+        self.workers = workers or os.cpu_count()
+        self.random_state = random_state
+
+    # Function to assign every document to its most similar centroid, returns (labels, similarities)
+    def _assign(self, executor, matrix, centers):
+        centers_t = np.ascontiguousarray(centers.T)
+
+        def assign_block(start):
+            similarities = matrix[start:start + BLOCK_SIZE] @ centers_t
+            labels = similarities.argmax(axis=1)
+            return labels, similarities[np.arange(len(labels)), labels]
+
+        blocks = list(executor.map(assign_block, range(0, matrix.shape[0], BLOCK_SIZE)))
+        return np.concatenate([block[0] for block in blocks]), np.concatenate([block[1] for block in blocks])
+
+    # Function to move every centroid to the normalized sum of its documents. An empty cluster takes the document
+    # least similar to its own centroid.
+    def _update(self, matrix, labels, similarities):
+        count = matrix.shape[0]
+        membership = sp.csr_matrix((np.ones(count, dtype=matrix.dtype), (labels, np.arange(count))),
+                                   shape=(self.n_clusters, count))
+        centers = np.asarray((membership @ matrix).todense())
+        empty = np.flatnonzero(np.bincount(labels, minlength=self.n_clusters) == 0)
+        if len(empty):
+            outliers = np.argsort(similarities)[:len(empty)]
+            centers[empty[:len(outliers)]] = matrix[outliers].toarray()
+        return normalize(centers)
+
+    def fit(self, matrix):
+        matrix = normalize(sp.csr_matrix(matrix, dtype=np.float32))
+        random_state = np.random.RandomState(self.random_state)
+        best = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in range(self.n_init):
+                if self.init is not None:
+                    centers = normalize(np.asarray(self.init, dtype=np.float32))
+                else:
+                    centers, _ = kmeans_plusplus(matrix, self.n_clusters, random_state=random_state.randint(2 ** 31))
+                    centers = normalize(centers)
+                labels = None
+                for iteration in range(1, self.max_iter + 1):
+                    new_labels, similarities = self._assign(executor, matrix, centers)
+                    if labels is not None and np.array_equal(new_labels, labels):
+                        break
+                    labels = new_labels
+                    centers = self._update(matrix, labels, similarities)
+                objective = float(similarities.sum())
+                if best is None or objective > best[0]:
+                    best = (objective, labels, centers, iteration)
+        self.objective_, self.labels_, self.cluster_centers_, self.n_iter_ = best
+        return self
+
+# Function to create the model of an engine, starting from the given centroids when init is set
+def make_model(engine, num_clusters, init=None, workers=None, random_state=None):
+    if engine == 'kmeans':
+        if init is not None:
+            return KMeans(n_clusters=num_clusters, init=init, n_init=1, random_state=random_state)
+        return KMeans(n_clusters=num_clusters, random_state=random_state)
+    if engine == 'minibatch':
+        return MiniBatchKMeans(n_clusters=num_clusters, batch_size=BATCH_SIZE, init=init if init is not None else 'k-means++',
+                               n_init=1 if init is not None else 3, random_state=random_state)
+    if engine == 'spherical':
+        return SphericalKMeans(num_clusters, init=init, workers=workers, random_state=random_state)
+    raise ValueError(f"Unknown clustering engine '{engine}'")
+
+# Function to get the mean document vector of every cluster, in the term space of the matrix
+def cluster_means(matrix, labels, num_clusters):
+    count = matrix.shape[0]
+    membership = sp.csr_matrix((np.ones(count), (labels, np.arange(count))), shape=(num_clusters, count))
+    sizes = np.maximum(np.bincount(labels, minlength=num_clusters), 1)
+    return np.asarray((membership @ matrix).todense()) / sizes[:, None]
+
+# Function to get the peak resident set size of this process since it started, in bytes. ru_maxrss counts
+# everything the process touched, native NumPy, SciPy and BLAS buffers included; it is in kB on Linux, bytes on macOS.
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Function to cluster the rows of a document-term matrix and report the run time and peak memory: the peak of the
+# Python-level allocations traced by tracemalloc during the run (a lower bound, native buffers of the BLAS and of
+# sklearn's C extensions are not traced) and the process's peak RSS (an upper bound, it covers the whole run of the
+# script so far and cannot be reset). With
+# svd_components the documents are first reduced to that many dimensions by a truncated SVD (and L2-normalized);
+# the centroids are then given as cluster means in the term space, so the top terms of a cluster can still be read
+# from cluster_centers_. init gives the starting centroids (num_clusters rows in the term space) to continue from an
+# earlier run; it is ignored with svd_components, whose reduced space changes from run to run.
+# workers limits the cores used (default: all). Returns a fitted model with labels_ and cluster_centers_.
+def cluster(matrix, num_clusters, engine='kmeans', svd_components=None, init=None, workers=None, random_state=None):
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with threadpool_limits(limits=workers):
+        vectors = matrix
+        if svd_components:
+            svd = TruncatedSVD(n_components=svd_components, random_state=random_state)
+            vectors = normalize(svd.fit_transform(matrix))
+            init = None
+        model = make_model(engine, num_clusters, init, workers, random_state).fit(vectors)
+        if svd_components:
+            model.cluster_centers_ = cluster_means(matrix, model.labels_, num_clusters)
+    seconds = time.perf_counter() - started
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    if not tracing:
+        tracemalloc.stop()
+    rss_peak = peak_rss()
+    details = f", SVD to {svd_components} dimensions" if svd_components else ", warm start" if init is not None else ""
+    print(f"Clustering complete ({engine}{details}, {num_clusters} clusters, {matrix.shape[0]} documents x "
+          f"{matrix.shape[1]} terms): {seconds:.2f} s, peak Python allocations {traced_peak / 2 ** 20:.1f} MB "
+          f"(tracemalloc, native buffers not counted), process peak RSS {rss_peak / 2 ** 20:.1f} MB "
+          f"(whole process since start).")
+    model.run_seconds_, model.traced_peak_memory_, model.peak_rss_ = seconds, traced_peak, rss_peak
+    return model
+
+# Function to add the clustering options to a script's argument parser
+def add_clustering_arguments(parser):
+    parser.add_argument('--engine', choices=ENGINES, default='kmeans', help="clustering engine (default: kmeans)")
+    parser.add_argument('--svd', type=int, default=None, metavar='COMPONENTS',
+                        help="reduce the documents to this many dimensions before clustering")
+    parser.add_argument('--workers', type=int, default=None, help="cores to use (default: all)")
+    parser.add_argument('--seed', type=int, default=None, help="random seed, for repeatable clusters")
+
+# Function to get the keyword arguments of cluster() from parsed arguments
+def clustering_options(args):
+    return {'engine': args.engine, 'svd_components': args.svd, 'workers': args.workers, 'random_state': args.seed}
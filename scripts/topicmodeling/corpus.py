@@ -0,0 +1,324 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+# Necessary NLTK resources are downloaded automatically
+import nltk
+nltk.download('wordnet')  # for the WordNet Lemmatizer
+from nltk.stem import WordNetLemmatizer
+
+# Preprocessed transcripts shared by the topic modeling scripts. Every transcript is tokenized once and stored as
+# int32 token ids, so a script loads a ready corpus instead of tokenizing every transcript on every run.
+# Stopwords and lemmas are applied per vocabulary entry when the corpus is loaded, so changing the stopwords
+# does not make any transcript go through the tokenizer again.
+#
+# Layout of a corpus directory (<transcripts directory>/../corpus/<pipeline>/), where <n> is the generation
+# named in documents.json. Every update writes a new generation, so readers never see a half-written corpus.
+#   tokens.<n>.npy       int32 token ids of all transcripts, one after the other
+#   offsets.<n>.npy      int64, the transcript in row i is tokens[offsets[i]:offsets[i + 1]]
+#   vocabulary.<n>.json  the token of every token id
+#   documents.json       pipeline version, generation and, per transcript, its row, content hash, size and
+#                        modification time
+TOKENS_FILE = 'tokens.{}.npy'
+OFFSETS_FILE = 'offsets.{}.npy'
+VOCABULARY_FILE = 'vocabulary.{}.json'
+DOCUMENTS_FILE = 'documents.json'
+# Changing a tokenizer below must change this, so every transcript is tokenized again
+PIPELINE_VERSION = 1
+# Fewer new or changed transcripts than this are tokenized in this process, starting workers would take longer
+MIN_PARALLEL_FILES = 16
+# Lemmas of every token seen so far, shared by all pipelines (<transcripts directory>/../corpus/lemmas.json)
+LEMMAS_FILE = 'lemmas.json'
+# Changing the lemmatizer must change this, so every lemma is looked up again
+LEMMAS_VERSION = 1
+
+# Tokens are the words of the scripts' original preprocessing (two regex substitutions, then NLTK's word_tokenize),
+# found here in one compiled pass over each transcript. Once only letters and spaces remain, word_tokenize just
+# splits on whitespace and splits the contractions below, which are whole words by then.
+LETTER_WORD = re.compile('[A-Za-z]{3,}')
+LONG_WORD = re.compile(r'\w{3,}')
+LETTERS = re.compile('[A-Za-z]+')
+# Remove <NA> and everything before it on its line (replaced by nothing), or <unk> (replaced by a space)
+TRANSCRIPT_MARKUP = re.compile(r'.*<NA>\s?|<unk>')
+CONTRACTIONS = {'cannot': ('can', 'not'), 'gimme': ('gim', 'me'), 'gonna': ('gon', 'na'), 'gotta': ('got', 'ta'),
+                'lemme': ('lem', 'me'), 'wanna': ('wan', 'na')}
+
+# Function to split the contractions word_tokenize splits
+def split_contractions(words):
+    tokens = []
+    for word in words:
+        contraction = CONTRACTIONS.get(word)
+        if contraction:
+            tokens.extend(contraction)
+        else:
+            tokens.append(word)
+    return tokens
+
+# Tokenizer of custom.py and tfidfkmeansstopwords.py: non-letters first, then short words. Words of three or more
+# letters are kept.
+def tokenize_letters(text):
+    return split_contractions([word.lower() for word in LETTER_WORD.findall(text)])
+
+# Tokenizer of idfwithkmeans.py: short words first, then non-letters. Words of three or more word characters
+# (digits and underscores count) are kept, then split at their non-letters, so 'x2y' gives 'x' and 'y'.
+def tokenize_words(text):
+    words = []
+    for word in LONG_WORD.findall(text):
+        if word.isascii() and word.isalpha():
+            words.append(word.lower())
+        else:
+            words.extend(part.lower() for part in LETTERS.findall(word))
+    return split_contractions(words)
+
+# Tokenizer of lda.py, which also drops what the transcript cleaner drops
+def tokenize_transcript(text):
+    return tokenize_words(TRANSCRIPT_MARKUP.sub(lambda match: ' ' if match.group() == '<unk>' else '', text))
+
+PIPELINES = {
+    'letters': tokenize_letters,
+    'words': tokenize_words,
+    'transcript': tokenize_transcript,
+}
+
+# Function to get the directory of a pipeline's corpus, next to the transcripts directory
+def corpus_directory(directory, pipeline):
+    return os.path.join(os.path.dirname(os.path.normpath(directory)), 'corpus', pipeline)
+
+# Function to read the documents of a previous run, empty if there is none or it was built by another tokenizer
+def load_documents(documents_path):
+    try:
+        with open(documents_path, 'r', encoding='utf-8') as file:
+            documents = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if documents.get('pipeline_version') != PIPELINE_VERSION:
+        return {}
+    return documents
+
+
+# Function to read and tokenize one transcript, run in the worker processes. Tokenizing is skipped when the
+# content hash equals known_hash. The tokens come back as their distinct words and the position of every token
+# among them, which is much smaller to send back than the tokens themselves.
+# Returns (content hash, distinct words or None, int32 positions or None).
+def tokenize_file(path, pipeline, known_hash=None):
+    with open(path, 'rb') as file:
+        data = file.read()
+    content_hash = hashlib.sha1(data).hexdigest()
+    if content_hash == known_hash:
+        return content_hash, None, None
+    positions = {}
+    tokens = PIPELINES[pipeline](data.decode('utf-8'))
+    ids = np.fromiter((positions.setdefault(token, len(positions)) for token in tokens), dtype=np.int32, count=len(tokens))
+    return content_hash, list(positions), ids
+
+# Function to bring the corpus of a pipeline up to date with the transcripts directory. Transcripts whose size and
+# modification time, or failing that content hash, match the previous run keep their token ids; only new and
+# changed transcripts are tokenized, in parallel when there are many. Returns the number of transcripts tokenized.
+def update_corpus(directory, pipeline, output_directory=None, workers=None):
+    output_directory = output_directory or corpus_directory(directory, pipeline)
+    os.makedirs(output_directory, exist_ok=True)
+    documents_path = os.path.join(output_directory, DOCUMENTS_FILE)
+    documents = load_documents(documents_path)
+    previous = documents.get('files', {})
+    generation = documents.get('generation', 0)
+    corpus = None
+    if previous:
+        try:
+            corpus = Corpus(output_directory)
+        except (FileNotFoundError, ValueError):
+            previous = {}
+    vocabulary = list(corpus.vocabulary) if corpus else []
+    token_ids = {token: token_id for token_id, token in enumerate(vocabulary)}
+
+    filenames = [filename for filename in os.listdir(directory) if filename.endswith('.stm')]
+    stats = {}
+    changed = []
+    for filename in filenames:
+        stat = os.stat(os.path.join(directory, filename))
+        stats[filename] = stat
+        entry = previous.get(filename)
+        if not entry or (stat.st_mtime_ns, stat.st_size) != (entry['mtime_ns'], entry['size']):
+            changed.append(filename)
+
+    paths = [os.path.join(directory, filename) for filename in changed]
+    known_hashes = [previous.get(filename, {}).get('hash') for filename in changed]
+    if len(changed) < MIN_PARALLEL_FILES or workers == 1:
+        results = list(map(tokenize_file, paths, [pipeline] * len(changed), known_hashes))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(tokenize_file, paths, [pipeline] * len(changed), known_hashes, chunksize=8))
+    tokenized_ids = {}
+    content_hashes = {}
+    # Token ids are given out in directory order, whatever order the workers finished in
+    for filename, (content_hash, words, ids) in zip(changed, results):
+        content_hashes[filename] = content_hash
+        if words is not None:
+            word_ids = np.array([token_ids.setdefault(word, len(token_ids)) for word in words], dtype=np.int32)
+            tokenized_ids[filename] = word_ids[ids]
+
+    files = {}
+    pieces = []
+    for filename in filenames:
+        stat = stats[filename]
+        ids = tokenized_ids[filename] if filename in tokenized_ids else corpus.token_ids(filename)
+        content_hash = content_hashes.get(filename) or previous[filename]['hash']
+        files[filename] = {'row': len(pieces), 'hash': content_hash, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        pieces.append(ids)
+
+    if not tokenized_ids and files == previous:
+        return 0
+
+    vocabulary.extend(list(token_ids)[len(vocabulary):])
+    offsets = np.zeros(len(pieces) + 1, dtype=np.int64)
+    np.cumsum([len(ids) for ids in pieces], out=offsets[1:])
+    tokens = np.concatenate(pieces).astype(np.int32) if pieces else np.zeros(0, dtype=np.int32)
+
+    generation += 1
+    with open(os.path.join(output_directory, TOKENS_FILE.format(generation)), 'wb') as file:
+        np.save(file, tokens)
+    with open(os.path.join(output_directory, OFFSETS_FILE.format(generation)), 'wb') as file:
+        np.save(file, offsets)
+    with open(os.path.join(output_directory, VOCABULARY_FILE.format(generation)), 'w', encoding='utf-8') as file:
+        json.dump(vocabulary, file, ensure_ascii=False)
+    # Switching documents.json publishes the new generation, then the files of older generations are removed
+    with open(documents_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({'pipeline_version': PIPELINE_VERSION, 'generation': generation, 'files': files}, file, indent=1)
+    os.replace(documents_path + '.tmp', documents_path)
+    current = {name.format(generation) for name in (TOKENS_FILE, OFFSETS_FILE, VOCABULARY_FILE)}
+    for filename in os.listdir(output_directory):
+        if filename.startswith(('tokens.', 'offsets.', 'vocabulary.')) and filename not in current:
+            os.remove(os.path.join(output_directory, filename))
+    return len(tokenized_ids)
+
+# Persistent word -> lemma table. A WordNet lemma depends only on the word, so every distinct word is lemmatized
+# once, and the table is kept on disk for later runs and the other pipelines.
+class LemmaTable:
+    def __init__(self, path):
+        self.path = path
+        self.lemmas = {}
+        self.lemmatizer = None
+        self.added = False
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                table = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if table.get('version') == [LEMMAS_VERSION, nltk.__version__]:
+            self.lemmas = table['lemmas']
+
+    # Function to get the lemma of a word
+    def lemmatize(self, word):
+        lemma = self.lemmas.get(word)
+        if lemma is None:
+            if self.lemmatizer is None:
+                self.lemmatizer = WordNetLemmatizer()
+            lemma = self.lemmas[word] = self.lemmatizer.lemmatize(word)
+            self.added = True
+        return lemma
+
+    # Function to write the table if words were added since it was read
+    def save(self):
+        if not self.added:
+            return
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({'version': [LEMMAS_VERSION, nltk.__version__], 'lemmas': self.lemmas}, file, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+        self.added = False
+
+# Lemma tables read by this process, by path
+LEMMA_TABLES = {}
+
+# Function to get the lemma table at a path, read once per process
+def load_lemma_table(path):
+    if path not in LEMMA_TABLES:
+        LEMMA_TABLES[path] = LemmaTable(path)
+    return LEMMA_TABLES[path]
+
+# Read-only view of a corpus directory. The token ids are memory-mapped, so opening a corpus reads only its
+# vocabulary and document list.
+class Corpus:
+    def __init__(self, output_directory):
+        with open(os.path.join(output_directory, DOCUMENTS_FILE), 'r', encoding='utf-8') as file:
+            documents = json.load(file)
+        generation = documents['generation']
+        with open(os.path.join(output_directory, VOCABULARY_FILE.format(generation)), 'r', encoding='utf-8') as file:
+            self.vocabulary = np.array(json.load(file), dtype=object)
+        self.tokens = np.load(os.path.join(output_directory, TOKENS_FILE.format(generation)), mmap_mode='r')
+        self.offsets = np.load(os.path.join(output_directory, OFFSETS_FILE.format(generation)), mmap_mode='r')
+        # filename -> row, in directory listing order
+        self.rows = {filename: entry['row'] for filename, entry in documents['files'].items()}
+        # Digest of the pipeline version and every transcript's row and content hash. Unlike the generation, which
+        # starts over when the corpus is rebuilt from scratch, it changes exactly when the tokens can have changed.
+        self.digest = hashlib.sha1(json.dumps(
+            [documents['pipeline_version'], sorted((filename, entry['row'], entry['hash']) for filename, entry in documents['files'].items())]
+        ).encode('utf-8')).hexdigest()
+        self.lemmas_path = os.path.join(os.path.dirname(os.path.normpath(output_directory)), LEMMAS_FILE)
+
+    # Function to get the token ids of a transcript
+    def token_ids(self, filename):
+        row = self.rows[filename]
+        return self.tokens[self.offsets[row]:self.offsets[row + 1]]
+
+    # Function to get the lemma table shared by the corpora next to this one
+    def lemma_table(self):
+        return load_lemma_table(self.lemmas_path)
+
+    # Function to get the word of every token id: its lemma when lemmatize is set. Lemmas are looked up once per
+    # vocabulary entry, not once per occurrence.
+    def words(self, lemmatize):
+        if not lemmatize:
+            return self.vocabulary
+        lemmas = self.lemma_table()
+        words = np.array([lemmas.lemmatize(token) for token in self.vocabulary], dtype=object)
+        lemmas.save()
+        return words
+
+    # Function to iterate over the transcripts as lists of words, in the order of filenames, without the stopwords.
+    # Stopwords are matched against the tokens before lemmatization, as the scripts always did. Only one transcript
+    # is held in memory at a time.
+    def stream(self, filenames, stop_words=frozenset(), lemmatize=True):
+        words = self.words(lemmatize)
+        keep = np.fromiter((token not in stop_words for token in self.vocabulary), dtype=bool, count=len(self.vocabulary))
+        for filename in filenames:
+            ids = self.token_ids(filename)
+            yield words[ids[keep[ids]]].tolist()
+
+    # Function to get the transcripts as lists of words, see stream
+    def documents(self, filenames, stop_words=frozenset(), lemmatize=True):
+        return list(self.stream(filenames, stop_words, lemmatize))
+
+    # Function to get the transcripts as space-separated text, the input of the TF-IDF vectorizers
+    def texts(self, filenames, stop_words=frozenset(), lemmatize=True):
+        return [" ".join(document) for document in self.documents(filenames, stop_words, lemmatize)]
+
+# Function to update and open the corpus of a pipeline
+def open_corpus(directory, pipeline):
+    output_directory = corpus_directory(directory, pipeline)
+    tokenized = update_corpus(directory, pipeline, output_directory)
+    if tokenized:
+        print(f"Tokenized {tokenized} new or changed transcripts.")
+    return Corpus(output_directory)
+
+# Function to load preprocessed transcripts from a directory, excluding certain files. Returns the texts and
+# their filenames in directory listing order, like the scripts' own loaders did.
+def load_transcripts(directory, pipeline, stop_words=frozenset(), exclude_files=frozenset()):
+    corpus = open_corpus(directory, pipeline)
+    file_names = [filename for filename in corpus.rows if filename not in exclude_files]
+    return corpus.texts(file_names, stop_words), file_names
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tokenize new and changed transcripts into the shared topic modeling corpus")
+    parser.add_argument('directory', nargs='?', default='../../data/transcripts/cleanedtranscripts')
+    parser.add_argument('pipelines', nargs='*', metavar='pipeline', help=f"one of {', '.join(PIPELINES)} (default: all)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+    for pipeline in args.pipelines:
+        if pipeline not in PIPELINES:
+            parser.error(f"unknown pipeline '{pipeline}'")
+    for pipeline in args.pipelines or PIPELINES:
+        tokenized = update_corpus(args.directory, pipeline, workers=args.workers)
+        print(f"Corpus '{pipeline}' complete. {tokenized} transcripts were tokenized.")
@@ -1,59 +1,134 @@
 import os
-import re
+import sys
 import json
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
+import argparse
+import numpy as np
+from sklearn.preprocessing import normalize
+from sklearn.utils.extmath import row_norms
 # Necessary NLTK resources are downloaded automatically
 import nltk
-nltk.download('punkt')  # for the word_tokenize function
 nltk.download('stopwords')  # for stopwords
-nltk.download('wordnet')  # for the WordNet Lemmatizer
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
 from nltk.corpus import stopwords
-
-
-#Preprocesses input text by removing non-alphabetic characters and short words, tokenizing, lemmatizing, and filtering out stop words.
-def preprocess(text, stop_words):
-    lemmatizer = WordNetLemmatizer()
-    cleaned_text = re.sub('[^A-Za-z]+', ' ', text)
-    cleaned_text = re.sub(r'\b\w{1,2}\b', '', cleaned_text)
-    tokens = word_tokenize(cleaned_text.lower())
-    return " ".join([lemmatizer.lemmatize(w) for w in tokens if w not in stop_words])
-
-# Load and preprocess transcripts from a directory, excluding certain files
+# The shared preprocessed corpus, clustering and labeling live one directory up, the SQLite catalog with the server code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'flask-server'))
+from corpus import load_transcripts, open_corpus
+from vectorizers import make_vectorizer
+from clustering import add_clustering_arguments, cluster, clustering_options
+from labeling import label_topics
+from catalogdb import add_assignments, assigned_filenames
+
+
+# Load preprocessed transcripts from a directory, excluding certain files. Non-alphabetic characters and short words
+# are removed and the tokens are lemmatized and filtered by the stop words; transcripts tokenized by an earlier run
+# are read from the shared corpus instead of being processed again.
 def load_and_preprocess_transcripts(directory, stop_words, exclude_files):
-    preprocessed_texts = []
-    file_names = []
-    for filename in os.listdir(directory):
-        if filename.endswith('.stm') and filename not in exclude_files:
-            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as file:
-                preprocessed_texts.append(preprocess(file.read(), stop_words))
-                file_names.append(filename)
-    return preprocessed_texts, file_names
-# Perform topic modeling using KMeans clustering on TF-IDF transformed data
-def run_topic_modeling(preprocessed_texts, num_clusters):
-    tfidf_vectorizer = TfidfVectorizer()
-    tfidf_matrix = tfidf_vectorizer.fit_transform(preprocessed_texts)
-
-    km_model = KMeans(n_clusters=num_clusters)
-    km_model.fit(tfidf_matrix)
-
-    clusters = km_model.labels_.tolist()
-    order_centroids = km_model.cluster_centers_.argsort()[:, ::-1]
-    terms = tfidf_vectorizer.get_feature_names_out()
-
-    topics_to_files = {}
-    for i in range(num_clusters):
-        topic_word = terms[order_centroids[i, 0]]
-        topics_to_files[topic_word] = []
-    for i, cluster_label in enumerate(clusters):
-        topic_word = terms[order_centroids[cluster_label, 0]]
-        topics_to_files[topic_word].append(file_names[i])
-
-    return topics_to_files
-# Prompt the user to select topics to save and update an existing JSON file with the selected topics
-def select_and_save_topics(topics_to_files, selected_topics_file):
+    return load_transcripts(directory, 'letters', stop_words, exclude_files)
+# TF-IDF matrix and clusters of one curation session, kept between rounds. The transcripts are preprocessed and
+# vectorized once; saved transcripts are then dropped from the matrix and new stopwords taken out of it, and every
+# round starts KMeans from the centroids of the clusters that are left. The IDF weights stay those of the first
+# round; start the script again to recompute them over the remaining transcripts.
+class CurationSession:
+    def __init__(self, directory, stop_words, exclude_files, clustering=None):
+        self.corpus = open_corpus(directory, 'letters')
+        self.file_names = [filename for filename in self.corpus.rows if filename not in exclude_files]
+        preprocessed_texts = self.corpus.texts(self.file_names, stop_words)
+        self.stop_words = set(stop_words)
+        self.clustering = clustering or {}
+        # The TF-IDF weights are computed unnormalized and their row norms kept, so a stopword's term counts can be
+        # subtracted from them later
+        self.tfidf_vectorizer = make_vectorizer('tfidf').set_params(norm=None)
+        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(preprocessed_texts) if preprocessed_texts else None
+        self.terms = self.tfidf_vectorizer.get_feature_names_out() if preprocessed_texts else None
+        if self.tfidf_matrix is not None:
+            self.norms = row_norms(self.tfidf_matrix)
+            normalize(self.tfidf_matrix, copy=False)
+        # Labels and centroids of the previous round
+        self.labels = None
+        self.centers = None
+
+    # Function to drop the rows of transcripts that were saved to a topic
+    def exclude(self, exclude_files):
+        keep = np.array([filename not in exclude_files for filename in self.file_names], dtype=bool)
+        if keep.all():
+            return
+        self.tfidf_matrix = self.tfidf_matrix[keep]
+        self.norms = self.norms[keep]
+        self.file_names = [filename for filename, kept in zip(self.file_names, keep) if kept]
+        if self.labels is not None:
+            self.labels = self.labels[keep]
+
+    # Function to take new stopwords out of the TF-IDF matrix, in place. Stopwords are tokens, filtered before
+    # lemmatization: every occurrence of a new stopword is subtracted from the term count of its lemma, so 'running'
+    # leaves the 'run' and 'runs' occurrences of the column 'run'. Rows are L2-normalized again afterwards. With the
+    # IDF weights of the first round, the matrix is the one a fresh run with these stopwords would build.
+    def add_stopwords(self, stop_words):
+        new_stop_words = set(stop_words) - self.stop_words
+        self.stop_words.update(new_stop_words)
+        if self.tfidf_matrix is None:
+            return
+        # Token id of every new stopword -> index into columns, the column of its lemma
+        lemmas = self.corpus.lemma_table()
+        vocabulary = self.tfidf_vectorizer.vocabulary_
+        stopword_index = np.full(len(self.corpus.vocabulary), -1)
+        columns = []
+        for token_id in np.flatnonzero(np.isin(self.corpus.vocabulary, list(new_stop_words))):
+            lemma = lemmas.lemmatize(self.corpus.vocabulary[token_id])
+            if lemma in vocabulary:
+                stopword_index[token_id] = len(columns)
+                columns.append(vocabulary[lemma])
+        if not columns:
+            return
+        columns = np.array(columns)
+
+        matrix, idf = self.tfidf_matrix, self.tfidf_vectorizer.idf_
+        for row, filename in enumerate(self.file_names):
+            found = stopword_index[self.corpus.token_ids(filename)]
+            found = found[found >= 0]
+            if not len(found):
+                continue
+            # Subtract the stopword counts from the term counts of the row, which are its weights over the IDF
+            removed = np.bincount(columns[found], minlength=len(idf))
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            indices = matrix.indices[start:end]
+            counts = np.rint(matrix.data[start:end] * self.norms[row] / idf[indices]) - removed[indices]
+            weights = counts * idf[indices]
+            self.norms[row] = np.sqrt((weights ** 2).sum())
+            matrix.data[start:end] = weights / self.norms[row] if self.norms[row] else 0
+        matrix.eliminate_zeros()
+        if self.centers is not None:
+            emptied = np.setdiff1d(columns, matrix.indices)
+            self.centers[:, emptied] = 0
+
+    # Function to get the starting centroids of the next round: those of the previous round's clusters that still
+    # have transcripts, largest first, topped up with the transcripts farthest from all of them. None starts afresh.
+    def initial_centers(self, num_clusters):
+        if self.centers is None or self.clustering.get('svd_components'):
+            return None
+        remaining = np.bincount(self.labels, minlength=len(self.centers))
+        order = np.argsort(-remaining, kind='stable')
+        centers = self.centers[order[remaining[order] > 0][:num_clusters]]
+        if not len(centers):
+            return None
+        missing = num_clusters - len(centers)
+        if missing > 0:
+            distances = (row_norms(self.tfidf_matrix, squared=True)[:, None] - 2 * (self.tfidf_matrix @ centers.T)
+                         + (centers ** 2).sum(axis=1)[None, :]).min(axis=1)
+            farthest = np.argsort(-distances, kind='stable')[:missing]
+            centers = np.vstack([centers, self.tfidf_matrix[farthest].toarray()])
+        return centers
+
+    # Function to cluster the remaining transcripts, returns the topics and their files, None when none are left
+    def run(self, num_clusters):
+        if not self.file_names:
+            return None
+        km_model = cluster(self.tfidf_matrix, num_clusters, init=self.initial_centers(num_clusters), **self.clustering)
+        self.labels, self.centers = km_model.labels_, np.array(km_model.cluster_centers_)
+        topics_to_files, _ = label_topics(km_model, self.terms, self.file_names)
+        return topics_to_files
+# Prompt the user to select topics to save and update an existing JSON file with the selected topics.
+# When the SQLite catalog exists only the new assignments are written to it instead.
+def select_and_save_topics(topics_to_files, selected_topics_file, catalog_database=None):
     print("\nIdentified Topics:")
     for topic, filenames in topics_to_files.items():
         print(f"Topic '{topic}':")
@@ -64,6 +139,10 @@ def select_and_save_topics(topics_to_files, selected_topics_file):
     selected_topics_input = input("\nEnter the topic names you wish to save, separated by comma (,): ")
     selected_topics = selected_topics_input.split(",")
 
+    if catalog_database and os.path.exists(catalog_database):
+        selected = {topic.strip(): topics_to_files[topic.strip()] for topic in selected_topics if topic.strip() in topics_to_files}
+        return add_assignments(catalog_database, selected)
+
     # Initialize existing_data as an empty dict
     existing_data = {}
     # Check if the file exists and is not empty before attempting to read it
@@ -101,8 +180,13 @@ def update_stopwords(stop_words_file):
         print("Stopwords updated.")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cluster the transcripts into topics and save the topics you select")
+    add_clustering_arguments(parser)
+    args = parser.parse_args()
+
     directory = '../../../data/transcripts/cleanedtranscripts' # Directory of the transcripts to be processed
     selected_topics_file = '../../../data/mappedtopics/selectedtopics.json' # File to store selected topics (clusters) and their corresponding files
+    catalog_database = '../../../data/mappedtopics/catalog.db' # SQLite catalog used instead of the JSON file once flask-server/catalogdb.py has imported it
     stop_words_file = 'customstopwords.txt' # File to store custom stopwords (appended to nltk's stopwords), delete this file before running script for the first time
 
     if not os.path.exists(selected_topics_file): # Create an empty file for selected topics (clusters) if it doesn't exist
@@ -120,21 +204,23 @@ if __name__ == '__main__':
         stop_words = set(file.read().splitlines())
 
     excluded_files = set()
-    if os.path.exists(selected_topics_file):
+    if os.path.exists(catalog_database):
+        excluded_files.update(assigned_filenames(catalog_database))
+    elif os.path.exists(selected_topics_file):
         with open(selected_topics_file, 'r', encoding='utf-8') as f:
             for files in json.load(f).values():
                 excluded_files.update(files)
 
     num_clusters = int(input("Enter the number of topics you wish to generate: "))
+    session = CurationSession(directory, stop_words, excluded_files, clustering_options(args))
     while True:
-        preprocessed_texts, file_names = load_and_preprocess_transcripts(directory, stop_words, excluded_files)
-        if not preprocessed_texts:
+        topics_to_files = session.run(num_clusters)
+        if topics_to_files is None:
             print("No more transcripts to process.")
             break
 
-        topics_to_files = run_topic_modeling(preprocessed_texts, num_clusters)
-
-        excluded_files.update(select_and_save_topics(topics_to_files, selected_topics_file))
+        excluded_files.update(select_and_save_topics(topics_to_files, selected_topics_file, catalog_database))
+        session.exclude(excluded_files)
 
         continue_processing = input("\nDo you want to continue with the remaining transcripts? (yes/no): ").lower()
         if continue_processing != "yes":
@@ -152,3 +238,4 @@ if __name__ == '__main__':
 
         with open(stop_words_file, 'r', encoding='utf-8') as file:
             stop_words = set(file.read().splitlines())
+        session.add_stopwords(stop_words)
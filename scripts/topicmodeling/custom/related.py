@@ -0,0 +1,81 @@
+import json
+import os
+import struct
+import sys
+import numpy as np
+from nltk.corpus import stopwords
+# custom.py downloads the NLTK stopwords and puts the shared topic modeling modules on the path
+from custom import load_and_preprocess_transcripts
+from vectorizers import make_vectorizer
+
+# Layout shared with flask-server/relatedindex.py, which serves the result
+RELATED_FILE = 'related.bin'
+INDEX_FILE = 'related.index.json'
+RELATED_MAGIC = b'REL1'
+RELATED_HEADER = struct.Struct('<4sII')
+
+# Number of related recordings stored per recording
+NEIGHBOURS = 10
+# Rows multiplied at once. A block of similarities takes block size x recordings x 4 bytes of memory.
+BLOCK_SIZE = 512
+
+# Compute the top-k cosine neighbours of every row of an L2-normalized sparse matrix. The similarities are computed
+# one block of rows at a time (a sparse product with the whole matrix), so memory stays at one dense block.
+def top_k_neighbours(matrix, k, block_size=BLOCK_SIZE):
+    count = matrix.shape[0]
+    k = min(k, max(count - 1, 0))
+    neighbours = np.full((count, k), -1, dtype=np.int32)
+    scores = np.zeros((count, k), dtype=np.float32)
+    if k == 0:
+        return neighbours, scores
+    transposed = matrix.T.tocsc()
+    for start in range(0, count, block_size):
+        end = min(start + block_size, count)
+        similarities = (matrix[start:end] @ transposed).toarray()
+        rows = np.arange(end - start)
+        similarities[rows, rows + start] = -1.0  # a recording is not related to itself
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        # Recordings that share no terms are not related
+        top[top_scores <= 0] = -1
+        neighbours[start:end] = top
+        scores[start:end] = np.maximum(top_scores, 0)
+    return neighbours, scores
+
+# Save the neighbours as int32 rows and their similarities as float16, plus the recording id of every row
+def save_related(recordings, neighbours, scores, store_directory):
+    os.makedirs(store_directory, exist_ok=True)
+    related_path = os.path.join(store_directory, RELATED_FILE)
+    index_path = os.path.join(store_directory, INDEX_FILE)
+    with open(related_path + '.tmp', 'wb') as file:
+        file.write(RELATED_HEADER.pack(RELATED_MAGIC, len(recordings), neighbours.shape[1]))
+        file.write(neighbours.astype('<i4').tobytes())
+        file.write(scores.astype('<f2').tobytes())
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump({'recordings': recordings}, file)
+    os.replace(related_path + '.tmp', related_path)
+    os.replace(index_path + '.tmp', index_path)
+
+if __name__ == '__main__':
+    # Usage: python related.py [neighbours per recording]
+    directory = '../../../data/transcripts/cleanedtranscripts' # Directory of the transcripts to be processed
+    store_directory = '../../../data/transcripts/store' # Directory the server reads its indexes from
+    stop_words_file = 'customstopwords.txt' # Stopwords written by custom.py, nltk's stopwords until custom.py has run
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else NEIGHBOURS
+
+    if os.path.exists(stop_words_file):
+        with open(stop_words_file, 'r', encoding='utf-8') as file:
+            stop_words = set(file.read().splitlines())
+    else:
+        stop_words = set(stopwords.words('english'))
+
+    # Same preprocessing and TF-IDF vectors as custom.py's topic modeling, over every transcript
+    preprocessed_texts, file_names = load_and_preprocess_transcripts(directory, stop_words, set())
+    tfidf_matrix = make_vectorizer('tfidf').fit_transform(preprocessed_texts)
+    neighbours, scores = top_k_neighbours(tfidf_matrix.tocsr(), k)
+    recordings = [os.path.splitext(file_name)[0] for file_name in file_names]
+    save_related(recordings, neighbours, scores, store_directory)
+    print(f"Related recordings complete. {neighbours.shape[1]} neighbours of {len(recordings)} recordings were saved.")
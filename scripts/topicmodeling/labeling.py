@@ -0,0 +1,65 @@
+import json
+import os
+from collections import defaultdict
+import numpy as np
+
+# Top terms kept per cluster, for its label and the cluster details file
+TOP_TERMS = 10
+# Joins the top term and the second term of a label. Not a comma: custom.py reads the topics to save as a comma
+# separated list.
+LABEL_SEPARATOR = ' / '
+
+# Function to get the top terms of every centroid as (term indices, weights), each row sorted by weight, highest
+# first. argpartition finds the top n without sorting the whole vocabulary, only those n are sorted.
+def top_terms(centers, n=TOP_TERMS):
+    centers = np.asarray(centers)
+    n = min(n, centers.shape[1])
+    top = np.argpartition(-centers, n - 1, axis=1)[:, :n]
+    weights = np.take_along_axis(centers, top, axis=1)
+    order = np.argsort(-weights, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(weights, order, axis=1)
+
+# Function to give every cluster a unique label. A cluster is labeled by its top term. When clusters share a top
+# term, each of them (largest first) adds its highest weighted other term that none of the others added, e.g.
+# 'music / guitar' and 'music / opera'. A cluster with no such term left is told apart by its cluster id.
+def label_clusters(term_indices, weights, terms, sizes):
+    labels = [terms[indices[0]] for indices in term_indices]
+    groups = defaultdict(list)
+    for cluster_id in np.argsort(-np.asarray(sizes), kind='stable'):
+        groups[labels[cluster_id]].append(cluster_id)
+    for label, group in groups.items():
+        if len(group) == 1:
+            continue
+        used = {label}
+        for cluster_id in group:
+            for index, weight in zip(term_indices[cluster_id][1:], weights[cluster_id][1:]):
+                if weight > 0 and terms[index] not in used:
+                    used.add(terms[index])
+                    labels[cluster_id] = label + LABEL_SEPARATOR + terms[index]
+                    break
+            else:
+                labels[cluster_id] = f"{label} ({cluster_id})"
+    return labels
+
+# Function to map every cluster's label to the files of the cluster, in cluster order. Returns (topics_to_files,
+# clusters), where clusters holds the cluster id, label, size and top terms with their weights of every cluster.
+def label_topics(km_model, terms, file_names, n=TOP_TERMS):
+    term_indices, weights = top_terms(km_model.cluster_centers_, n)
+    sizes = np.bincount(km_model.labels_, minlength=len(term_indices))
+    labels = label_clusters(term_indices, weights, terms, sizes)
+
+    topics_to_files = {label: [] for label in labels}
+    for file_name, cluster_id in zip(file_names, km_model.labels_):
+        topics_to_files[labels[cluster_id]].append(file_name)
+    clusters = [{'cluster': cluster_id, 'label': label, 'size': int(sizes[cluster_id]),
+                 'terms': [[str(terms[index]), round(float(weight), 6)] for index, weight in zip(term_indices[cluster_id], weights[cluster_id])]}
+                for cluster_id, label in enumerate(labels)]
+    return topics_to_files, clusters
+
+# Function to write a topic mapping file (label -> files, read by the plot scripts) and next to it the cluster
+# details (<name>.clusters.json)
+def save_topics(topics_to_files, clusters, mapping_path):
+    with open(mapping_path, 'w', encoding='utf-8') as f:
+        json.dump(topics_to_files, f, ensure_ascii=False, indent=4)
+    with open(os.path.splitext(mapping_path)[0] + '.clusters.json', 'w', encoding='utf-8') as f:
+        json.dump(clusters, f, ensure_ascii=False, indent=4)
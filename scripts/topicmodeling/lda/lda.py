@@ -1,71 +1,108 @@
 import os
-import re
+import sys
 import json
+import argparse
 from gensim import corpora
-import gensim
+from gensim.models import LdaMulticore, Phrases
+from gensim.models.phrases import FrozenPhrases
 # Necessary NLTK resources are downloaded automatically
-nltk.download('punkt')  # for the word_tokenize function
+import nltk
 nltk.download('stopwords')  # for stopwords
-nltk.download('wordnet')  # for the WordNet Lemmatizer
 from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
-from gensim.models import Phrases
-from gensim.models.phrases import Phraser
-
-def minimal_preprocess(text):
-    cleaned_text = re.sub(r'.*<NA>\s?', '', text)
-    cleaned_text = re.sub('<unk>', ' ', cleaned_text)
-    cleaned_text = re.sub(r'\b\w{1,2}\b', '', cleaned_text)
-    cleaned_text = re.sub('[^A-Za-z]+', ' ', cleaned_text)
-    tokens = word_tokenize(cleaned_text.lower())
-    return tokens
+# The shared preprocessed corpus lives one directory up
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from corpus import open_corpus
+
+# Directory of the phrase model, dictionary and serialized Bag-of-Words corpus. They are reused by the next run
+# as long as the transcripts have not changed.
+MODEL_DIRECTORY = 'ldamodel'
+PHRASES_FILE = 'phrases.model'
+DICTIONARY_FILE = 'dictionary.dict'
+BOW_FILE = 'corpus.mm'
+# Digest of the transcript corpus and filenames (one per BoW row) the files above were built from
+BUILD_FILE = 'build.json'
+
+# Re-iterable stream of the transcripts' token lists. The phrase model and the dictionary each take a pass over the
+# transcripts, and only one transcript is held in memory at a time.
+class TranscriptStream:
+    def __init__(self, corpus, file_names, process=None):
+        self.corpus = corpus
+        self.file_names = file_names
+        self.process = process
+
+    def __iter__(self):
+        for tokens in self.corpus.stream(self.file_names, lemmatize=False):
+            yield self.process(tokens) if self.process else tokens
 
 def train_phrases(transcripts):
-    # Train the Phrases model to detect common phrases (bigrams or more)
+    # Train the Phrases model to detect common phrases (bigrams or more), frozen to keep only what it needs to
+    # merge them
     phrases = Phrases(transcripts, min_count=5, threshold=10)
-    bigram = Phraser(phrases)
+    bigram = phrases.freeze()
     return bigram
 
-def preprocess(tokens, bigram_model):
+def preprocess(tokens, bigram_model, stop_words, lemmas):
     # Apply the Phrases model to merge detected phrases into single tokens
     tokens_with_phrases = bigram_model[tokens]
-    # Continue with your preprocessing (stopwords removal, lemmatization, etc.)
-    stop_words = set(stopwords.words('english'))
-    lemmatizer = WordNetLemmatizer()
-    processed_tokens = [lemmatizer.lemmatize(w) for w in tokens_with_phrases if w not in stop_words]
+    # Continue with your preprocessing (stopwords removal, lemmatization, etc.), each distinct word is lemmatized
+    # once through the corpus' lemma table
+    processed_tokens = [lemmas.lemmatize(w) for w in tokens_with_phrases if w not in stop_words]
     return processed_tokens
 
-def load_and_preprocess_transcripts(directory):
-    # First pass: collect minimally processed transcripts for phrase model training
-    minimal_transcripts = []
-    file_names = []
-    for filename in os.listdir(directory):
-        if filename.endswith('.stm'):
-            file_path = os.path.join(directory, filename)
-            with open(file_path, 'r', encoding='utf-8') as file:
-                text = file.read()
-                minimal_tokens = minimal_preprocess(text)
-                minimal_transcripts.append(minimal_tokens)
-                file_names.append(filename)
-    
-    bigram_model = train_phrases(minimal_transcripts)
-    
-    processed_transcripts = [preprocess(tokens, bigram_model) for tokens in minimal_transcripts]
-    
-    return processed_transcripts, file_names
+# Function to read the build of the files in the model directory, None if they are missing
+def load_build(model_directory):
+    try:
+        with open(os.path.join(model_directory, BUILD_FILE), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+# Function to get the dictionary, the Bag-of-Words corpus (streamed from disk) and the filename of every BoW row.
+# The minimally processed transcripts come from the shared corpus; the phrase model is trained on them in one pass,
+# then every transcript is phrased, filtered, lemmatized and written to the serialized corpus in a second pass.
+def load_bow_corpus(directory, model_directory):
+    corpus = open_corpus(directory, 'transcript')
+    build = load_build(model_directory)
+    if build and build.get('digest') == corpus.digest:
+        dictionary = corpora.Dictionary.load(os.path.join(model_directory, DICTIONARY_FILE))
+        return dictionary, corpora.MmCorpus(os.path.join(model_directory, BOW_FILE)), build['file_names']
+
+    os.makedirs(model_directory, exist_ok=True)
+    file_names = list(corpus.rows)
+    bigram_model = train_phrases(TranscriptStream(corpus, file_names))
+    bigram_model.save(os.path.join(model_directory, PHRASES_FILE))
+
+    stop_words = set(stopwords.words('english'))
+    lemmas = corpus.lemma_table()
+    transcripts = TranscriptStream(corpus, file_names, lambda tokens: preprocess(tokens, bigram_model, stop_words, lemmas))
+    dictionary = corpora.Dictionary() #Maps each unique token (word) in the transcripts to a unique integer ID, filled while the transcripts are converted below. Necessary for converting the transcripts into a numerical format that can be used for LDA analysis.
+    bow_path = os.path.join(model_directory, BOW_FILE)
+    corpora.MmCorpus.serialize(bow_path, (dictionary.doc2bow(text, allow_update=True) for text in transcripts)) #Converts each transcript into the Bag-of-Words (BoW) format and writes it to disk. The BoW model represents each document as a vector of token frequencies, ignoring the order of words but maintaining the information about word occurrences. doc2bow converts the transcript into a sparse representation of the token IDs and their frequencies in the document.
+    dictionary.save(os.path.join(model_directory, DICTIONARY_FILE))
+    lemmas.save()
+    with open(os.path.join(model_directory, BUILD_FILE), 'w', encoding='utf-8') as file:
+        json.dump({'digest': corpus.digest, 'file_names': file_names}, file)
+    return dictionary, corpora.MmCorpus(bow_path), file_names
+
+# Function to load the phrase model saved by the last run, to merge phrases in new text the same way
+def load_phrases(model_directory=MODEL_DIRECTORY):
+    return FrozenPhrases.load(os.path.join(model_directory, PHRASES_FILE))
 
 if __name__ == '__main__':  
-    directory = '../../../data/transcripts/cleanedtranscripts'
-    transcripts, file_names = load_and_preprocess_transcripts(directory)
+    parser = argparse.ArgumentParser(description="Find topics in the transcripts with LDA")
+    parser.add_argument('--topics', type=int, default=300, help="number of topics (default: 300)")
+    parser.add_argument('--passes', type=int, default=15, help="passes over the corpus (default: 15)")
+    parser.add_argument('--workers', type=int, default=None, help="training processes (default: one less than the number of cores)")
+    parser.add_argument('--chunksize', type=int, default=2000, help="transcripts per training chunk (default: 2000)")
+    args = parser.parse_args()
 
-    dictionary = corpora.Dictionary(transcripts) #Creates a Gensim dictionary from the transcripts. This dictionary maps each unique token (word) in the transcripts to a unique integer ID. Necessary for converting the transcripts into a numerical format that can be used for LDA analysis.
-    corpus = [dictionary.doc2bow(text) for text in transcripts] #Converts each transcript into the Bag-of-Words (BoW) format using the previously created dictionary. The BoW model represents each document as a vector of token frequencies, ignoring the order of words but maintaining the information about word occurrences. doc2bow converts the transcript into a sparse representation of the token IDs and their frequencies in the document.
+    directory = '../../../data/transcripts/cleanedtranscripts'
+    dictionary, corpus, file_names = load_bow_corpus(directory, MODEL_DIRECTORY)
 
-    ldamodel = gensim.models.ldamodel.LdaModel(corpus, num_topics=300, id2word=dictionary, passes=15) #Initializes and trains the LDA model on the corpus. This model will try to find 300 topics in the corpus. The id2word parameter is the dictionary that maps IDs to tokens, necessary for interpreting the topics. The passes parameter defines how many times the model iterates over the entire corpus during training, with more passes potentially leading to a better model at the cost of longer training time. 
+    ldamodel = LdaMulticore(corpus, num_topics=args.topics, id2word=dictionary, passes=args.passes, workers=args.workers, chunksize=args.chunksize) #Trains the LDA model on the corpus, streamed from disk one chunk at a time by several worker processes. This model will try to find 300 topics (--topics) in the corpus. The id2word parameter is the dictionary that maps IDs to tokens, necessary for interpreting the topics. The passes parameter defines how many times the model iterates over the entire corpus during training, with more passes potentially leading to a better model at the cost of longer training time. 
 
     # Extracting the most significant topic for each transcript and assigning that topic to the transcript 
-    topic_assignments = {file_names[i]: max(ldamodel[corpus[i]], key=lambda x: x[1])[0] for i in range(len(file_names))}
+    topic_assignments = {file_name: max(ldamodel[bow], key=lambda x: x[1])[0] for file_name, bow in zip(file_names, corpus)}
 
     # Generate full topic descriptions (to print/see the words in each topic, not just topic id))
     full_topic_descriptions = {i: ldamodel.show_topic(i) for i in range(ldamodel.num_topics)}
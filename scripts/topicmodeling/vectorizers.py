@@ -0,0 +1,15 @@
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Document weightings of the KMeans topic scripts, as TfidfVectorizer settings. Both give a sparse CSR matrix
+# built in one pass over the texts, which KMeans clusters without densifying.
+WEIGHTINGS = {
+    # TF-IDF, every row L2-normalized (custom.py, tfidfkmeansstopwords.py)
+    'tfidf': {},
+    # IDF only (idfwithkmeans.py): every term a document contains weighs its IDF, however often it occurs. This is
+    # the binary occurrence matrix times the IDF diagonal, rows are not normalized.
+    'idf': {'binary': True, 'norm': None},
+}
+
+# Function to create the vectorizer of a weighting
+def make_vectorizer(weighting):
+    return TfidfVectorizer(**WEIGHTINGS[weighting])